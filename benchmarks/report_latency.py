@@ -0,0 +1,54 @@
+"""Report latency: default connection vs read-optimized connection.
+
+Usage: python benchmarks/report_latency.py my.db [report_name ...]
+
+Cold latency is the first report on a new connection (empty page
+cache). Warm latency is the best of several runs on the same
+connection.
+"""
+
+import sys
+import time
+
+from hbreports import db
+from hbreports.reports import GENERATORS
+
+
+_WARM_RUNS = 5
+
+
+def _measure(engine, report_gen):
+    with engine.connect() as dbc:
+        start = time.perf_counter()
+        report_gen.generate_report(dbc)
+        cold = time.perf_counter() - start
+        warm = []
+        for _ in range(_WARM_RUNS):
+            start = time.perf_counter()
+            report_gen.generate_report(dbc)
+            warm.append(time.perf_counter() - start)
+    return cold, min(warm)
+
+
+def main():
+    db_path = sys.argv[1]
+    names = sys.argv[2:] or sorted(GENERATORS)
+    profiles = [
+        ('default', lambda: db.init_db(db_path)),
+        ('readonly', lambda: db.open_readonly_db(db_path)),
+        ('immutable', lambda: db.open_readonly_db(db_path, immutable=True)),
+    ]
+    print(f'{"report":8}{"profile":12}{"cold, ms":>10}{"warm, ms":>10}')
+    for name in names:
+        for profile_name, open_engine in profiles:
+            engine = open_engine()
+            try:
+                cold, warm = _measure(engine, GENERATORS[name]())
+            finally:
+                engine.dispose()
+            print(f'{name:8}{profile_name:12}'
+                  f'{cold * 1000:10.1f}{warm * 1000:10.1f}')
+
+
+if __name__ == '__main__':
+    main()
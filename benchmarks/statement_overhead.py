@@ -0,0 +1,99 @@
+"""Statement overhead: built and compiled per call vs cached.
+
+Usage: python benchmarks/statement_overhead.py
+
+Measures per-call time of the smallest units that pay for statement
+building and compilation: a transaction insert (import runs it for
+every transaction) and reports on a tiny database (queries take
+almost no time, so the rest is overhead). "per call" clears the
+caches before every call, which is how it worked before statements
+were cached.
+"""
+
+import datetime
+import time
+
+from hbreports import db, derived, pivot, reports, statements
+from hbreports.common import TxnStatus
+from hbreports.reports import GENERATORS
+
+
+_INSERTS = 10000
+_REPORT_RUNS = 200
+
+
+def _insert_params(i):
+    return {'date': datetime.date(2019, 1, 1) + datetime.timedelta(i % 365),
+            'account_id': 1,
+            'status': TxnStatus.RECONCILED,
+            'payee_id': None,
+            'memo': f'memo {i}',
+            'info': None,
+            'paymode': 0}
+
+
+def _measure_inserts(dbc):
+    start = time.perf_counter()
+    for i in range(_INSERTS):
+        dbc.execute(db.txn.insert().values(**_insert_params(i)))
+    per_call = time.perf_counter() - start
+
+    statement = db.txn.insert()
+    start = time.perf_counter()
+    for i in range(_INSERTS):
+        statements.execute(dbc, statement, _insert_params(i))
+    cached = time.perf_counter() - start
+    return per_call / _INSERTS, cached / _INSERTS
+
+
+def _clear_caches():
+    reports._STATEMENTS.clear()
+    pivot._pivot_query.cache_clear()
+    statements._compiled_cache.clear()
+
+
+def _measure_report(dbc, report_gen):
+    report_gen.generate_report(dbc)
+    start = time.perf_counter()
+    for _ in range(_REPORT_RUNS):
+        _clear_caches()
+        report_gen.generate_report(dbc)
+    per_call = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(_REPORT_RUNS):
+        report_gen.generate_report(dbc)
+    cached = time.perf_counter() - start
+    return per_call / _REPORT_RUNS, cached / _REPORT_RUNS
+
+
+def main():
+    engine = db.init_db()
+    try:
+        with engine.connect() as dbc:
+            dbc.execute(db.currency.insert().values(id=1, name='c'))
+            dbc.execute(db.account.insert().values(
+                id=1, name='a', currency_id=1))
+            with dbc.begin():
+                timings = [('txn insert', *_measure_inserts(dbc))]
+            # A few splits: reports run on (almost) no data
+            dbc.execute(db.split.insert(), [
+                {'txn_id': txn_id, 'amount': -1.0, 'category_id': None,
+                 'memo': None}
+                for txn_id in range(1, 21)])
+            dbc.execute(db.txn.delete().where(db.txn.c.id > 20))
+            derived.refresh(dbc)
+            for name in sorted(GENERATORS):
+                timings.append(
+                    (f'report {name}', *_measure_report(
+                        dbc, GENERATORS[name]())))
+    finally:
+        engine.dispose()
+
+    print(f'{"call":14}{"per call, us":>14}{"cached, us":>12}')
+    for name, per_call, cached in timings:
+        print(f'{name:14}{per_call * 1e6:14.1f}{cached * 1e6:12.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""Approximate reports.
+
+Approximate reports are computed from a stratified sample of splits
+(split_sample table, see hbreports.derived) instead of all splits.
+Strata are (account, year). A fixed share of every stratum is sampled
+(but no less than a few splits, small strata are taken whole), so
+every account and year is represented.
+
+Sampled split with weight w stands for w splits. Sum of amounts is
+estimated as sum(amount * w) (Horvitz-Thompson estimator) with
+variance sum(amount^2 * w * (w - 1)). Both are plain sums, so any
+group of splits (report cell) gets its estimate and error with the
+same GROUP BY as the exact report. Cells of sums are summed up with
+their variances.
+
+Error is a bound of approximately 95% confidence interval.
+"""
+
+import math
+
+from hbreports.tables import Estimate
+
+
+# Normal distribution quantile for 95% confidence
+_Z_95 = 1.96
+
+
+def weighted_amount(splits):
+    """Get SQL expression: estimate of amount sum (sum it up).
+
+    :param splits: split_sample table (or its alias)
+    """
+    return splits.c.amount * splits.c.weight
+
+
+def amount_variance(splits):
+    """Get SQL expression: variance of estimate (sum it up).
+
+    :param splits: split_sample table (or its alias)
+    """
+    return (splits.c.amount * splits.c.amount
+            * splits.c.weight * (splits.c.weight - 1))
+
+
+def to_estimate(value, variance):
+    """Build Estimate from value and its variance."""
+    # Rounding errors may give a tiny negative variance
+    return Estimate(value, _Z_95 * math.sqrt(max(variance, 0.0)))
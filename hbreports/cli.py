@@ -1,13 +1,33 @@
 """Command line interface for hbreports."""
 
 import argparse
+import contextlib
+import datetime
+import inspect
 import os.path
 import sys
 
 from hbreports import db
-from hbreports.hbfile import initial_import, DataImportError
-from hbreports.reports import AnnualBalanceByCategory, TxnsByAccount
+from hbreports.common import Paymode, TxnStatus
+from hbreports.consolidate import import_many
+from hbreports.explain import explain_report, format_plans
+from hbreports import export, memprofile, partitions
+from hbreports.filters import ReportFilter
+from hbreports.hbfile import (
+    PARSERS,
+    DataImportError,
+    checkpointed_import,
+    initial_import,
+    open_xhb,
+    read_import_state,
+)
+from hbreports.parallel import generate_many_sync
+from hbreports.partitions import PartitionError, partition_db
+from hbreports.reports import DIMENSIONS, GENERATORS
 from hbreports.render import PlainTextRenderer
+from hbreports.search import SearchError, TxnSearch
+from hbreports.snapshot import write_snapshot
+from hbreports.watch import FileWatcher
 
 
 def handle_import_command(args):
@@ -16,18 +36,74 @@ def handle_import_command(args):
         sys.exit('Cannot perform import. '
                  f'HomeBank file "{args.xhb_path}" not found.')
 
+    if args.resume:
+        if not os.path.exists(args.db_path):
+            sys.exit('Cannot resume import. '
+                     f'Database file "{args.db_path}" not found.')
+    elif os.path.exists(args.db_path):
+        sys.exit('Cannot perform import. '
+                 f'Database file "{args.db_path}" already exists')
+
+    engine = db.init_db(args.db_path)
+    if args.resume:
+        with engine.connect() as dbc:
+            version = db.read_schema_version(dbc)
+        if version != db.SCHEMA_VERSION:
+            engine.dispose()
+            sys.exit('Cannot resume import. '
+                     f'Database file "{args.db_path}" was created by'
+                     ' another version of hbreports.')
+    try:
+        with _memory_profile(args), memprofile.phase('import'):
+            checkpointed_import(args.xhb_path, engine,
+                                resume=args.resume, parser=args.parser)
+    except DataImportError as exc:
+        with engine.connect() as dbc:
+            state = read_import_state(dbc)
+        engine.dispose()
+        message = 'Import failed: ' + str(exc)
+        if state is None:
+            if not args.resume:
+                # there's no point keeping this empty db
+                os.remove(args.db_path)
+        elif not state.complete:
+            message += (f' Imported elements: {state.elements}.'
+                        ' Run import with --resume to continue.')
+        sys.exit(message)
+    engine.dispose()
+
+
+def handle_import_many_command(args):
+    """Handle "import-many" command."""
+    for xhb_path in args.xhb_paths:
+        if not os.path.exists(xhb_path):
+            sys.exit('Cannot perform import. '
+                     f'HomeBank file "{xhb_path}" not found.')
+
     if os.path.exists(args.db_path):
         sys.exit('Cannot perform import. '
                  f'Database file "{args.db_path}" already exists')
 
     engine = db.init_db(args.db_path)
     try:
-        with engine.begin() as dbc, open(args.xhb_path) as f:
-            initial_import(f, dbc)
+        with engine.begin() as dbc:
+            import_many(args.xhb_paths, dbc, max_workers=args.jobs)
     except DataImportError as exc:
-        # there's no point keeping this empty db
+        engine.dispose()
         os.remove(args.db_path)
         sys.exit('Import failed: ' + str(exc))
+    with engine.connect() as dbc:
+        db.checkpoint_wal(dbc, truncate=True)
+    engine.dispose()
+
+
+def _import_xhb(xhb_path, engine):
+    """Import HomeBank file to database.
+
+    :raises DataImportError:
+    """
+    with engine.begin() as dbc, open_xhb(xhb_path) as f:
+        initial_import(f, dbc)
 
 
 def handle_report_command(args):
@@ -37,21 +113,411 @@ def handle_report_command(args):
         sys.exit("Can't generate a report. "
                  f'Database file "{args.db_path}" not found.')
 
-    engine = db.init_db(args.db_path)
-
-    # TODO: factory
-    # TODO: apply report params
-    if args.report_name == 'tta':
-        report_gen = TxnsByAccount()
-    elif args.report_name == 'abc':
-        report_gen = AnnualBalanceByCategory()
-    else:
-        sys.exit(f'Unknown report "{args.report_name}"')
-    with engine.begin() as db_connection:
-        report = report_gen.generate_report(db_connection)
+    report_gens = [_create_report_generator(name, args)
+                   for name in args.report_names]
+    _exit_if_incomplete(args.db_path, "Can't generate a report.")
+    try:
+        if args.memprofile:
+            _profile_reports(args, report_gens)
+            return
+        reports = generate_many_sync(
+            args.db_path, report_gens,
+            processes=args.processes,
+            max_workers=args.jobs,
+            immutable=args.immutable,
+            shards=args.shards)
+    except PartitionError as exc:
+        sys.exit("Can't generate a report. " + str(exc))
     # TODO: select renderer
     renderer = PlainTextRenderer(sys.stdout)
-    renderer.render(report)
+    for report in reports:
+        renderer.render(report)
+
+
+def _profile_reports(args, report_gens):
+    """Generate and render reports one by one with memory profiling.
+
+    Reports are not generated concurrently: phases of concurrent
+    reports would overlap.
+    """
+    renderer = PlainTextRenderer(sys.stdout)
+    engine = db.open_readonly_db(args.db_path, immutable=args.immutable)
+    try:
+        with _memory_profile(args), engine.connect() as dbc:
+            for name, report_gen in zip(args.report_names, report_gens):
+                with memprofile.phase(f'report {name}'):
+                    report = partitions.generate_report(dbc, report_gen)
+                with memprofile.phase(f'render {name}'):
+                    renderer.render(report)
+    finally:
+        engine.dispose()
+
+
+@contextlib.contextmanager
+def _memory_profile(args):
+    """Profile memory phases (see memprofile.phase) if requested.
+
+    Writes results and exits if memory budget is exceeded.
+    """
+    if not args.memprofile:
+        yield
+        return
+    with memprofile.MemoryProfiler() as profiler:
+        yield
+    with open(args.memprofile, 'w') as f:
+        profiler.write_json(f)
+    if args.memory_budget is not None:
+        message = memprofile.check_budget(profiler, args.memory_budget)
+        if message is not None:
+            sys.exit(message)
+
+
+def _exit_if_incomplete(db_path, message):
+    """Exit if database import was interrupted.
+
+    Data of such database is partial, so are any results. Databases
+    of other versions can't be read at all.
+    """
+    engine = db.open_readonly_db(db_path)
+    try:
+        with engine.connect() as dbc:
+            version = db.read_schema_version(dbc)
+            state = read_import_state(dbc)
+    finally:
+        engine.dispose()
+    if version != db.SCHEMA_VERSION:
+        sys.exit(f'{message} Database file "{db_path}" was created by'
+                 ' another version of hbreports. Import data again.')
+    if state is not None and not state.complete:
+        sys.exit(f'{message} Import to database file "{db_path}"'
+                 ' is not complete. Run import with --resume.')
+
+
+def _attach_partitions(dbc, message):
+    """Attach all partitions of partitioned database or exit.
+
+    See hbreports.partitions.
+    """
+    try:
+        partitions.attach(dbc)
+    except PartitionError as exc:
+        sys.exit(f'{message} {exc}')
+
+
+def handle_partition_command(args):
+    """Handle "partition" command."""
+    if not os.path.exists(args.db_path):
+        sys.exit("Can't partition a database. "
+                 f'Database file "{args.db_path}" not found.')
+
+    _exit_if_incomplete(args.db_path, "Can't partition a database.")
+    try:
+        partition_db(args.db_path, years_per_file=args.years_per_file)
+    except (PartitionError, ValueError) as exc:
+        sys.exit("Can't partition a database. " + str(exc))
+
+
+def handle_search_command(args):
+    """Handle "search" command."""
+    if not os.path.exists(args.db_path):
+        sys.exit("Can't search. "
+                 f'Database file "{args.db_path}" not found.')
+
+    _exit_if_incomplete(args.db_path, "Can't search.")
+    report_gen = TxnSearch(args.query,
+                           limit=args.limit,
+                           offset=args.offset)
+    engine = db.open_readonly_db(args.db_path)
+    try:
+        with engine.connect() as dbc:
+            _attach_partitions(dbc, "Can't search.")
+            report = report_gen.generate_report(dbc)
+    except SearchError as exc:
+        sys.exit('Search failed: ' + str(exc))
+    finally:
+        engine.dispose()
+    PlainTextRenderer(sys.stdout).render(report)
+
+
+def handle_snapshot_command(args):
+    """Handle "snapshot" command."""
+    if not os.path.exists(args.db_path):
+        sys.exit("Can't create a snapshot. "
+                 f'Database file "{args.db_path}" not found.')
+
+    _exit_if_incomplete(args.db_path, "Can't create a snapshot.")
+    engine = db.open_readonly_db(args.db_path)
+    try:
+        with engine.connect() as dbc:
+            _attach_partitions(dbc, "Can't create a snapshot.")
+            write_snapshot(dbc, args.snapshot_path)
+    finally:
+        engine.dispose()
+
+
+def handle_export_command(args):
+    """Handle "export" command."""
+    if not os.path.exists(args.db_path):
+        sys.exit("Can't export. "
+                 f'Database file "{args.db_path}" not found.')
+
+    _exit_if_incomplete(args.db_path, "Can't export.")
+    engine = db.open_readonly_db(args.db_path)
+    try:
+        with engine.connect() as dbc:
+            _attach_partitions(dbc, "Can't export.")
+            if args.output is None:
+                export.export(dbc, args.table, sys.stdout, args.format)
+            else:
+                with open(args.output, 'w', encoding='utf-8',
+                          newline='') as f:
+                    export.export(dbc, args.table, f, args.format)
+    finally:
+        engine.dispose()
+
+
+def handle_watch_command(args):
+    """Handle "watch" command.
+
+    Import HomeBank file and show reports. Then repeat every time the
+    file is saved. Runs until interrupted.
+    """
+    if not os.path.exists(args.xhb_path):
+        sys.exit("Can't watch. "
+                 f'HomeBank file "{args.xhb_path}" not found.')
+
+    report_gens = {name: _create_report_generator(name, args)
+                   for name in args.report_names}
+    renderer = PlainTextRenderer(sys.stdout)
+    # Last rendered rows by report name
+    rendered = {}
+    engine = None
+    with FileWatcher(args.xhb_path, interval=args.interval) as watcher:
+        try:
+            while True:
+                try:
+                    new_engine = _reimport(args.xhb_path, args.db_path)
+                except DataImportError as exc:
+                    # Keep showing old results. The file is probably
+                    # being written right now.
+                    print('Import failed: ' + str(exc), file=sys.stderr)
+                else:
+                    if engine is not None:
+                        engine.dispose()
+                    engine = new_engine
+                    _render_changed_reports(
+                        engine, report_gens, rendered, renderer)
+                watcher.wait_for_change()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if engine is not None:
+                engine.dispose()
+
+
+def _reimport(xhb_path, db_path):
+    """Import HomeBank file to a fresh database.
+
+    File database is replaced atomically, so readers never see a
+    partial import.
+
+    :param str db_path: path to database file or None to use in-memory
+        database
+    :returns: engine for new database
+    :raises DataImportError:
+    """
+    if db_path is None:
+        engine = db.init_db()
+        _import_xhb(xhb_path, engine)
+        return engine
+
+    tmp_path = db_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    engine = db.init_db(tmp_path, wal=False)
+    try:
+        _import_xhb(xhb_path, engine)
+    except DataImportError:
+        engine.dispose()
+        os.remove(tmp_path)
+        raise
+    engine.dispose()
+    os.replace(tmp_path, db_path)
+    return db.init_db(db_path, wal=False)
+
+
+def _render_changed_reports(engine, report_gens, rendered, renderer):
+    """Render reports with results different from the last rendered.
+
+    :param dict rendered: last rendered rows by report name. Updated
+        by this function.
+    """
+    with engine.begin() as db_connection:
+        for name, report_gen in report_gens.items():
+            report = report_gen.generate_report(db_connection)
+            rows = list(report.table)
+            if rendered.get(name) != rows:
+                rendered[name] = rows
+                renderer.render(report)
+
+
+def handle_explain_command(args):
+    """Handle "explain" command."""
+    if not os.path.exists(args.db_path):
+        sys.exit("Can't explain a report. "
+                 f'Database file "{args.db_path}" not found.')
+
+    report_gen = _create_report_generator(args.report_name, args)
+    _exit_if_incomplete(args.db_path, "Can't explain a report.")
+    engine = db.open_readonly_db(args.db_path)
+    try:
+        with engine.connect() as dbc:
+            partitions.attach_report(dbc, report_gen)
+            plans = explain_report(dbc, report_gen)
+    except PartitionError as exc:
+        sys.exit(f"Can't explain a report. {exc}")
+    finally:
+        engine.dispose()
+    print(format_plans(plans))
+
+
+# Report options (see _add_report_options) by generator parameter names
+_REPORT_OPTIONS = ['source', 'currency', 'period', 'rows', 'columns',
+                   'approx']
+
+
+def _add_report_options(parser):
+    """Add options for report generators to parser."""
+    parser.add_argument(
+        '--source',
+        help='process only data from this source (consolidated database)')
+    parser.add_argument(
+        '--currency',
+        help='process only accounts in this currency (name)')
+    parser.add_argument(
+        '--period', choices=['year', 'month'],
+        help='report period (for reports with periods)')
+    parser.add_argument(
+        '--rows', choices=sorted(DIMENSIONS),
+        help='dimension for rows (pivot report)')
+    parser.add_argument(
+        '--columns', choices=sorted(DIMENSIONS),
+        help='dimension for columns (pivot report)')
+    parser.add_argument(
+        '--approx', action='store_true', default=None,
+        help='estimate balances from a sample of transactions (faster,'
+        ' cells get error bounds)')
+
+    group = parser.add_argument_group(
+        'filter', 'process only matching transactions. Options that may'
+        ' be used several times select transactions matching any value.')
+    group.add_argument(
+        '--from', dest='from_date', type=_parse_date, metavar='YYYY-MM-DD',
+        help='first date')
+    group.add_argument(
+        '--to', dest='to_date', type=_parse_date, metavar='YYYY-MM-DD',
+        help='last date')
+    group.add_argument(
+        '--account', dest='accounts', action='append',
+        help='account name')
+    group.add_argument(
+        '--category', dest='categories', action='append',
+        help='category name (subcategories are included)')
+    group.add_argument(
+        '--status', dest='statuses', action='append',
+        choices=[status.name.lower() for status in TxnStatus],
+        help='transaction status')
+    group.add_argument(
+        '--paymode', dest='paymodes', action='append',
+        choices=[paymode.name.lower() for paymode in Paymode],
+        help='payment mode')
+    group.add_argument(
+        '--tag', dest='tags', action='append',
+        help='tag name')
+
+
+def _add_memprofile_options(parser):
+    """Add memory profiling options to parser."""
+    parser.add_argument(
+        '--memprofile', metavar='PATH',
+        help='profile memory (time and peak memory per phase, top'
+        ' allocation sites) and write results to JSON file. Reports'
+        ' are generated one by one.')
+    parser.add_argument(
+        '--memory-budget', type=float, metavar='MIB',
+        help='fail if peak memory of any phase exceeds this number of'
+        ' MiB (with --memprofile)')
+
+
+def _parse_date(value):
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f'invalid date "{value}", YYYY-MM-DD expected') from None
+
+
+def _positive_int(value):
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            f'invalid value "{value}", positive integer expected')
+    return number
+
+
+def _create_report_filter(args):
+    """Create report filter from parsed arguments.
+
+    :returns: ReportFilter or None if no criteria are set
+    """
+    criteria = {name: getattr(args, name)
+                for name in ReportFilter._fields
+                if getattr(args, name) is not None}
+    if not criteria:
+        return None
+    if 'statuses' in criteria:
+        criteria['statuses'] = [TxnStatus[name.upper()]
+                                for name in criteria['statuses']]
+    if 'paymodes' in criteria:
+        criteria['paymodes'] = [Paymode[name.upper()]
+                                for name in criteria['paymodes']]
+    return ReportFilter(**criteria)
+
+
+def _create_report_generator(name, args=None):
+    """Create report generator.
+
+    :param args: parsed arguments with report options or None for
+        default options. Options that are not set are not passed to
+        generator.
+    """
+    try:
+        generator_class = GENERATORS[name]
+    except KeyError:
+        sys.exit(f'Unknown report "{name}"')
+    params = {}
+    if args is not None:
+        params = {option: getattr(args, option)
+                  for option in _REPORT_OPTIONS
+                  if getattr(args, option) is not None}
+        report_filter = _create_report_filter(args)
+        if report_filter is not None:
+            params['report_filter'] = report_filter
+    # Check options before the call: constructors may raise TypeError
+    # for other reasons.
+    signature = inspect.signature(generator_class)
+    try:
+        signature.bind(**params)
+    except TypeError:
+        sys.exit(f'Report "{name}" does not support options: '
+                 + ', '.join(sorted(set(params) - set(signature.parameters))))
+    try:
+        return generator_class(**params)
+    except ValueError as exc:
+        sys.exit(f'Report "{name}": {exc}')
 
 
 def main(argv=None):
@@ -73,17 +539,134 @@ def main(argv=None):
         help='import data from HomeBank file')
     import_parser.add_argument('xhb_path', help='path to HomeBank file (.xhb)')
     import_parser.add_argument('db_path', help='path to sqlite database file')
+    import_parser.add_argument(
+        '--parser', choices=sorted(PARSERS), default='expat',
+        help='XML parser engine (default: %(default)s)')
+    import_parser.add_argument(
+        '--resume', action='store_true',
+        help='continue interrupted import to existing database'
+        ' (HomeBank file must stay the same)')
+    _add_memprofile_options(import_parser)
     import_parser.set_defaults(func=handle_import_command)
 
+    import_many_parser = subparsers.add_parser(
+        'import-many',
+        help='import data from several HomeBank files to one database')
+    import_many_parser.add_argument(
+        'db_path', help='path to sqlite database file')
+    import_many_parser.add_argument(
+        'xhb_paths', metavar='xhb_path', nargs='+',
+        help='path to HomeBank file (.xhb). File name (without extension)'
+        ' becomes source name.')
+    import_many_parser.add_argument(
+        '--jobs', type=_positive_int,
+        help='maximum number of files parsed at the same time')
+    import_many_parser.set_defaults(func=handle_import_many_command)
+
     report_parser = subparsers.add_parser(
         'report',
         help='compile a report')
     # TODO: move to parent or change to source (db/xhb)
     # TODO: this is a weird order - report db report_name. Change or use flags.
     report_parser.add_argument('db_path', help='path to sqlite database file')
-    report_parser.add_argument('report_name', help='name of report')
+    report_parser.add_argument(
+        'report_names', metavar='report_name', nargs='+',
+        help='name of report. Several reports are generated concurrently.')
+    report_parser.add_argument(
+        '--jobs', type=_positive_int,
+        help='maximum number of reports generated at the same time')
+    report_parser.add_argument(
+        '--processes', action='store_true',
+        help='generate reports in separate processes instead of threads')
+    report_parser.add_argument(
+        '--immutable', action='store_true',
+        help='promise that nothing modifies the database during report'
+        ' generation (faster, but unsafe during import)')
+    report_parser.add_argument(
+        '--shards', type=int, default=1,
+        help='split date range of a report into this many parts generated'
+        ' in parallel (reports with sums and counts only)')
+    _add_report_options(report_parser)
+    _add_memprofile_options(report_parser)
     report_parser.set_defaults(func=handle_report_command)
 
+    explain_parser = subparsers.add_parser(
+        'explain',
+        help='show queries of a report with their plans and warnings')
+    explain_parser.add_argument('db_path', help='path to sqlite database file')
+    explain_parser.add_argument('report_name', help='name of report')
+    _add_report_options(explain_parser)
+    explain_parser.set_defaults(func=handle_explain_command)
+
+    partition_parser = subparsers.add_parser(
+        'partition',
+        help='move transactions to per-year database files')
+    partition_parser.add_argument(
+        'db_path', help='path to sqlite database file')
+    partition_parser.add_argument(
+        '--years-per-file', type=int, default=1,
+        help='minimum number of years in a partition file (default:'
+        ' %(default)s). There are 10 partition files at most.')
+    partition_parser.set_defaults(func=handle_partition_command)
+
+    search_parser = subparsers.add_parser(
+        'search',
+        help='search transactions by memo, info and payee')
+    search_parser.add_argument('db_path', help='path to sqlite database file')
+    search_parser.add_argument(
+        'query', help='search query (SQLite FTS5 syntax)')
+    search_parser.add_argument(
+        '--limit', type=int, default=20,
+        help='maximum number of results (default: %(default)s)')
+    search_parser.add_argument(
+        '--offset', type=int, default=0,
+        help='number of results to skip (default: %(default)s)')
+    search_parser.set_defaults(func=handle_search_command)
+
+    snapshot_parser = subparsers.add_parser(
+        'snapshot',
+        help='write columnar snapshot of database for fast analytics')
+    snapshot_parser.add_argument(
+        'db_path', help='path to sqlite database file')
+    snapshot_parser.add_argument(
+        'snapshot_path', help='path to snapshot file')
+    snapshot_parser.set_defaults(func=handle_snapshot_command)
+
+    export_parser = subparsers.add_parser(
+        'export',
+        help='export raw data (for other systems)')
+    export_parser.add_argument('db_path', help='path to sqlite database file')
+    export_parser.add_argument(
+        '--table', choices=export.export_names(),
+        default=export.FLAT_TRANSACTIONS,
+        help='table to export. "%(default)s" is a flat view of'
+        ' transactions with account, payee, category path and tags'
+        ' (default: %(default)s)')
+    export_parser.add_argument(
+        '--format', choices=export.FORMATS, default='csv',
+        help='output format (default: %(default)s)')
+    export_parser.add_argument(
+        '--output',
+        help='path to output file (standard output by default)')
+    export_parser.set_defaults(func=handle_export_command)
+
+    watch_parser = subparsers.add_parser(
+        'watch',
+        help='show reports and update them when HomeBank file changes')
+    watch_parser.add_argument('xhb_path', help='path to HomeBank file (.xhb)')
+    watch_parser.add_argument(
+        '--report', dest='report_names', action='append', required=True,
+        help='name of report (may be used several times)')
+    watch_parser.add_argument(
+        '--db', dest='db_path',
+        help='path to sqlite database file to keep up to date'
+        ' (in-memory database is used by default)')
+    watch_parser.add_argument(
+        '--interval', type=float, default=1.0,
+        help='polling interval in seconds (default: %(default)s)')
+    _add_report_options(watch_parser)
+    watch_parser.set_defaults(func=handle_watch_command)
+
     args = parser.parse_args(argv)
     # This is a standard way of handling (sub)commands
     args.func(args)
@@ -0,0 +1,191 @@
+"""Consolidation of several HomeBank files in one database.
+
+Every file is imported to its own temporary database in a worker
+process. Then temporary databases are merged one by one into the
+target database. Every file becomes a source named after the file.
+
+Ids from different files clash, so entities get new ids during the
+merge. Currencies, payees and categories with the same names are
+shared by all sources (so are tags). Accounts belong to their sources.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import os.path
+import tempfile
+
+from sqlalchemy import func
+from sqlalchemy.sql import select
+
+from hbreports import db, derived
+from hbreports.hbfile import DataImportError, initial_import, open_xhb
+
+
+# Number of rows copied at once
+_BATCH_SIZE = 10000
+
+
+def import_many(xhb_paths, dbc, max_workers=None):
+    """Import data from several files to one database.
+
+    Derived data is refreshed after all files are merged.
+
+    :param list xhb_paths: paths to HomeBank files
+    :param sqlalchemy.engine.Connectable dbc: database connection
+    :param int max_workers: maximum number of worker processes
+
+    :raises DataImportError:
+    """
+    source_names = [source_name(path) for path in xhb_paths]
+    if len(set(source_names)) != len(source_names):
+        raise DataImportError('File names must be unique')
+
+    with tempfile.TemporaryDirectory() as tmp_dir, \
+            ProcessPoolExecutor(max_workers) as executor:
+        tmp_paths = [os.path.join(tmp_dir, f'{i}.db')
+                     for i in range(len(xhb_paths))]
+        # Results are merged in order while other files are still
+        # being imported.
+        imported_paths = executor.map(_import_to_db, xhb_paths, tmp_paths)
+        for name, tmp_path in zip(source_names, imported_paths):
+            engine = db.init_db(tmp_path, wal=False)
+            try:
+                with engine.connect() as src_dbc:
+                    merge_db(src_dbc, dbc, name)
+            finally:
+                engine.dispose()
+    derived.refresh(dbc)
+
+
+def source_name(xhb_path):
+    """Get source name for HomeBank file."""
+    return os.path.splitext(os.path.basename(xhb_path))[0]
+
+
+def _import_to_db(xhb_path, db_path):
+    """Import file to a new database (runs in worker process).
+
+    :returns: database path
+    :raises DataImportError:
+    """
+    # Private database, nobody reads it concurrently
+    engine = db.init_db(db_path, wal=False)
+    try:
+        with engine.begin() as dbc, open_xhb(xhb_path) as f:
+            initial_import(f, dbc)
+    except DataImportError as exc:
+        raise DataImportError(f'"{xhb_path}": {exc}') from None
+    finally:
+        engine.dispose()
+    return db_path
+
+
+def merge_db(src_dbc, dst_dbc, name):
+    """Merge data from single-file database as a new source.
+
+    :param src_dbc: connection to single-file database
+    :param dst_dbc: connection to target database
+    :param str name: source name
+    """
+    result = dst_dbc.execute(db.source.insert().values(name=name))
+    source_id = result.inserted_primary_key[0]
+
+    currency_map = _merge_by_name(src_dbc, dst_dbc, db.currency)
+    payee_map = _merge_by_name(src_dbc, dst_dbc, db.payee)
+    tag_map = _merge_by_name(src_dbc, dst_dbc, db.tag)
+    category_map = _merge_categories(src_dbc, dst_dbc)
+
+    account_map = {}
+    for row in src_dbc.execute(select([db.account])):
+        result = dst_dbc.execute(db.account.insert().values(
+            name=row.name,
+            currency_id=currency_map[row.currency_id],
+            initial=row.initial,
+            source_id=source_id))
+        account_map[row.id] = result.inserted_primary_key[0]
+
+    # Transactions are numerous. Keep their ids by adding an offset
+    # instead of mapping them one by one.
+    txn_offset = dst_dbc.execute(
+        select([func.coalesce(func.max(db.txn.c.id), 0)])).scalar()
+
+    def txn_row(row):
+        values = dict(row)
+        values['id'] += txn_offset
+        values['account_id'] = account_map[row.account_id]
+        values['payee_id'] = payee_map.get(row.payee_id)
+        return values
+
+    def split_row(row):
+        values = dict(row)
+        del values['id']
+        values['txn_id'] += txn_offset
+        values['category_id'] = category_map.get(row.category_id)
+        return values
+
+    def tag_row(row):
+        return {'tag_id': tag_map[row.tag_id],
+                'txn_id': row.txn_id + txn_offset}
+
+    _copy_rows(src_dbc, dst_dbc, db.txn, txn_row)
+    _copy_rows(src_dbc, dst_dbc, db.split, split_row)
+    _copy_rows(src_dbc, dst_dbc, db.txn_tag, tag_row)
+
+
+def _merge_by_name(src_dbc, dst_dbc, table):
+    """Merge entities identified by unique name.
+
+    :returns: dict mapping source ids to target ids
+    """
+    existing = {row.name: row.id
+                for row in dst_dbc.execute(
+                    select([table.c.id, table.c.name]))}
+    id_map = {}
+    for row in src_dbc.execute(select([table.c.id, table.c.name])):
+        if row.name not in existing:
+            result = dst_dbc.execute(table.insert().values(name=row.name))
+            existing[row.name] = result.inserted_primary_key[0]
+        id_map[row.id] = existing[row.name]
+    return id_map
+
+
+def _merge_categories(src_dbc, dst_dbc):
+    """Merge categories identified by name and parent.
+
+    :returns: dict mapping source ids to target ids
+    """
+    c = db.category.c
+    existing = {(row.name, row.parent_id): row.id
+                for row in dst_dbc.execute(
+                    select([c.id, c.name, c.parent_id]))}
+    id_map = {}
+    # Parents first
+    rows = src_dbc.execute(
+        select([db.category])
+        .order_by(c.parent_id != None, c.id)  # noqa: E711
+    ).fetchall()
+    for row in rows:
+        parent_id = id_map.get(row.parent_id)
+        key = (row.name, parent_id)
+        if key not in existing:
+            result = dst_dbc.execute(db.category.insert().values(
+                name=row.name,
+                parent_id=parent_id,
+                income=row.income))
+            existing[key] = result.inserted_primary_key[0]
+        id_map[row.id] = existing[key]
+    return id_map
+
+
+def _copy_rows(src_dbc, dst_dbc, table, convert):
+    """Copy all rows of table in batches.
+
+    :param callable convert: function to convert source row to dict
+        with target values
+    """
+    result = src_dbc.execute(
+        select([table]).order_by(*table.primary_key))
+    while True:
+        rows = result.fetchmany(_BATCH_SIZE)
+        if not rows:
+            break
+        dst_dbc.execute(table.insert(), [convert(row) for row in rows])
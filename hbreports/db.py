@@ -13,15 +13,25 @@ We're using double type for money. SQLAlchemy doesn't support Numeric
 type with SQLite. HomeBank uses double internally. We're going to use
 double too. This should be more than enough for purposes of this
 application.
+
+Dates are stored as integer day ordinals (datetime.date.toordinal(),
+HomeBank uses them too), see OrdinalDate. Integers are smaller than
+ISO strings and are compared faster. Use julian_day() for SQLite date
+functions and *_iso views in sqlite shell.
 """
 
+import contextlib
+import datetime
+import sqlite3
+import urllib.parse
 
 from sqlalchemy import (
+    DDL,
     Boolean,
     Column,
-    Date,
     Float,
     ForeignKey,
+    Index,
     Integer,
     MetaData,
     String,
@@ -29,14 +39,60 @@ from sqlalchemy import (
     UniqueConstraint,
     create_engine,
     event,
+    literal_column,
+    type_coerce,
 )
 from sqlalchemy.engine import Engine
+from sqlalchemy.pool import NullPool, QueuePool, StaticPool
+from sqlalchemy.types import TypeDecorator
 
 from hbreports.common import Paymode
 
 
 metadata = MetaData()
 
+# Version of data format. Stored as user_version of the database file.
+# Increment when existing databases can't be read anymore.
+#
+# 1: dates are day ordinals (ISO strings before)
+SCHEMA_VERSION = 1
+
+
+class OrdinalDate(TypeDecorator):
+    """Date stored as integer day ordinal.
+
+    Values are datetime.date objects. Ordinals (int) are accepted as
+    well.
+    """
+
+    impl = Integer
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, datetime.date):
+            return value.toordinal()
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return datetime.date.fromordinal(value)
+
+
+# Julian day number of midnight before day ordinal 0 (SQL literal)
+JULIAN_DAY_OFFSET = '1721424.5'
+
+
+def julian_day(date):
+    """Convert ordinal date to Julian day number.
+
+    SQLite date and time functions accept Julian day numbers, e.g.
+    strftime('%Y', julian_day(txn.c.date)).
+
+    :param date: SQL expression of OrdinalDate type
+    """
+    return (type_coerce(date, Integer)
+            + literal_column(JULIAN_DAY_OFFSET, Float))
+
 
 currency = Table(
     'currency',
@@ -46,16 +102,37 @@ currency = Table(
 )
 
 
+# Source is a HomeBank file. There are no sources in a database
+# created from a single file. Consolidated database (several files
+# imported together) has a source per file.
+source = Table(
+    'source',
+    metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', String, nullable=False, unique=True),
+)
+
+
+# Accounts belong to sources (if there are any). Other entities
+# (currencies, payees, categories) are shared by sources.
 account = Table(
     'account',
     metadata,
     Column('id', Integer, primary_key=True),
-    Column('name', String, nullable=False, unique=True),
+    Column('name', String, nullable=False),
     Column('currency_id', None, ForeignKey('currency.id'), nullable=False),
     Column('initial', Float, nullable=False, default=0.0),
+    Column('source_id', None, ForeignKey('source.id')),
+    UniqueConstraint('name', 'source_id')
 )
 
 
+# SQLite treats NULLs as distinct in unique constraints, so accounts
+# without a source (single-file databases) need their own index.
+Index('ix_account_name_no_source', account.c.name, unique=True,
+      sqlite_where=account.c.source_id == None)  # noqa: E711
+
+
 category = Table(
     'category',
     metadata,
@@ -63,6 +140,9 @@ category = Table(
     Column('name', String, nullable=False),
     Column('parent_id', None, ForeignKey('category.id')),
     Column('income', Boolean, nullable=False),
+    # Derived column: root of category tree (category itself for
+    # top-level categories).
+    Column('top_category_id', None, ForeignKey('category.id')),
     UniqueConstraint('name', 'parent_id')
 )
 
@@ -82,7 +162,7 @@ txn = Table(
     'txn',
     metadata,
     Column('id', Integer, primary_key=True),
-    Column('date', Date, nullable=False),
+    Column('date', OrdinalDate, nullable=False),
     Column('account_id', None, ForeignKey('account.id'), nullable=False),
     Column('status', Integer, nullable=False),
     Column('payee_id', None, ForeignKey('payee.id')),
@@ -92,6 +172,11 @@ txn = Table(
 )
 
 
+Index('ix_txn_account_date', txn.c.account_id, txn.c.date)
+# For date range filters without accounts
+Index('ix_txn_date', txn.c.date)
+
+
 split = Table(
     'split',
     metadata,
@@ -104,20 +189,143 @@ split = Table(
 )
 
 
-# Using one-to-many approach for transaction tags. We will usually
-# join transaction and tag tables. Tag information is almost useless on
-# its own for our purposes. Using many-to-many scheme would just mean
-# an additional join.
+Index('ix_split_txn', split.c.txn_id)
+
+
+# Tag names are interned: every name is stored once in "tag" table.
+tag = Table(
+    'tag',
+    metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', String, nullable=False, unique=True)
+)
+
+
+# Transaction tags. Primary key works as an index for filtering
+# transactions by tag. There's another index for the opposite
+# direction.
 txn_tag = Table(
     'txn_tag',
     metadata,
+    Column('tag_id', None, ForeignKey('tag.id'), primary_key=True),
+    Column('txn_id', None, ForeignKey('txn.id'), primary_key=True),
+    sqlite_with_rowid=False,
+)
+
+
+Index('ix_txn_tag_txn', txn_tag.c.txn_id, txn_tag.c.tag_id)
+
+
+# Derived tables. They are filled in by hbreports.derived module.
+
+
+# Account balance at the end of month (initial value included). There
+# are checkpoints only for months with transactions.
+balance_checkpoint = Table(
+    'balance_checkpoint',
+    metadata,
+    Column('account_id', None, ForeignKey('account.id'), primary_key=True),
+    # first day of month
+    Column('month', OrdinalDate, primary_key=True),
+    Column('balance', Float, nullable=False),
+)
+
+
+# Closure of category tree: all (ancestor, descendant) pairs including
+# (category, category) with depth 0. Makes rollups to any level
+# possible with plain joins.
+category_closure = Table(
+    'category_closure',
+    metadata,
+    Column('ancestor_id', None, ForeignKey('category.id'),
+           primary_key=True),
+    Column('descendant_id', None, ForeignKey('category.id'),
+           primary_key=True),
+    Column('depth', Integer, nullable=False),
+)
+
+
+Index('ix_category_closure_descendant',
+      category_closure.c.descendant_id,
+      category_closure.c.depth)
+
+
+# Stratified sample of splits for approximate reports (see
+# hbreports.approx). Weight is the number of splits of the stratum
+# represented by the sampled split. Rows are copies of split rows
+# (same ids). There are no foreign keys: imported data can be deleted
+# before the sample is refreshed.
+split_sample = Table(
+    'split_sample',
+    metadata,
     Column('id', Integer, primary_key=True),
-    Column('txn_id', None,
-           ForeignKey('txn.id'), nullable=False),
-    Column('name', String, nullable=False)
+    Column('amount', Float, nullable=False),
+    Column('category_id', Integer),
+    Column('txn_id', Integer, nullable=False),
+    Column('weight', Float, nullable=False),
+)
+
+
+Index('ix_split_sample_txn', split_sample.c.txn_id)
+
+
+# Progress of checkpointed import (see hbfile.checkpointed_import).
+# Single row. Databases without it were imported in one transaction
+# and are always complete.
+import_state = Table(
+    'import_state',
+    metadata,
+    Column('id', Integer, primary_key=True),
+    # HomeBank file size and modification time at the import start.
+    # Import can't be resumed if the file was changed.
+    Column('xhb_size', Integer, nullable=False),
+    Column('xhb_mtime_ns', Integer, nullable=False),
+    # number of XML elements imported
+    Column('elements', Integer, nullable=False),
+    # position in XML data (NULL if parser doesn't report positions)
+    Column('byte_offset', Integer),
+    Column('complete', Boolean, nullable=False),
+)
+
+
+# Partition files of a partitioned database (see hbreports.partitions).
+# Empty for databases that are not partitioned.
+txn_partition = Table(
+    'txn_partition',
+    metadata,
+    # schema name of attached partition
+    Column('name', String, primary_key=True),
+    # file path relative to the directory of the main database
+    Column('path', String, nullable=False),
+    # date range of transactions, inclusive
+    Column('first_date', OrdinalDate, nullable=False),
+    Column('last_date', OrdinalDate, nullable=False),
+    # read-only file with past years that never changes
+    Column('closed', Boolean, nullable=False),
 )
 
 
+# Views with ISO dates for sqlite shell
+_ISO_VIEWS = {
+    'txn_iso': txn,
+    'balance_checkpoint_iso': balance_checkpoint,
+}
+
+
+def _iso_view_ddl(name, table):
+    columns = ', '.join(
+        f'date({column.name} + {JULIAN_DAY_OFFSET}) AS {column.name}'
+        if isinstance(column.type, OrdinalDate) else column.name
+        for column in table.columns)
+    return DDL(f'CREATE VIEW IF NOT EXISTS {name} AS'
+               f' SELECT {columns} FROM {table.name}')
+
+
+for _name, _table in _ISO_VIEWS.items():
+    event.listen(metadata, 'after_create', _iso_view_ddl(_name, _table))
+    event.listen(metadata, 'before_drop', DDL(f'DROP VIEW IF EXISTS {_name}'))
+
+
 # Enable foreign key constraint. It's disabled in sqlite by default.
 @event.listens_for(Engine, "connect")
 def enable_foreign_keys(dbapi_connection, _):
@@ -126,16 +334,156 @@ def enable_foreign_keys(dbapi_connection, _):
     cursor.close()
 
 
-def init_db(path=None):
+# Seconds to wait for a lock held by another connection before
+# failing with "database is locked".
+BUSY_TIMEOUT = 30.0
+
+# Connection settings for writers of WAL databases (see init_db).
+_WAL_PRAGMAS = [
+    # Persistent, but cheap to repeat. Must run outside transactions.
+    'PRAGMA journal_mode = WAL',
+    # Commits don't wait for fsync of the database file, only of the
+    # log. Committed data survives application crashes, the last
+    # commits may be lost on power failure.
+    'PRAGMA synchronous = NORMAL',
+]
+
+
+def init_db(path=None, wal=True):
     """Initialize database.
 
     Call to start working with new or existing database. Use in-memory
     db by default.
+
+    File databases are switched to write-ahead log (WAL) mode. A
+    writer appends to the log then, and readers (reports, see
+    open_readonly_db) keep reading the last committed snapshot: they
+    never wait for the writer and never see its uncommitted changes.
+    The log is copied to the database file by checkpoint_wal().
+
+    :param bool wal: use WAL mode. Turn it off for databases that are
+        going to be moved or replaced: log and shared memory files
+        belong to a path, not to a database file, so a replaced
+        database could be paired with a stale log.
     """
     if path:
         url = 'sqlite:///' + path
     else:
         url = 'sqlite:///:memory:'
-    engine = create_engine(url, echo=False)
-    metadata.create_all(engine)
+    engine = create_engine(url, echo=False,
+                           connect_args={'timeout': BUSY_TIMEOUT})
+    if path:
+        pragmas = (_WAL_PRAGMAS if wal
+                   else ['PRAGMA journal_mode = DELETE'])
+
+        @event.listens_for(engine, 'connect')
+        def set_journal_mode(dbapi_connection, _):
+            for pragma in pragmas:
+                dbapi_connection.execute(pragma)
+
+    with engine.connect() as dbc:
+        new = not engine.dialect.has_table(dbc, txn.name)
+        metadata.create_all(dbc)
+        if new:
+            dbc.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
     return engine
+
+
+def read_schema_version(dbc):
+    """Read version of data format (see SCHEMA_VERSION).
+
+    Databases created before versioning have version 0.
+    """
+    return dbc.execute('PRAGMA user_version').scalar()
+
+
+def checkpoint_wal(dbc, truncate=False):
+    """Copy committed changes from write-ahead log to database file.
+
+    Call outside of transactions, e.g. after every committed batch.
+    Does nothing for databases not in WAL mode. Writers checkpoint
+    automatically as well, unless they turn it off (see
+    manual_wal_checkpoints).
+
+    :param bool truncate: wait for readers of old snapshots (up to
+        BUSY_TIMEOUT) and truncate the log file. Otherwise copy as much
+        as possible without waiting (the log is reused from the start
+        once it is copied completely).
+    """
+    mode = 'TRUNCATE' if truncate else 'PASSIVE'
+    dbc.execute(f'PRAGMA wal_checkpoint({mode})')
+
+
+@contextlib.contextmanager
+def manual_wal_checkpoints(dbc):
+    """Turn off automatic checkpoints of connection for a while.
+
+    A writer committing big batches then calls checkpoint_wal between
+    them instead of checkpointing in the middle of a commit. The log
+    grows until the next checkpoint_wal call. The setting is restored
+    on exit: pooled connections are reused.
+    """
+    autocheckpoint = dbc.execute('PRAGMA wal_autocheckpoint').scalar()
+    dbc.execute('PRAGMA wal_autocheckpoint = 0')
+    try:
+        yield
+    finally:
+        dbc.execute(f'PRAGMA wal_autocheckpoint = {autocheckpoint}')
+
+
+# Connection settings for report queries. Reports read a lot and
+# write nothing, so bigger caches are a good deal.
+_READONLY_PRAGMAS = [
+    # 64 MiB page cache (negative value is in KiB)
+    'PRAGMA cache_size = -65536',
+    # read pages directly from memory-mapped file (up to 256 MiB)
+    'PRAGMA mmap_size = 268435456',
+    # temporary B-trees for sorting and grouping
+    'PRAGMA temp_store = MEMORY',
+]
+
+
+def open_readonly_db(path, immutable=False, single_connection=False,
+                     pooled=False):
+    """Open existing database in read-only mode.
+
+    Connections can't modify the database. That makes them safe to
+    use for reports running concurrently with each other. In WAL mode
+    (see init_db) they run concurrently with a writer too: every read
+    transaction sees the last snapshot committed before it started.
+
+    :param bool immutable: promise that nobody modifies the database
+        while it's open. SQLite skips locking and change detection
+        then, write-ahead log is ignored too. Results are undefined if
+        the promise is broken.
+    :param bool single_connection: use one connection for the whole
+        engine life (StaticPool). Page cache stays warm between
+        queries, but the engine must be used by one thread at a
+        time. By default every connect() opens a new connection
+        (NullPool), which suits short-lived engines and worker
+        threads.
+    :param bool pooled: keep connections open between connect() calls
+        (QueuePool), so page caches stay warm and settings are not
+        applied again. Suits long-lived engines shared by threads.
+    """
+    uri = 'file:' + urllib.parse.quote(path) + '?mode=ro'
+    if immutable:
+        uri += '&immutable=1'
+
+    def connect():
+        # Every connection is used by one thread at a time, but not
+        # necessarily by the thread that created it.
+        connection = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                                     timeout=BUSY_TIMEOUT)
+        for pragma in _READONLY_PRAGMAS:
+            connection.execute(pragma)
+        return connection
+
+    if single_connection:
+        poolclass = StaticPool
+    elif pooled:
+        poolclass = QueuePool
+    else:
+        poolclass = NullPool
+    return create_engine('sqlite://', creator=connect, poolclass=poolclass,
+                         echo=False)
@@ -0,0 +1,184 @@
+"""Derived data.
+
+Derived tables contain data computed from imported data. They make
+reports faster. Call refresh() every time imported data is changed.
+
+Full-text search index is a derived table too. It's an FTS5 virtual
+table, which SQLAlchemy can't describe, so it's created here. Search
+is not available if SQLite is built without FTS5.
+"""
+
+from sqlalchemy import Float, Integer, func, literal
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql import and_, cast, select, text
+
+from hbreports import db, memprofile
+
+
+def refresh(dbc):
+    """Recompute all derived data.
+
+    :param sqlalchemy.engine.Connectable dbc: database connection
+    """
+    with memprofile.phase('derived.refresh'):
+        _refresh_balance_checkpoints(dbc)
+        _refresh_category_closure(dbc)
+        _refresh_search_index(dbc)
+        _refresh_split_sample(dbc)
+
+
+# Split sample (see hbreports.approx): share of every stratum and the
+# minimum sample size per stratum. Smaller strata are taken whole.
+SAMPLE_RATE = 0.05
+SAMPLE_MIN_SIZE = 20
+
+# Multiplicative hash (Knuth) for a pseudo-random but reproducible
+# order of splits. Products fit into 64-bit integers for ids up to
+# 2^31.
+_HASH_MULTIPLIER = 2654435761
+_HASH_MODULUS = 2 ** 32
+
+
+# Name of full-text search table. Row id is transaction id.
+SEARCH_TABLE = 'txn_search'
+
+# Contentless table: text is indexed, but not stored
+_CREATE_SEARCH_TABLE = text(f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE}
+USING fts5(memo, info, split_memo, payee, content='')
+""")
+
+_FILL_SEARCH_TABLE = text(f"""
+INSERT INTO {SEARCH_TABLE} (rowid, memo, info, split_memo, payee)
+SELECT txn.id, txn.memo, txn.info,
+       (SELECT group_concat(split.memo, ' ')
+        FROM split WHERE split.txn_id = txn.id),
+       payee.name
+FROM txn LEFT JOIN payee ON payee.id = txn.payee_id
+""")
+
+
+def _refresh_balance_checkpoints(dbc):
+    # Ordinal of the first day of month
+    month = (
+        db.txn.c.date + 1
+        - cast(func.strftime('%d', db.julian_day(db.txn.c.date)), Integer)
+    ).label('month')
+    monthly = (
+        select([
+            db.txn.c.account_id,
+            month,
+            func.sum(db.split.c.amount).label('total'),
+        ])
+        .select_from(db.txn.join(db.split, db.split.c.txn_id == db.txn.c.id))
+        .group_by(db.txn.c.account_id, 'month')
+        .alias('monthly')
+    )
+    balance = db.account.c.initial + func.sum(monthly.c.total).over(
+        partition_by=monthly.c.account_id,
+        order_by=monthly.c.month)
+    dbc.execute(db.balance_checkpoint.delete())
+    dbc.execute(db.balance_checkpoint.insert().from_select(
+        ['account_id', 'month', 'balance'],
+        select([monthly.c.account_id, monthly.c.month, balance])
+        .select_from(monthly.join(
+            db.account, db.account.c.id == monthly.c.account_id))))
+
+
+def _refresh_category_closure(dbc):
+    c = db.category.c
+    tree = (
+        select([c.id.label('ancestor_id'),
+                c.id.label('descendant_id'),
+                literal(0).label('depth')])
+        .cte('tree', recursive=True)
+    )
+    tree = tree.union_all(
+        select([tree.c.ancestor_id, c.id, tree.c.depth + 1])
+        .where(c.parent_id == tree.c.descendant_id))
+    dbc.execute(db.category_closure.delete())
+    dbc.execute(db.category_closure.insert().from_select(
+        ['ancestor_id', 'descendant_id', 'depth'],
+        select([tree.c.ancestor_id, tree.c.descendant_id, tree.c.depth])))
+
+    closure = db.category_closure.c
+    dbc.execute(db.category.update().values(
+        top_category_id=(
+            select([closure.ancestor_id])
+            .where(closure.descendant_id == c.id)
+            .order_by(closure.depth.desc())
+            .limit(1)
+            .as_scalar())))
+
+
+def _refresh_search_index(dbc):
+    try:
+        dbc.execute(_CREATE_SEARCH_TABLE)
+    except OperationalError:
+        # no FTS5 support
+        return
+    dbc.execute(text(
+        f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('delete-all')"))
+    dbc.execute(_FILL_SEARCH_TABLE)
+
+
+def _refresh_split_sample(dbc):
+    s = db.split.c
+    stratum = [db.txn.c.account_id,
+               func.strftime('%Y', db.julian_day(db.txn.c.date))]
+    ranked = (
+        select([
+            s.id, s.amount, s.category_id, s.txn_id,
+            func.row_number().over(
+                partition_by=stratum,
+                order_by=s.id * _HASH_MULTIPLIER % _HASH_MODULUS,
+            ).label('number'),
+            func.count().over(partition_by=stratum).label('stratum_size'),
+        ])
+        .select_from(db.txn.join(db.split, s.txn_id == db.txn.c.id))
+        .alias('ranked')
+    )
+    # Multi-argument min() and max() are scalar functions in SQLite
+    sample_size = func.min(
+        ranked.c.stratum_size,
+        func.max(SAMPLE_MIN_SIZE,
+                 cast(ranked.c.stratum_size * SAMPLE_RATE, Integer)))
+    dbc.execute(db.split_sample.delete())
+    dbc.execute(db.split_sample.insert().from_select(
+        ['id', 'amount', 'category_id', 'txn_id', 'weight'],
+        select([ranked.c.id, ranked.c.amount, ranked.c.category_id,
+                ranked.c.txn_id,
+                cast(ranked.c.stratum_size, Float) / sample_size])
+        .where(ranked.c.number <= sample_size)))
+
+
+def account_balance(dbc, account_id, date):
+    """Get account balance at the end of the date.
+
+    Uses the nearest checkpoint and transactions after it (no more
+    than a month of transactions).
+
+    :param datetime.date date: date
+    """
+    month_start = date.replace(day=1)
+    cp = db.balance_checkpoint.c
+    checkpoint = dbc.execute(
+        select([cp.balance])
+        .where(cp.account_id == account_id)
+        .where(cp.month < month_start)
+        .order_by(cp.month.desc())
+        .limit(1)
+    ).scalar()
+    if checkpoint is None:
+        checkpoint = dbc.execute(
+            select([db.account.c.initial])
+            .where(db.account.c.id == account_id)
+        ).scalar()
+    rest = dbc.execute(
+        select([func.coalesce(func.sum(db.split.c.amount), 0.0)])
+        .select_from(db.txn.join(db.split, db.split.c.txn_id == db.txn.c.id))
+        .where(and_(db.txn.c.account_id == account_id,
+                    db.txn.c.date >= month_start,
+                    db.txn.c.date <= date))
+    ).scalar()
+    return checkpoint + rest
@@ -0,0 +1,178 @@
+"""Engine registry for serving many databases from one process.
+
+Creating an engine per request is wasteful: init_db() runs schema
+creation every time, and a new read-only engine opens a new connection
+with a cold page cache and applies its settings again.
+EngineRegistry keeps a bounded number of engines keyed by database
+path and evicts the least recently used ones. Read-only engines keep
+their connections open (see db.open_readonly_db). Partitions attached
+to a connection (see hbreports.partitions) are detached when it's
+returned to the pool.
+
+Cached engines are validated cheaply on every get():
+
+* file version (stat of the database file and its write-ahead log) is
+  compared first. It costs a couple of system calls;
+* only if the file has changed, schema version (PRAGMA schema_version
+  and user_version) is queried. Engine is reopened if the schema has
+  changed or the engine can't notice changes itself (immutable).
+
+Databases replaced by a new file (e.g. watch command) are handled the
+same way.
+"""
+
+import collections
+import os
+import threading
+
+from sqlalchemy import event
+
+from hbreports import db, partitions
+
+
+_Entry = collections.namedtuple(
+    '_Entry', ['engine', 'file_version', 'schema_version'])
+
+
+class EngineRegistry:
+    """Thread-safe LRU cache of database engines.
+
+    Engines are disposed when evicted or when the registry is closed.
+    dispose() closes idle connections only: a thread still using an
+    evicted engine finishes its work normally.
+
+    :param int max_engines: maximum number of open engines
+    :param bool readonly: open engines with db.open_readonly_db (for
+        reports). Otherwise use db.init_db (schema is created once per
+        engine).
+    :param bool immutable: see db.open_readonly_db. Engine is reopened
+        whenever the file changes, so it's safe for databases that
+        are replaced as a whole, but not for databases updated in
+        place while queries run.
+    """
+
+    def __init__(self, max_engines=16, readonly=True, immutable=False):
+        if max_engines < 1:
+            raise ValueError('max_engines must be positive')
+        self._max_engines = max_engines
+        self._readonly = readonly
+        self._immutable = immutable
+        # path -> _Entry, least recently used first
+        self._entries = collections.OrderedDict()
+        # Opening an engine queries the database, but it's done under
+        # the lock anyway: the same engine must not be opened twice.
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, path):
+        """Get engine for database file.
+
+        :param str path: path to existing database file
+        :raises FileNotFoundError: there's no such file (cached engine
+            is evicted)
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            try:
+                file_version = _file_version(path)
+            except FileNotFoundError:
+                self._evict(path)
+                raise
+            entry = self._entries.get(path)
+            if entry is not None and entry.file_version != file_version:
+                entry = self._revalidate(path, entry, file_version)
+            if entry is None:
+                entry = self._open(path, file_version)
+            self._entries[path] = entry
+            self._entries.move_to_end(path)
+            while len(self._entries) > self._max_engines:
+                _, evicted = self._entries.popitem(last=False)
+                evicted.engine.dispose()
+            return entry.engine
+
+    def discard(self, path):
+        """Evict engine for database file (if there's one)."""
+        with self._lock:
+            self._evict(os.path.abspath(path))
+
+    def close(self):
+        """Dispose all engines."""
+        with self._lock:
+            while self._entries:
+                _, entry = self._entries.popitem()
+                entry.engine.dispose()
+
+    def _open(self, path, file_version):
+        if self._readonly:
+            engine = db.open_readonly_db(path, immutable=self._immutable,
+                                         pooled=True)
+            event.listen(engine, 'checkin', _detach_partitions)
+        else:
+            engine = db.init_db(path)
+        try:
+            schema_version = _schema_version(engine)
+        except BaseException:
+            engine.dispose()
+            raise
+        return _Entry(engine, file_version, schema_version)
+
+    def _revalidate(self, path, entry, file_version):
+        """Check engine of changed file.
+
+        :returns: updated entry or None if engine was disposed
+        """
+        if not self._immutable:
+            schema_version = _schema_version(entry.engine)
+            if schema_version == entry.schema_version:
+                return entry._replace(file_version=file_version)
+        del self._entries[path]
+        entry.engine.dispose()
+        return None
+
+    def _evict(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            entry.engine.dispose()
+
+
+def _detach_partitions(dbapi_connection, _):
+    # Connection is None if it was invalidated
+    if dbapi_connection is not None:
+        partitions.detach(dbapi_connection)
+
+
+def _file_version(path):
+    """Get state of database file used to detect changes.
+
+    Committed data may stay in write-ahead log for a while, so the log
+    file is checked too.
+
+    :raises FileNotFoundError:
+    """
+    stat = os.stat(path)
+    version = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    try:
+        wal_stat = os.stat(path + '-wal')
+    except FileNotFoundError:
+        return version
+    return version + (wal_stat.st_size, wal_stat.st_mtime_ns)
+
+
+def _schema_version(engine):
+    """Query schema version: (schema_version, user_version).
+
+    SQLite increments schema_version on every schema change.
+    user_version is set by the application.
+    """
+    with engine.connect() as dbc:
+        return (dbc.execute('PRAGMA schema_version').scalar(),
+                dbc.execute('PRAGMA user_version').scalar())
@@ -0,0 +1,119 @@
+"""Query plans for reports.
+
+Report generators build queries on the fly, so there's no list of
+queries to explain. Instead, report is generated once and every
+executed statement is explained with "EXPLAIN QUERY PLAN".
+
+Some plan steps are usually bad news for big databases. They are
+reported as warnings:
+
+* full table scan - missing index or a predicate that can't use an
+  index (e.g. function of indexed column);
+* temporary B-tree - sorting or grouping without suitable index;
+* automatic index - SQLite builds an index for every query execution.
+"""
+
+import collections
+
+from sqlalchemy import event
+
+
+QueryPlan = collections.namedtuple(
+    'QueryPlan', [
+        'sql',
+        'params',
+        # list of PlanStep
+        'steps',
+        # list of str
+        'warnings',
+    ])
+
+
+PlanStep = collections.namedtuple('PlanStep', ['depth', 'detail'])
+
+
+def explain_report(dbc, report_gen):
+    """Get plans for all queries of report generator.
+
+    Statements are explained right before execution: they may use
+    temporary tables which don't exist after the report is generated.
+
+    :param sqlalchemy.engine.Connection dbc: database connection
+    :returns: list of QueryPlan in execution order
+    """
+    plans = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not statement.lstrip().upper().startswith(_EXPLAINED):
+            return
+        steps = _plan_steps(dbc, statement, parameters)
+        plans.append(QueryPlan(statement, parameters, steps,
+                               _find_problems(steps)))
+
+    event.listen(dbc, 'before_cursor_execute', capture)
+    try:
+        report_gen.generate_report(dbc)
+    finally:
+        event.remove(dbc, 'before_cursor_execute', capture)
+    return plans
+
+
+# Statements to explain (others are DDL, etc.)
+_EXPLAINED = ('SELECT', 'WITH', 'INSERT')
+
+
+def format_plans(plans):
+    """Format query plans as text."""
+    lines = []
+    for number, plan in enumerate(plans, start=1):
+        lines.append(f'--- Query {number} ---')
+        lines.append(plan.sql.strip())
+        if plan.params:
+            lines.append(f'Parameters: {plan.params!r}')
+        lines.append('')
+        lines.append('Plan:')
+        lines.extend('  ' * (step.depth + 1) + step.detail
+                     for step in plan.steps)
+        if plan.warnings:
+            lines.append('')
+            lines.append('Warnings:')
+            lines.extend('  ' + warning for warning in plan.warnings)
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def _plan_steps(dbc, sql, params):
+    """Run EXPLAIN QUERY PLAN.
+
+    :returns: list of PlanStep in tree order
+    """
+    cursor = dbc.connection.cursor()
+    try:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+
+    depths = {0: -1}
+    steps = []
+    for step_id, parent_id, _, detail in rows:
+        depth = depths.get(parent_id, -1) + 1
+        depths[step_id] = depth
+        steps.append(PlanStep(depth, detail))
+    return steps
+
+
+def _find_problems(steps):
+    warnings = []
+    for step in steps:
+        detail = step.detail
+        if (detail.startswith('SCAN ')
+                and ' USING ' not in detail
+                and 'VIRTUAL TABLE' not in detail
+                and detail != 'SCAN CONSTANT ROW'):
+            warnings.append(f'full table scan: {detail}')
+        if 'TEMP B-TREE' in detail:
+            warnings.append(f'temporary B-tree: {detail}')
+        if 'AUTOMATIC' in detail:
+            warnings.append(f'automatic index: {detail}')
+    return warnings
@@ -0,0 +1,156 @@
+"""Export of raw data.
+
+Export is for feeding other systems, so it's all about throughput.
+Rows are streamed from a raw DBAPI cursor in batches and written
+without Report/Table objects:
+
+* CSV rows are written by csv module (in C);
+* JSON lines are built by SQLite (json_object), Python only joins
+  them.
+
+Memory use doesn't depend on the number of rows.
+
+Besides database tables there's "transactions": flat transactions
+with account, payee, category path and tags. There's a row per split.
+"""
+
+import csv
+
+from hbreports import db
+
+
+FORMATS = ['csv', 'jsonl']
+
+# Name of flat transactions export
+FLAT_TRANSACTIONS = 'transactions'
+
+# Number of rows fetched and written at once
+_BATCH_SIZE = 10000
+
+# Category path is "Category:Subcategory" like in HomeBank. Paths of
+# all categories are computed once. Ancestors (and tags) are ordered by
+# subquery, group_concat keeps that order.
+_FLAT_TRANSACTIONS_WITH = """
+WITH category_path (id, path) AS (
+    SELECT descendant_id, group_concat(name, ':') FROM (
+        SELECT category_closure.descendant_id, category.name
+        FROM category_closure
+        JOIN category ON category.id = category_closure.ancestor_id
+        ORDER BY category_closure.descendant_id, category_closure.depth DESC)
+    GROUP BY descendant_id)
+"""
+
+_FLAT_TRANSACTIONS_COLUMNS = [
+    ('txn_id', 'txn.id'),
+    ('date', f'date(txn.date + {db.JULIAN_DAY_OFFSET})'),
+    ('account', 'account.name'),
+    ('currency', 'currency.name'),
+    ('payee', 'payee.name'),
+    ('status', 'txn.status'),
+    ('paymode', 'txn.paymode'),
+    ('memo', 'txn.memo'),
+    ('info', 'txn.info'),
+    ('amount', 'split.amount'),
+    ('category', 'category_path.path'),
+    ('split_memo', 'split.memo'),
+    ('tags', """(
+        SELECT group_concat(name, ' ') FROM (
+            SELECT tag.name FROM txn_tag
+            JOIN tag ON tag.id = txn_tag.tag_id
+            WHERE txn_tag.txn_id = txn.id
+            ORDER BY tag.name))"""),
+]
+
+_FLAT_TRANSACTIONS_FROM = """
+FROM txn
+JOIN split ON split.txn_id = txn.id
+JOIN account ON account.id = txn.account_id
+JOIN currency ON currency.id = account.currency_id
+LEFT JOIN payee ON payee.id = txn.payee_id
+LEFT JOIN category_path ON category_path.id = split.category_id
+ORDER BY txn.id, split.id
+"""
+
+
+def export_names():
+    """Get names of everything that can be exported."""
+    return [FLAT_TRANSACTIONS] + sorted(db.metadata.tables)
+
+
+def export(dbc, name, file, output_format='csv'):
+    """Export table rows.
+
+    :param sqlalchemy.engine.Connection dbc: database connection
+    :param str name: table name or FLAT_TRANSACTIONS (see
+        export_names)
+    :param file: text file object. Open it with newline='' for CSV.
+    :param str output_format: see FORMATS
+    :returns: number of exported rows
+    :raises ValueError: unknown table or format
+    """
+    columns = _columns(name)
+    if output_format == 'csv':
+        select_list = ', '.join(expr for _, expr in columns)
+        write = _csv_writer(file, [column for column, _ in columns])
+    elif output_format == 'jsonl':
+        select_list = 'json_object({})'.format(', '.join(
+            f"'{column}', {expr}" for column, expr in columns))
+        write = _jsonl_writer(file)
+    else:
+        raise ValueError(f'Unknown export format "{output_format}"')
+    sql = _query(name, select_list)
+
+    cursor = dbc.connection.cursor()
+    count = 0
+    try:
+        cursor.execute(sql)
+        while True:
+            rows = cursor.fetchmany(_BATCH_SIZE)
+            if not rows:
+                break
+            write(rows)
+            count += len(rows)
+    finally:
+        cursor.close()
+    return count
+
+
+def _columns(name):
+    """Get output columns.
+
+    :returns: list of (column name, SQL expression)
+    """
+    if name == FLAT_TRANSACTIONS:
+        return _FLAT_TRANSACTIONS_COLUMNS
+    try:
+        table = db.metadata.tables[name]
+    except KeyError:
+        raise ValueError(f'Unknown table "{name}"') from None
+    # Dates are stored as day ordinals, but exported as ISO strings
+    return [(column.name,
+             f'date("{table.name}"."{column.name}" + {db.JULIAN_DAY_OFFSET})'
+             if isinstance(column.type, db.OrdinalDate)
+             else f'"{table.name}"."{column.name}"')
+            for column in table.columns]
+
+
+def _query(name, select_list):
+    if name == FLAT_TRANSACTIONS:
+        return (_FLAT_TRANSACTIONS_WITH + 'SELECT ' + select_list
+                + _FLAT_TRANSACTIONS_FROM)
+    table = db.metadata.tables[name]
+    order = ', '.join(f'"{column.name}"' for column in table.primary_key)
+    return f'SELECT {select_list} FROM "{table.name}" ORDER BY {order}'
+
+
+def _csv_writer(file, header):
+    writer = csv.writer(file)
+    writer.writerow(header)
+    return writer.writerows
+
+
+def _jsonl_writer(file):
+    def write(rows):
+        file.write('\n'.join(row[0] for row in rows))
+        file.write('\n')
+    return write
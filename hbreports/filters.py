@@ -0,0 +1,120 @@
+"""Report filter.
+
+One filter works for all report generators. Criteria are compiled
+into predicates on plain indexed columns: date ranges, IN lists and
+IN subqueries. Columns are never wrapped in functions (like
+strftime), so SQLite can use indexes.
+"""
+
+import collections
+
+from sqlalchemy.sql import and_, select
+
+from hbreports.db import (
+    account,
+    category,
+    category_closure,
+    split,
+    tag,
+    txn,
+    txn_tag,
+)
+
+
+_CRITERIA = [
+    # datetime.date, inclusive
+    'from_date',
+    'to_date',
+    # account names
+    'accounts',
+    # category names, subcategories are included
+    'categories',
+    # TxnStatus values
+    'statuses',
+    # Paymode values
+    'paymodes',
+    # tag names
+    'tags',
+]
+
+
+class ReportFilter(collections.namedtuple(
+        'ReportFilter', _CRITERIA, defaults=[None] * len(_CRITERIA))):
+    """Filter for transactions processed by a report.
+
+    All criteria are optional (None). Lists mean "any of". Filter
+    narrows selection of a report, e.g. ABC report processes only
+    reconciled transactions whatever statuses are.
+    """
+
+    __slots__ = ()
+
+    def criteria(self):
+        """Get names of criteria that are set."""
+        return [name for name, value in zip(self._fields, self)
+                if value is not None]
+
+    def key(self):
+        """Get hashable representation (lists become tuples)."""
+        return tuple(tuple(value) if isinstance(value, list) else value
+                     for value in self)
+
+    def txn_conditions(self, split_joined=True, split_table=split):
+        """Get predicates for a query with transactions.
+
+        :param bool split_joined: query has a row per split (split
+            table is joined). Otherwise category criterion selects
+            transactions with at least one split in categories.
+        :param split_table: joined table of splits (split or
+            split_sample)
+        :returns: list of SQL expressions
+        """
+        conditions = []
+        if self.from_date is not None and self.to_date is not None:
+            conditions.append(txn.c.date.between(self.from_date,
+                                                 self.to_date))
+        elif self.from_date is not None:
+            conditions.append(txn.c.date >= self.from_date)
+        elif self.to_date is not None:
+            conditions.append(txn.c.date <= self.to_date)
+        if self.accounts is not None:
+            conditions.append(txn.c.account_id.in_(
+                select([account.c.id])
+                .where(and_(*self.account_conditions()))))
+        if self.statuses is not None:
+            conditions.append(txn.c.status.in_(self.statuses))
+        if self.paymodes is not None:
+            conditions.append(txn.c.paymode.in_(self.paymodes))
+        if self.tags is not None:
+            conditions.append(txn.c.id.in_(
+                select([txn_tag.c.txn_id])
+                .select_from(txn_tag.join(tag, tag.c.id == txn_tag.c.tag_id))
+                .where(tag.c.name.in_(self.tags))))
+        if self.categories is not None:
+            categories = self._category_ids()
+            if split_joined:
+                conditions.append(
+                    split_table.c.category_id.in_(categories))
+            else:
+                conditions.append(txn.c.id.in_(
+                    select([split.c.txn_id])
+                    .where(split.c.category_id.in_(categories))))
+        return conditions
+
+    def account_conditions(self):
+        """Get predicates for a query with accounts.
+
+        :returns: list of SQL expressions
+        """
+        if self.accounts is None:
+            return []
+        return [account.c.name.in_(self.accounts)]
+
+    def _category_ids(self):
+        """Query ids of selected categories and their subcategories."""
+        return (
+            select([category_closure.c.descendant_id])
+            .select_from(category_closure.join(
+                category, category.c.id == category_closure.c.ancestor_id))
+            .where(category.c.name.in_(self.categories))
+        )
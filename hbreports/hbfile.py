@@ -5,21 +5,43 @@ import of data from such files.
 
 """
 
+import bz2
 import collections
-import datetime
 import enum
 from functools import partial
+import gzip
+import io
+import lzma
+import os
+from xml.parsers import expat
 import xml.etree.ElementTree as ET
 
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql import select
 
-from hbreports import db
+from hbreports import db, derived, statements
 from hbreports.common import Paymode
 
 
 # Delimiter for samt, scat, smem (in XHB file)
 _SPLIT_DELIMITER = '||'
 
+# Buffer size for reading files. Large buffer means fewer system
+# calls and decompressor invocations.
+_READ_BUFFER_SIZE = 1024 * 1024
+
+# Openers for compressed files by magic bytes
+_COMPRESSED_OPENERS = [
+    (b'\x1f\x8b', gzip.open),
+    (b'BZh', bz2.open),
+    (b'\xfd7zXZ\x00', lzma.open),
+]
+
+# Number of XML elements imported in one transaction by
+# checkpointed_import. Write-ahead log is checkpointed after every
+# batch, so it doesn't grow much beyond a batch size (a few MiB).
+CHECKPOINT_INTERVAL = 10000
+
 
 class CategoryFlag(enum.IntFlag):
     SUB = 1
@@ -52,16 +74,147 @@ class DataImportError(Exception):
     """Failed to import data from HomeBank file."""
 
 
-def initial_import(file_object, dbc):
+def open_xhb(path):
+    """Open HomeBank file for import.
+
+    Compressed files (gzip, bzip2, xz) are decompressed on the
+    fly. Compression is detected by file content, not by extension.
+
+    :returns: binary file object
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(6)
+    for prefix, opener in _COMPRESSED_OPENERS:
+        if magic.startswith(prefix):
+            return io.BufferedReader(opener(path),
+                                     buffer_size=_READ_BUFFER_SIZE)
+    return open(path, 'rb', buffering=_READ_BUFFER_SIZE)
+
+
+def initial_import(file_object, dbc, parser='expat'):
     """Import data from file for the first time.
 
     :param file_object: file-like object with XHB data
     :param sqlalchemy.engine.Connectable dbc: database connection
+    :param str parser: parser engine name (see PARSERS)
+
+    :raises DataImportError:
+    """
+    _get_parser_class(parser)(dbc).parse(file_object)
+    derived.refresh(dbc)
+
+
+def checkpointed_import(xhb_path, engine, resume=False, parser='expat',
+                        checkpoint_interval=None):
+    """Import data from file committing in batches.
+
+    Progress (number of elements and byte offset) is saved in
+    "import_state" table with every batch. If import fails, committed
+    batches stay in the database and import may be resumed: elements
+    imported before are parsed again, but skipped. Derived data is
+    refreshed and database is marked complete at the very end.
+
+    Readers of a WAL database (see db.init_db) are not blocked by the
+    import.
+
+    :param str xhb_path: path to HomeBank file
+    :param sqlalchemy.engine.Engine engine: database engine
+    :param bool resume: continue interrupted import
+    :param str parser: parser engine name (see PARSERS)
+    :param int checkpoint_interval: number of elements in a batch
+        (CHECKPOINT_INTERVAL by default)
 
     :raises DataImportError:
     """
-    parser = _StreamParser(dbc)
-    parser.parse(file_object)
+    parser_class = _get_parser_class(parser)
+    if checkpoint_interval is None:
+        checkpoint_interval = CHECKPOINT_INTERVAL
+    stat = os.stat(xhb_path)
+
+    with engine.connect() as dbc, db.manual_wal_checkpoints(dbc):
+        transaction = dbc.begin()
+        try:
+            if resume:
+                skip = _check_resumable(dbc, stat)
+            else:
+                dbc.execute(db.import_state.insert().values(
+                    id=1,
+                    xhb_size=stat.st_size,
+                    xhb_mtime_ns=stat.st_mtime_ns,
+                    elements=0,
+                    byte_offset=0,
+                    complete=False))
+                skip = 0
+
+            def checkpoint(elements, byte_offset):
+                nonlocal transaction
+                dbc.execute(db.import_state.update().values(
+                    elements=elements,
+                    byte_offset=byte_offset))
+                transaction.commit()
+                db.checkpoint_wal(dbc)
+                transaction = dbc.begin()
+
+            stream_parser = parser_class(
+                dbc, skip=skip, checkpoint=checkpoint,
+                checkpoint_interval=checkpoint_interval)
+            with open_xhb(xhb_path) as f:
+                stream_parser.parse(f)
+            derived.refresh(dbc)
+            dbc.execute(db.import_state.update().values(
+                elements=stream_parser.elements,
+                byte_offset=None,
+                complete=True))
+            transaction.commit()
+            db.checkpoint_wal(dbc, truncate=True)
+        except SQLAlchemyError as exc:
+            # Commits, checkpoints and refresh, e.g. disk is full.
+            # Committed batches are kept.
+            transaction.rollback()
+            raise DataImportError(
+                'Database error: ' + str(getattr(exc, 'orig', exc))) from exc
+        except BaseException:
+            # KeyboardInterrupt too: committed batches are kept
+            transaction.rollback()
+            raise
+
+
+def read_import_state(dbc):
+    """Get progress of checkpointed import.
+
+    :returns: row of "import_state" table or None if database was not
+        imported with checkpoints
+    """
+    if not dbc.dialect.has_table(dbc, db.import_state.name):
+        # database created by older version
+        return None
+    return dbc.execute(select([db.import_state])).first()
+
+
+def _check_resumable(dbc, stat):
+    """Check that interrupted import may be resumed.
+
+    :param os.stat_result stat: HomeBank file status
+    :returns: number of imported elements
+    :raises DataImportError:
+    """
+    state = read_import_state(dbc)
+    if state is None:
+        raise DataImportError('There is no import to resume')
+    if state.complete:
+        raise DataImportError('Import is already complete')
+    if (state.xhb_size, state.xhb_mtime_ns) != (stat.st_size,
+                                                stat.st_mtime_ns):
+        raise DataImportError('HomeBank file was changed after import'
+                              ' had started. Start a new import.')
+    return state.elements
+
+
+def _get_parser_class(name):
+    try:
+        return PARSERS[name]
+    except KeyError:
+        raise ValueError(f'Unknown parser "{name}"') from None
 
 
 class _StreamParser:
@@ -74,13 +227,35 @@ class _StreamParser:
 
     Define method named "_handle_TAG" to handle elements with tag
     "TAG".
+
+    This parser is based on ElementTree.
+
+    :param int skip: number of elements to skip (already imported)
+    :param callable checkpoint: function called with number of
+        elements and byte offset (or None) after every batch of
+        elements
+    :param int checkpoint_interval: number of elements in a batch
     """
 
     _HANDLER_PREFIX = '_handle_'
 
-    def __init__(self, db_connection):
+    def __init__(self, db_connection, skip=0, checkpoint=None,
+                 checkpoint_interval=CHECKPOINT_INTERVAL):
         self._dbc = db_connection
+        self._skip = skip
+        self._checkpoint = checkpoint
+        self._checkpoint_interval = checkpoint_interval
+        # Number of elements seen
+        self.elements = 0
         self._processed_homebank_element = False
+        # Tag ids by name
+        self._tag_ids = {}
+        # Handlers by tag
+        self._handlers = {
+            name[len(self._HANDLER_PREFIX):]: getattr(self, name)
+            for name in dir(self)
+            if name.startswith(self._HANDLER_PREFIX)
+        }
 
     def parse(self, file_object):
         """Parse file.
@@ -88,35 +263,63 @@ class _StreamParser:
         :raises DataImportError:
         """
         self._processed_homebank_element = False
+        self.elements = 0
+        # Tags may be created by previous (interrupted) import
+        self._tag_ids = {
+            row.name: row.id
+            for row in self._dbc.execute(select([db.tag.c.id, db.tag.c.name]))
+        }
 
         try:
-            for event, elem in ET.iterparse(file_object, events=['start']):
-                try:
-                    self._do_handle_element(elem)
-                except SQLAlchemyError as exc:
-                    raise DataImportError(
-                        f'Failed to import data from "{elem.tag}" element '
-                        'due to a database error') from exc
-        except ET.ParseError as exc:
+            self._parse_xml(file_object)
+        except (ET.ParseError, expat.ExpatError) as exc:
             raise DataImportError(
                 'XML parsing error.'
                 ' This is probably not a HomeBank file.') from exc
+        except (OSError, EOFError, lzma.LZMAError) as exc:
+            # Corrupt or truncated compressed file
+            raise DataImportError(
+                f'Failed to read HomeBank file: {exc}') from exc
 
         if not self._processed_homebank_element:
             raise DataImportError('This is not a HomeBank file.')
 
-    def _do_handle_element(self, elem):
+    def _parse_xml(self, file_object):
+        """Parse XML and call _do_handle_element for every element."""
+        for event, elem in ET.iterparse(file_object, events=['start']):
+            self._do_handle_element(elem.tag, elem.attrib)
+
+    def _do_handle_element(self, tag, attrib):
         """Handle XML element.
 
         Name is prefixed to avoid clash with custom handler methods.
         """
-        try:
-            handler = getattr(self, self._HANDLER_PREFIX + elem.tag)
-        except AttributeError:
-            # ignoring unknown elements
-            pass
-        else:
-            handler(_ElementWrapper(elem))
+        self.elements += 1
+        # Root element writes nothing, but it's required to accept
+        # the file.
+        if self.elements <= self._skip and tag != 'homebank':
+            return
+        handler = self._handlers.get(tag)
+        if handler is not None:
+            try:
+                handler(_ElementWrapper(tag, attrib))
+            except SQLAlchemyError as exc:
+                raise DataImportError(
+                    f'Failed to import data from "{tag}" element '
+                    'due to a database error') from exc
+        # unknown elements are ignored, but counted
+
+        if (self._checkpoint is not None
+                and self.elements > self._skip
+                and self.elements % self._checkpoint_interval == 0):
+            self._checkpoint(self.elements, self._byte_offset())
+
+    def _byte_offset(self):
+        """Get position of current element in XML data.
+
+        :returns: int or None if unknown
+        """
+        return None
 
     def _handle_homebank(self, elem):
         """Handle root element."""
@@ -126,56 +329,61 @@ class _StreamParser:
 
     def _handle_cur(self, elem):
         """Handle currency."""
-        self._dbc.execute(
-            db.currency.insert().values(
-                id=elem.key,
-                name=elem.name))
+        statements.execute(self._dbc, _INSERT_CURRENCY, {
+            'id': elem.key,
+            'name': elem.name})
 
     def _handle_account(self, elem):
-        self._dbc.execute(
-            db.account.insert().values(
-                id=elem.key,
-                name=elem.name,
-                initial=elem.initial,
-                currency_id=elem.curr))
+        statements.execute(self._dbc, _INSERT_ACCOUNT, {
+            'id': elem.key,
+            'name': elem.name,
+            'initial': elem.initial,
+            'currency_id': elem.curr})
 
     def _handle_pay(self, elem):
         """Handle payee."""
-        self._dbc.execute(
-            db.payee.insert().values(
-                id=elem.key,
-                name=elem.name))
+        statements.execute(self._dbc, _INSERT_PAYEE, {
+            'id': elem.key,
+            'name': elem.name})
 
     def _handle_cat(self, elem):
         """Handle category."""
         # TODO: Are subcategories of income categories explicitly marked
         # as income? We should mark anyway.
-        self._dbc.execute(
-            db.category.insert().values(
-                id=elem.key,
-                name=elem.name,
-                parent_id=elem.parent,
-                income=bool(elem.flags & CategoryFlag.INCOME)))
+        statements.execute(self._dbc, _INSERT_CATEGORY, {
+            'id': elem.key,
+            'name': elem.name,
+            'parent_id': elem.parent,
+            'income': bool(elem.flags & CategoryFlag.INCOME)})
+
+    def _get_tag_id(self, name):
+        """Get tag id. Create tag if necessary."""
+        tag_id = self._tag_ids.get(name)
+        if tag_id is None:
+            result = statements.execute(self._dbc, _INSERT_TAG,
+                                        {'name': name})
+            tag_id = self._tag_ids[name] = result.inserted_primary_key[0]
+        return tag_id
 
     def _handle_ope(self, elem):
         """Handle operation (transaction)."""
         # TODO: check if paymode and status values are in enums and
         # issue warnings?
-        result = self._dbc.execute(
-            db.txn.insert().values(
-                date=elem.date,
-                account_id=elem.account,
-                status=elem.st,
-                payee_id=elem.payee,
-                memo=elem.wording,
-                info=elem.info,
-                paymode=elem.paymode))
+        result = statements.execute(self._dbc, _INSERT_TXN, {
+            'date': elem.date,
+            'account_id': elem.account,
+            'status': elem.st,
+            'payee_id': elem.payee,
+            'memo': elem.wording,
+            'info': elem.info,
+            'paymode': elem.paymode})
         txn_id = result.inserted_primary_key[0]
 
-        for tag in elem.tags:
-            self._dbc.execute(db.txn_tag.insert().values(
-                txn_id=txn_id,
-                name=tag))
+        # dict removes duplicates and keeps order
+        tags = [{'txn_id': txn_id, 'tag_id': self._get_tag_id(tag)}
+                for tag in dict.fromkeys(elem.tags)]
+        if tags:
+            statements.execute(self._dbc, _INSERT_TXN_TAG, tags)
 
         if _is_multipart(elem):
             _process_multipart_transaction(elem, txn_id, self._dbc)
@@ -183,21 +391,68 @@ class _StreamParser:
             _process_simple_transaction(elem, txn_id, self._dbc)
 
 
+class _ExpatParser(_StreamParser):
+
+    """Stream parser based on expat.
+
+    Faster than ElementTree-based parser. Elements are not created at
+    all: expat passes tags and attributes directly to handlers. File is
+    read in large chunks.
+    """
+
+    _expat = None
+
+    def _parse_xml(self, file_object):
+        parser = self._expat = expat.ParserCreate()
+        parser.StartElementHandler = self._do_handle_element
+        try:
+            while True:
+                data = file_object.read(_READ_BUFFER_SIZE)
+                if not data:
+                    break
+                parser.Parse(data, False)
+            parser.Parse(b'', True)
+        finally:
+            self._expat = None
+
+    def _byte_offset(self):
+        return self._expat.CurrentByteIndex
+
+
+# Insert statements are built once: they are executed for every
+# element (see hbreports.statements).
+_INSERT_CURRENCY = db.currency.insert()
+_INSERT_ACCOUNT = db.account.insert()
+_INSERT_PAYEE = db.payee.insert()
+_INSERT_CATEGORY = db.category.insert()
+_INSERT_TAG = db.tag.insert()
+_INSERT_TXN = db.txn.insert()
+_INSERT_TXN_TAG = db.txn_tag.insert()
+_INSERT_SPLIT = db.split.insert()
+
+
+# Parser engines by name
+PARSERS = {
+    'etree': _StreamParser,
+    'expat': _ExpatParser,
+}
+
+
 def _is_multipart(elem):
     """Is this a multipart (split) transaction?"""
     return bool(elem.flags & TxnFlag.SPLIT)
 
 
 def _process_multipart_transaction(elem, txn_id, dbc):
-    for amount, category, memo in zip(
+    statements.execute(dbc, _INSERT_SPLIT, [
+        {'amount': amount,
+         'category_id': category,
+         'memo': memo,
+         'txn_id': txn_id}
+        for amount, category, memo in zip(
             elem.samt,
             elem.scat,
-            elem.smem):
-        dbc.execute(db.split.insert().values(
-            amount=amount,
-            category_id=category,
-            memo=memo,
-            txn_id=txn_id))
+            elem.smem)])
 
 
 def _process_simple_transaction(elem, txn_id, dbc):
@@ -205,18 +460,22 @@ def _process_simple_transaction(elem, txn_id, dbc):
 
     This transaction has just one part.
     """
-    dbc.execute(db.split.insert().values(
-            amount=elem.amount,
-            category_id=elem.category,
-            txn_id=txn_id))
+    statements.execute(dbc, _INSERT_SPLIT, {
+        'amount': elem.amount,
+        'category_id': elem.category,
+        'memo': None,
+        'txn_id': txn_id})
 
 
 def _convert_date(date_str):
     """Convert date from HomeBank file format.
 
-    :rtype: datetime.date
+    HomeBank dates are day ordinals like dates in the database (see
+    db.OrdinalDate), so they are stored as is.
+
+    :rtype: int
     """
-    return datetime.date.fromordinal(int(date_str))
+    return int(date_str)
 
 
 def _convert_split_amounts(amounts_str):
@@ -298,8 +557,9 @@ class _ElementWrapper:
 
     _attr_rules = _ATTR_RULES_MAP
 
-    def __init__(self, elem):
-        self._elem = elem
+    def __init__(self, tag, attrib):
+        self._tag = tag
+        self._attrib = attrib
 
     def __getattr__(self, name):
         """XML attrbute access."""
@@ -307,9 +567,9 @@ class _ElementWrapper:
             'Unknown attribute rule requested'
         rule = self._attr_rules[name]
         try:
-            return rule.converter(self._elem.attrib[name])
+            return rule.converter(self._attrib[name])
         except KeyError:
             if rule.default is _ATTR_NO_DEFAULT:
                 raise DataImportError(
-                    f'Required attribute "{self._elem.tag}.{name}" not found')
+                    f'Required attribute "{self._tag}.{name}" not found')
             return rule.default
@@ -0,0 +1,170 @@
+"""Memory profiling.
+
+Profiler records time and memory of named phases (import, report
+generation, rendering, etc.) with tracemalloc: traced memory at the
+start and the end of a phase, peak during the phase and top
+allocation sites of memory retained by the phase.
+
+Code marks its phases with phase(). It costs nothing unless a
+profiler is active. Phases may be nested: names are joined with "/"
+and peaks of nested phases count for outer phases too.
+
+Only memory allocated by Python is traced. Memory of SQLite page
+cache and other C libraries is not included.
+
+Peak of a phase is exact with Python 3.9+ (tracemalloc.reset_peak).
+Older versions only know the peak since tracing started, so peaks are
+upper bounds there.
+"""
+
+import contextlib
+import json
+import sys
+import time
+import tracemalloc
+
+
+# Active profiler (see MemoryProfiler.__enter__)
+_profiler = None
+
+# Allocations made by the profiler itself are not interesting
+_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+]
+
+_MIB = 1024 * 1024
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Profile phase with active profiler (does nothing without one).
+
+    :param str name: phase name
+    """
+    if _profiler is None:
+        yield
+    else:
+        with _profiler.phase(name):
+            yield
+
+
+class MemoryProfiler:
+    """Memory profiler (context manager).
+
+    Tracing starts on enter and stops on exit (unless it had been
+    started before). The profiler becomes active for phase() while
+    it's entered.
+
+    :param int top: number of top allocation sites per phase
+    """
+
+    def __init__(self, top=10):
+        self._top = top
+        # Finished phases in order of start
+        self.phases = []
+        # Unfinished phases (innermost last)
+        self._stack = []
+        self._started_tracing = False
+        self._previous_profiler = None
+
+    def __enter__(self):
+        global _profiler
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._previous_profiler = _profiler
+        _profiler = self
+        return self
+
+    def __exit__(self, *exc_info):
+        global _profiler
+        _profiler = self._previous_profiler
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Profile phase.
+
+        :param str name: phase name
+        """
+        if self._stack:
+            name = self._stack[-1]['name'] + '/' + name
+        before = tracemalloc.take_snapshot().filter_traces(_FILTERS)
+        # Peak so far belongs to the outer phase
+        self._update_peak(tracemalloc.get_traced_memory()[1])
+        _reset_peak()
+        start_bytes = tracemalloc.get_traced_memory()[0]
+        record = {
+            'name': name,
+            'seconds': None,
+            'start_bytes': start_bytes,
+            'peak_bytes': start_bytes,
+            'end_bytes': None,
+            'top': None,
+        }
+        self.phases.append(record)
+        self._stack.append(record)
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            record['seconds'] = time.perf_counter() - start_time
+            current, peak = tracemalloc.get_traced_memory()
+            self._update_peak(peak)
+            self._stack.pop()
+            # Outer phase includes this one
+            self._update_peak(record['peak_bytes'])
+            record['end_bytes'] = current
+            after = tracemalloc.take_snapshot().filter_traces(_FILTERS)
+            record['top'] = [
+                {'site': str(stat.traceback),
+                 'size_bytes': stat.size_diff,
+                 'count': stat.count_diff}
+                for stat in after.compare_to(before, 'lineno')[:self._top]
+                if stat.size_diff > 0]
+
+    def _update_peak(self, peak):
+        if self._stack:
+            record = self._stack[-1]
+            record['peak_bytes'] = max(record['peak_bytes'], peak)
+
+    def peak_phase(self):
+        """Get the phase with the highest peak (or None)."""
+        return max(self.phases, key=lambda record: record['peak_bytes'],
+                   default=None)
+
+    def write_json(self, file):
+        """Write results as JSON.
+
+        :param file: text file object
+        """
+        json.dump({
+            'python': sys.version.split()[0],
+            'exact_peaks': hasattr(tracemalloc, 'reset_peak'),
+            'phases': self.phases,
+        }, file, indent=2)
+        file.write('\n')
+
+
+def check_budget(profiler, budget_mib):
+    """Check peak memory of all phases.
+
+    :param MemoryProfiler profiler: finished profiler
+    :param float budget_mib: memory budget (MiB)
+    :returns: error message or None if the budget is not exceeded
+    """
+    record = profiler.peak_phase()
+    if record is None or record['peak_bytes'] <= budget_mib * _MIB:
+        return None
+    return (f'Memory budget exceeded: phase "{record["name"]}" peak is'
+            f' {record["peak_bytes"] / _MIB:.1f} MiB'
+            f' (budget {budget_mib:g} MiB)')
+
+
+def _reset_peak():
+    # Python 3.9+
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
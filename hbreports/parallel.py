@@ -0,0 +1,165 @@
+"""Concurrent report generation.
+
+Every report is generated on its own read-only database
+connection. Threads work well for reports, because SQLite releases the
+GIL while running queries. Use processes for reports with a lot of
+post-processing in Python.
+
+A single report can be generated in parallel too. Generators with
+mergeable results (sums and counts, see "mergeable" attribute) split
+their date range into shards with about the same number of
+transactions. Every shard is queried on its own connection, partial
+results are merged.
+
+Partitions of partitioned databases (see hbreports.partitions) are
+attached by date range of a report or a shard.
+"""
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import datetime
+
+from sqlalchemy import func
+from sqlalchemy.sql import and_, select
+
+from hbreports import db, partitions
+
+
+async def generate_many(db_path, report_gens, processes=False,
+                        max_workers=None, immutable=False, shards=1):
+    """Generate reports concurrently.
+
+    :param str db_path: path to database file
+    :param report_gens: iterable of report generators. Generators must
+        be picklable when using processes.
+    :param bool processes: use process pool instead of thread pool
+    :param int max_workers: maximum number of workers (default depends
+        on executor)
+    :param bool immutable: database is not modified while reports are
+        generated (see db.open_readonly_db)
+    :param int shards: number of date range shards of every mergeable
+        report. Shards are queried in separate read transactions, so
+        the database must not be modified meanwhile for consistent
+        results.
+    :returns: list of reports in the same order as generators
+    """
+    report_gens = list(report_gens)
+    if not report_gens:
+        return []
+    executor_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with executor_class(max_workers) as executor:
+        return await asyncio.gather(*[
+            _generate(executor, db_path, report_gen, immutable, shards)
+            for report_gen in report_gens])
+
+
+async def _generate(executor, db_path, report_gen, immutable, shards):
+    """Generate report in executor (sharded if possible)."""
+    loop = asyncio.get_running_loop()
+    if shards < 2 or not getattr(report_gen, 'mergeable', False):
+        return await loop.run_in_executor(
+            executor, generate_report, db_path, report_gen, immutable)
+    report_shards = await loop.run_in_executor(
+        executor, shard_report, db_path, report_gen, shards, immutable)
+    partials = await asyncio.gather(*[
+        loop.run_in_executor(
+            executor, generate_partial, db_path, report_shard, immutable)
+        for report_shard in report_shards])
+    return report_gen.merge_partials(partials)
+
+
+def generate_many_sync(db_path, report_gens, processes=False,
+                       max_workers=None, immutable=False, shards=1):
+    """Synchronous version of :func:`generate_many`.
+
+    Can't be called from a running event loop.
+    """
+    return asyncio.run(generate_many(
+        db_path, report_gens,
+        processes=processes,
+        max_workers=max_workers,
+        immutable=immutable,
+        shards=shards))
+
+
+def generate_report(db_path, report_gen, immutable=False):
+    """Generate report using a new read-only connection."""
+    engine = db.open_readonly_db(db_path, immutable=immutable)
+    try:
+        with engine.connect() as dbc:
+            return partitions.generate_report(dbc, report_gen)
+    finally:
+        engine.dispose()
+
+
+def generate_partial(db_path, report_gen, immutable=False):
+    """Generate partial result of mergeable report using a new
+    read-only connection.
+    """
+    engine = db.open_readonly_db(db_path, immutable=immutable)
+    try:
+        with engine.connect() as dbc:
+            return partitions.generate_partial(dbc, report_gen)
+    finally:
+        engine.dispose()
+
+
+def shard_report(db_path, report_gen, shards, immutable=False):
+    """Split mergeable report generator by date range.
+
+    :param int shards: maximum number of shards
+    :returns: list of generators (see shard method of generators)
+    """
+    engine = db.open_readonly_db(db_path, immutable=immutable)
+    try:
+        with engine.connect() as dbc:
+            partitions.attach(dbc, *report_gen.date_range())
+            date_ranges = split_date_range(
+                dbc, *report_gen.date_range(), shards)
+    finally:
+        engine.dispose()
+    return [report_gen.shard(from_date, to_date)
+            for from_date, to_date in date_ranges]
+
+
+def split_date_range(dbc, from_date, to_date, shards):
+    """Split date range into ranges with about the same number of
+    transactions.
+
+    Transactions of a day are never split, so there are fewer ranges
+    if there are few days with transactions.
+
+    :param from_date: first date (inclusive) or None
+    :param to_date: last date (inclusive) or None
+    :param int shards: maximum number of ranges
+    :returns: list of (from_date, to_date) tuples covering the whole
+        range in order
+    """
+    if shards < 2:
+        return [(from_date, to_date)]
+    conditions = []
+    if from_date is not None:
+        conditions.append(db.txn.c.date >= from_date)
+    if to_date is not None:
+        conditions.append(db.txn.c.date <= to_date)
+    count = dbc.execute(
+        select([func.count()]).select_from(db.txn)
+        .where(and_(*conditions))).scalar()
+    if not count:
+        return [(from_date, to_date)]
+
+    # Quantiles are looked up in date index
+    dates = select([db.txn.c.date]).where(and_(*conditions)).limit(1)
+    first = dbc.execute(dates.order_by(db.txn.c.date)).scalar()
+    boundaries = []
+    for i in range(1, shards):
+        boundary = dbc.execute(
+            dates.order_by(db.txn.c.date).offset(count * i // shards)
+        ).scalar()
+        if boundary > (boundaries[-1] if boundaries else first):
+            boundaries.append(boundary)
+
+    starts = [from_date] + boundaries
+    ends = [boundary - datetime.timedelta(days=1)
+            for boundary in boundaries] + [to_date]
+    return list(zip(starts, ends))
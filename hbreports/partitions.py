@@ -0,0 +1,320 @@
+"""Year-partitioned storage.
+
+Transactions of a big database can be moved to partition files: a
+file per year (or per several years) with its own txn, split and
+txn_tag tables. The main database keeps everything else including
+derived tables. Every file is smaller, so it's easier to vacuum, back
+up and cache.
+
+Reports attach partitions on demand (see attach). Only partitions
+overlapping the date range of a report are attached (partition
+pruning). Temporary views named after partitioned tables shadow the
+empty main tables: SQLite looks up unqualified names in the temp
+schema first. So report queries don't change. With a single attached
+partition the views are flattened and partition indexes are used as
+usual. Queries over several partitions go through UNION ALL views:
+SQLite pushes WHERE conditions into every partition, but may build
+temporary indexes for joins.
+
+Partitions of past years are closed: their files are made read-only
+and attached as immutable (no locking, no change detection) with a
+big memory map. Only the last partition is attached as a regular
+read-only file.
+
+SQLite attaches at most 10 databases to a connection, so databases
+are split into 10 partition files at most (long histories get more
+years per file). Commands reading all transactions (search, export,
+etc.) attach every partition.
+
+Other limitations:
+
+* partitioned databases are not updated. Import data to a new
+  database and partition it again;
+* partitions are attached with URI file names, so use connections of
+  db.open_readonly_db.
+"""
+
+import datetime
+import os
+import stat
+import urllib.parse
+
+from sqlalchemy import (
+    Column,
+    Index,
+    MetaData,
+    Table,
+    create_engine,
+    func,
+)
+from sqlalchemy.sql import select, text
+
+from hbreports import db
+
+
+class PartitionError(Exception):
+    """Database can't be partitioned or partitions can't be attached."""
+
+
+# Tables moved to partitions. Foreign keys can't reference tables of
+# another database, so partition tables have none.
+_partition_metadata = MetaData()
+
+
+def _partition_table(table):
+    partition_table = Table(
+        table.name,
+        _partition_metadata,
+        *[Column(column.name, column.type,
+                 primary_key=column.primary_key,
+                 nullable=column.nullable)
+          for column in table.columns],
+        **table.kwargs)
+    for index in table.indexes:
+        Index(index.name,
+              *[partition_table.c[column.name] for column in index.columns])
+    return partition_table
+
+
+PARTITIONED_TABLES = [_partition_table(table)
+                      for table in (db.txn, db.split, db.txn_tag)]
+
+# Rows of partition tables selected from main tables by date range
+# (:first_date, :last_date are ordinals).
+_COPY_ROWS = {
+    'txn': """
+        SELECT txn.* FROM main.txn
+        WHERE txn.date BETWEEN :first_date AND :last_date""",
+    'split': """
+        SELECT split.* FROM main.split
+        JOIN main.txn ON txn.id = split.txn_id
+        WHERE txn.date BETWEEN :first_date AND :last_date""",
+    'txn_tag': """
+        SELECT txn_tag.* FROM main.txn_tag
+        JOIN main.txn ON txn.id = txn_tag.txn_id
+        WHERE txn.date BETWEEN :first_date AND :last_date""",
+}
+
+# Memory map of closed partitions. Their files never change, so the
+# map is never invalidated.
+_CLOSED_MMAP_SIZE = 1024 * 1024 * 1024
+
+_NAME_PREFIX = 'partition_'
+
+# Maximum number of attached databases (SQLITE_MAX_ATTACHED default)
+MAX_ATTACHED = 10
+
+
+def partition_db(db_path, years_per_file=1):
+    """Move transactions of database to partition files.
+
+    Partition files are created next to the database: "my.2019.db",
+    "my.2010-2014.db", etc.
+
+    :param str db_path: path to complete database file
+    :param int years_per_file: minimum number of years in a partition.
+        It's increased if more than MAX_ATTACHED partitions would be
+        needed.
+    :returns: list of partition file paths
+    :raises PartitionError: database is already partitioned or
+        partition file exists. Nothing is changed then, as well as on
+        other errors.
+    :raises ValueError: years_per_file is not positive
+    """
+    if years_per_file < 1:
+        raise ValueError('Number of years per file must be positive')
+    engine = db.init_db(db_path)
+    try:
+        with engine.connect() as dbc:
+            if dbc.execute(select([func.count()])
+                           .select_from(db.txn_partition)).scalar():
+                raise PartitionError(
+                    f'Database "{db_path}" is already partitioned')
+            first_date, last_date = dbc.execute(
+                select([func.min(db.txn.c.date),
+                        func.max(db.txn.c.date)])).first()
+            if first_date is None:
+                return []
+            # All partitions must be attachable at once
+            years = last_date.year - first_date.year + 1
+            years_per_file = max(years_per_file, -(-years // MAX_ATTACHED))
+            partitions = _plan_partitions(
+                db_path, first_date.year, last_date.year, years_per_file)
+            paths = [_full_path(db_path, partition['path'])
+                     for partition in partitions]
+            for path in paths:
+                if os.path.exists(path):
+                    raise PartitionError(
+                        f'Partition file "{path}" already exists')
+            try:
+                for partition, path in zip(partitions, paths):
+                    _create_partition(dbc, path, partition)
+                with dbc.begin():
+                    for table in reversed(PARTITIONED_TABLES):
+                        dbc.execute(f'DELETE FROM main.{table.name}')
+                    dbc.execute(db.txn_partition.insert(), partitions)
+            except BaseException:
+                # Main tables are intact
+                for path in paths:
+                    if os.path.exists(path):
+                        os.remove(path)
+                raise
+            dbc.execute('VACUUM')
+    finally:
+        engine.dispose()
+
+    for partition, path in zip(partitions, paths):
+        if partition['closed']:
+            mode = os.stat(path).st_mode
+            os.chmod(path, mode & ~(stat.S_IWUSR | stat.S_IWGRP
+                                    | stat.S_IWOTH))
+    return paths
+
+
+def _plan_partitions(db_path, first_year, last_year, years_per_file):
+    """Get txn_partition rows (all but the last partition are closed)."""
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    partitions = []
+    for year in range(first_year, last_year + 1, years_per_file):
+        end_year = min(year + years_per_file - 1, last_year)
+        years = str(year) if year == end_year else f'{year}-{end_year}'
+        partitions.append({
+            'name': f'{_NAME_PREFIX}{year}',
+            'path': f'{stem}.{years}.db',
+            'first_date': datetime.date(year, 1, 1),
+            'last_date': datetime.date(end_year, 12, 31),
+            'closed': end_year < last_year,
+        })
+    return partitions
+
+
+def _create_partition(dbc, path, partition):
+    """Create partition file and copy rows of main tables to it."""
+    engine = create_engine('sqlite:///' + path)
+    try:
+        _partition_metadata.create_all(engine)
+    finally:
+        engine.dispose()
+
+    name = partition['name']
+    dbc.execute(text(f'ATTACH DATABASE :path AS {name}'), path=path)
+    try:
+        with dbc.begin():
+            for table in PARTITIONED_TABLES:
+                dbc.execute(
+                    text(f'INSERT INTO {name}.{table.name}'
+                         + _COPY_ROWS[table.name]),
+                    first_date=partition['first_date'].toordinal(),
+                    last_date=partition['last_date'].toordinal())
+    finally:
+        dbc.execute(f'DETACH DATABASE {name}')
+
+
+def generate_report(dbc, report_gen):
+    """Generate report attaching partitions it needs.
+
+    :param sqlalchemy.engine.Connection dbc: connection of
+        db.open_readonly_db
+    :raises PartitionError: too many partitions
+    """
+    attach_report(dbc, report_gen)
+    return report_gen.generate_report(dbc)
+
+
+def attach_report(dbc, report_gen):
+    """Attach partitions report queries read.
+
+    Only partitions overlapping the date range of mergeable reports
+    are attached.
+
+    :param sqlalchemy.engine.Connection dbc: connection of
+        db.open_readonly_db
+    :raises PartitionError: too many partitions
+    """
+    if getattr(report_gen, 'mergeable', False):
+        attach(dbc, *report_gen.date_range())
+    elif getattr(report_gen, 'reads_transactions', True):
+        attach(dbc)
+
+
+def generate_partial(dbc, report_gen):
+    """Generate partial result of mergeable report attaching
+    partitions it needs.
+
+    See generate_report.
+    """
+    attach(dbc, *report_gen.date_range())
+    return report_gen.generate_partial(dbc)
+
+
+def _query_partitions(dbc, from_date, to_date):
+    """Query partitions overlapping date range (in order of dates)."""
+    # Databases created before partitioning support
+    if not dbc.dialect.has_table(dbc, db.txn_partition.name):
+        return []
+    p = db.txn_partition.c
+    query = select([db.txn_partition]).order_by(p.first_date)
+    if from_date is not None:
+        query = query.where(p.last_date >= from_date)
+    if to_date is not None:
+        query = query.where(p.first_date <= to_date)
+    return dbc.execute(query).fetchall()
+
+
+def attach(dbc, from_date=None, to_date=None):
+    """Attach partitions overlapping date range.
+
+    Does nothing for databases that are not partitioned. Partitions
+    attached before are detached first, so a connection may be reused
+    for another date range. Call outside of transactions.
+
+    :param sqlalchemy.engine.Connection dbc: connection of
+        db.open_readonly_db
+    :param from_date: first date (inclusive) or None
+    :param to_date: last date (inclusive) or None
+    :raises PartitionError: too many partitions
+    """
+    detach(dbc)
+    partitions = _query_partitions(dbc, from_date, to_date)
+    if not partitions:
+        # Not partitioned or main tables are empty, so are results
+        return
+    if len(partitions) > MAX_ATTACHED:
+        raise PartitionError(
+            f'Date range spans {len(partitions)} partitions, only'
+            f' {MAX_ATTACHED} can be used at once.')
+
+    main_path = dbc.execute('PRAGMA database_list').first()['file']
+    for partition in partitions:
+        uri = ('file:'
+               + urllib.parse.quote(_full_path(main_path, partition.path))
+               + '?mode=ro')
+        if partition.closed:
+            uri += '&immutable=1'
+        dbc.execute(text(f'ATTACH DATABASE :uri AS {partition.name}'),
+                    uri=uri)
+        if partition.closed:
+            dbc.execute(
+                f'PRAGMA {partition.name}.mmap_size = {_CLOSED_MMAP_SIZE}')
+    for table in PARTITIONED_TABLES:
+        selects = ' UNION ALL '.join(
+            f'SELECT * FROM {partition.name}.{table.name}'
+            for partition in partitions)
+        dbc.execute(f'CREATE TEMP VIEW {table.name} AS {selects}')
+
+
+def detach(dbc):
+    """Detach all partitions and drop their views.
+
+    :param dbc: SQLAlchemy or DBAPI (sqlite3) connection
+    """
+    for table in PARTITIONED_TABLES:
+        dbc.execute(f'DROP VIEW IF EXISTS temp.{table.name}')
+    for _, name, _ in dbc.execute('PRAGMA database_list').fetchall():
+        if name.startswith(_NAME_PREFIX):
+            dbc.execute(f'DETACH DATABASE {name}')
+
+
+def _full_path(db_path, partition_path):
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)),
+                        partition_path)
@@ -0,0 +1,311 @@
+"""Cross-tab (pivot) tables computed by the database.
+
+Pivot turns long rows (row key, column key, value) into a wide table:
+a row per row key and a column per column key. Instead of building
+the table cell by cell in Python, the database returns it finished
+using conditional aggregation::
+
+    SELECT row_key,
+           total(CASE WHEN column_key = '2018' THEN amount END),
+           total(CASE WHEN column_key = '2019' THEN amount END),
+           total(amount)
+    FROM cells GROUP BY row_key
+
+Column keys (domain) must be known to build such a query. Values
+are aggregated by (row key, column key) into a temporary table
+("cells") first. Then the domain and the wide table are queried from
+aggregated cells: source rows are processed once, CASE expressions
+are evaluated only for cells.
+
+Approximate pivots (see hbreports.approx) sum up variances alongside
+values the same way. Cells are Estimate objects then.
+
+Aggregated cells of pivots over disjoint parts of data (e.g. date
+ranges queried in parallel) can be merged. The wide table is built in
+Python then (see Pivot.merged_table).
+"""
+
+import collections
+import functools
+
+from sqlalchemy import (
+    Column,
+    Float,
+    MetaData,
+    String,
+    Table as DBTable,
+    func,
+    literal,
+    literal_column,
+)
+from sqlalchemy.schema import CreateTable, DropTable
+from sqlalchemy.sql import and_, case, select, union_all
+
+from hbreports import statements
+from hbreports.approx import to_estimate
+from hbreports.tables import Table, merge_rows
+
+
+TOTAL_LABEL = 'Total'
+
+# Temporary tables are private to a connection, so concurrent pivots
+# don't clash.
+_cells = DBTable(
+    'pivot_cells',
+    MetaData(),
+    Column('group_key', String),
+    Column('row_key', String),
+    Column('column_key', String),
+    Column('value', Float),
+    Column('variance', Float),
+    prefixes=['TEMPORARY'],
+)
+
+
+def pivot_table(dbc, from_obj, conditions, row_key, column_key, value,
+                corner_label, group_key=None, group_label=None,
+                totals=True, variance=None):
+    """Run pivot query and build table.
+
+    Rows are sorted by group and row key, columns are sorted by
+    column key. Empty cells are 0.0.
+
+    :param sqlalchemy.engine.Connectable dbc: database connection
+    :param from_obj: FROM clause (joined tables)
+    :param list conditions: WHERE predicates
+    :param row_key: SQL expression for row labels
+    :param column_key: SQL expression for column labels. Must not be
+        NULL.
+    :param value: SQL expression to sum up
+    :param str corner_label: label of row labels column
+    :param group_key: SQL expression for row groups (e.g. currency
+        name) or None. Groups are not summed up together.
+    :param str group_label: label of group column or None to omit the
+        column (there must be a single group then)
+    :param bool totals: add row totals (last column) and column
+        totals (last row of every group)
+    :param variance: SQL expression for variance of value (summed up
+        like value, see hbreports.approx) or None for exact values
+    :returns: tables.Table (empty if there are no values)
+    """
+    pivot = Pivot(from_obj, conditions, row_key, column_key, value,
+                  corner_label, group_key, group_label, totals, variance)
+    return pivot.table(dbc)
+
+
+class Pivot:
+    """Pivot query built once and run any number of times.
+
+    Statements are compiled once too (see hbreports.statements). See
+    pivot_table() for parameters.
+    """
+
+    def __init__(self, from_obj, conditions, row_key, column_key, value,
+                 corner_label, group_key=None, group_label=None,
+                 totals=True, variance=None):
+        if group_key is None:
+            group_key = literal(None)
+        # Keys are labeled in subquery: expressions with bound
+        # parameters would be computed again for GROUP BY otherwise.
+        source_rows = (
+            select([group_key.label('group_key'),
+                    row_key.label('row_key'),
+                    column_key.label('column_key'),
+                    value.label('value')])
+            .select_from(from_obj)
+            .where(and_(*conditions))
+        )
+        cell_columns = ['group_key', 'row_key', 'column_key', 'value']
+        if variance is not None:
+            source_rows = source_rows.column(variance.label('variance'))
+            cell_columns.append('variance')
+        source_rows = source_rows.alias('source_rows')
+        keys = [source_rows.c[name] for name in cell_columns[:3]]
+        sums = [func.sum(source_rows.c[name]) for name in cell_columns[3:]]
+        self._fill_cells = _cells.insert().from_select(
+            cell_columns, select(keys + sums).group_by(*keys))
+        self._corner_label = corner_label
+        self._group_label = group_label
+        self._totals = totals
+        self._approx = variance is not None
+
+    def table(self, dbc):
+        """Run pivot query and build table.
+
+        :param sqlalchemy.engine.Connectable dbc: database connection
+        :returns: tables.Table (empty if there are no values)
+        """
+        dbc.execute(_CREATE_CELLS)
+        try:
+            statements.execute(dbc, self._fill_cells)
+            columns = tuple(
+                row[0] for row in statements.execute(dbc, _SELECT_DOMAIN))
+            if not columns:
+                return Table()
+            rows = statements.execute(
+                dbc, _pivot_query(columns, self._totals, self._approx)
+            ).fetchall()
+        finally:
+            dbc.execute(_DROP_CELLS)
+        return self._build_table(columns, rows)
+
+    def cells(self, dbc):
+        """Aggregate values into cells without building a table.
+
+        :param sqlalchemy.engine.Connectable dbc: database connection
+        :returns: list of (group key, row key, column key, value) tuples
+            (variance follows value for approximate pivots)
+        """
+        select_cells = (_SELECT_CELLS_WITH_VARIANCE if self._approx
+                        else _SELECT_CELLS)
+        dbc.execute(_CREATE_CELLS)
+        try:
+            statements.execute(dbc, self._fill_cells)
+            return [tuple(row)
+                    for row in statements.execute(dbc, select_cells)]
+        finally:
+            dbc.execute(_DROP_CELLS)
+
+    def merged_table(self, partial_cells):
+        """Build table from cells of several pivots.
+
+        Pivots must be the same but for conditions selecting disjoint
+        parts of data. The table is the same as a pivot of all the data
+        would produce (up to rounding of sums).
+
+        :param partial_cells: iterable of cells() results
+        :returns: tables.Table (empty if there are no values)
+        """
+        cells = merge_rows(partial_cells, 3)
+        if not cells:
+            return Table()
+        columns = sorted({cell[2] for cell in cells})
+        return self._build_table(
+            columns, _wide_rows(cells, columns, self._totals, self._approx))
+
+    def _build_table(self, columns, rows):
+        """Build table from rows of wide query (see _pivot_query)."""
+        table = Table()
+        header = [self._corner_label] + list(columns)
+        if self._totals:
+            header.append(TOTAL_LABEL)
+        if self._group_label is not None:
+            header.insert(0, self._group_label)
+        table.add_row(header)
+        for row in rows:
+            values = row[2:-1]
+            if self._approx:
+                # (value, variance) pairs
+                values = [to_estimate(value, variance) for value, variance
+                          in zip(values[::2], values[1::2])]
+            labels = ([row[1]] if self._group_label is None
+                      else [row[0], row[1]])
+            table.add_row(labels + list(values))
+        return table
+
+
+_CREATE_CELLS = CreateTable(_cells)
+_DROP_CELLS = DropTable(_cells)
+_SELECT_DOMAIN = (
+    select([_cells.c.column_key])
+    .distinct()
+    .order_by(_cells.c.column_key)
+)
+_SELECT_CELLS = select([_cells.c.group_key, _cells.c.row_key,
+                        _cells.c.column_key, _cells.c.value])
+_SELECT_CELLS_WITH_VARIANCE = _SELECT_CELLS.column(_cells.c.variance)
+
+
+# Wide queries depend on column keys only, so a report run again on
+# the same data gets the same (compiled) query.
+@functools.lru_cache(maxsize=64)
+def _pivot_query(columns, totals, approx):
+    """Build query for wide table from cells.
+
+    :param tuple columns: column keys
+
+    Rows are (group key, row key, values..., [total], is total row).
+    Every value is followed by its variance if approx is set.
+    """
+    c = _cells.c
+    query = (
+        select([c.group_key, c.row_key]
+               + _wide_values(c, columns, totals, approx)
+               + [literal(0).label('is_total')])
+        .group_by(c.group_key, c.row_key)
+    )
+    if totals:
+        # Column totals are computed from (few) sums by column, not
+        # from all cells.
+        column_totals = (
+            select([c.group_key, c.column_key,
+                    func.sum(c.value).label('value'),
+                    func.sum(c.variance).label('variance')])
+            .group_by(c.group_key, c.column_key)
+            .alias('column_totals')
+        )
+        query = union_all(
+            query,
+            select([column_totals.c.group_key, literal(TOTAL_LABEL)]
+                   + _wide_values(column_totals.c, columns, totals, approx)
+                   + [literal(1)])
+            .group_by(column_totals.c.group_key))
+    # Total rows go after group rows
+    return query.order_by(literal_column('group_key'),
+                          literal_column('is_total'),
+                          literal_column('row_key'))
+
+
+def _wide_values(c, columns, totals, approx):
+    """Get conditional aggregates: a value per column key.
+
+    :param c: columns of cells (column_key, value, variance)
+    """
+    names = ['value', 'variance'] if approx else ['value']
+    values = [
+        func.total(case([(c.column_key == column, c[name])]))
+        .label(f'{name}_{i}')
+        for i, column in enumerate(columns)
+        for name in names]
+    if totals:
+        values.extend(func.total(c[name]).label(f'total_{name}')
+                      for name in names)
+    return values
+
+
+def _wide_rows(cells, columns, totals, approx):
+    """Build rows of wide table from cells in Python.
+
+    Rows are the same as _pivot_query() returns.
+
+    :param list cells: (group key, row key, column key, value,
+        [variance]) tuples, a tuple per (group key, row key, column key)
+    :param list columns: sorted column keys
+    """
+    width = 2 if approx else 1
+    positions = {column: i * width for i, column in enumerate(columns)}
+    groups = collections.defaultdict(dict)
+    for group_key, row_key, column_key, *sums in cells:
+        values = groups[group_key].get(row_key)
+        if values is None:
+            values = groups[group_key][row_key] = [0.0] * (len(columns)
+                                                           * width)
+        position = positions[column_key]
+        values[position:position + width] = sums
+
+    def wide_row(group_key, row_key, values, is_total):
+        if totals:
+            values = values + [sum(values[i::width]) for i in range(width)]
+        return (group_key, row_key, *values, is_total)
+
+    # NULL goes first in SQL
+    def sort_key(key):
+        return (key is not None, key)
+
+    for group_key in sorted(groups, key=sort_key):
+        rows = groups[group_key]
+        for row_key in sorted(rows, key=sort_key):
+            yield wide_row(group_key, row_key, rows[row_key], 0)
+        if totals:
+            column_totals = [sum(values) for values in zip(*rows.values())]
+            yield wide_row(group_key, TOTAL_LABEL, column_totals, 1)
@@ -3,6 +3,8 @@
 import shutil
 from texttable import Texttable
 
+from hbreports.tables import Estimate
+
 
 # TODO: add HTML renderer and renderer abc
 
@@ -26,6 +28,9 @@ class PlainTextRenderer:
         self._stream.write(f'\n*** ' + text + ' ***\n\n')
 
     def _render_table(self, table):
+        if not table:
+            self._stream.write('No data\n')
+            return
         # TODO: alignment
         text_table = Texttable(self._width)
         # TODO: formatting information should be provided by report
@@ -40,7 +45,9 @@ class PlainTextRenderer:
 
 def _table_format(value):
     """Format value for table."""
-    if isinstance(value, float):
+    if isinstance(value, Estimate):
+        return f'{value.value:.2f} ± {value.error:.2f}'
+    elif isinstance(value, float):
         return f'{value:.2f}'
     else:
         return str(value)
@@ -4,17 +4,34 @@ There are reports and generators. Generators work with the database
 and create reports. Reports just store results.
 """
 
-from sqlalchemy import func
-from sqlalchemy.sql import and_, or_, select
+import copy
+import datetime
+import itertools
 
+from sqlalchemy import Integer, String, bindparam, func
+from sqlalchemy.sql import and_, case, cast, select
+from sqlalchemy.util import LRUCache
+
+from hbreports import memprofile, statements
 from hbreports.db import (
     account,
+    balance_checkpoint,
     category,
+    currency,
+    julian_day,
+    payee,
+    source,
     split,
+    split_sample,
+    tag,
     txn,
+    txn_tag,
 )
+from hbreports.approx import amount_variance, to_estimate, weighted_amount
 from hbreports.common import Paymode, TxnStatus
-from hbreports.tables import FreeTableBuilder, Table
+from hbreports.filters import ReportFilter
+from hbreports.pivot import Pivot
+from hbreports.tables import FreeTableBuilder, Table, merge_rows
 
 
 class Report:
@@ -28,100 +45,662 @@ class Report:
 # TODO: abc for report generators?
 
 
-class TxnsByAccount:
+class _Mergeable:
+    """Base of report generators with mergeable results.
+
+    Partial results of the same generator restricted to disjoint date
+    ranges (shards) are merged into the report of the whole range.
+    Subclasses implement generate_partial() and merge_partials(). See
+    hbreports.parallel.
+    """
+
+    mergeable = True
+
+    def date_range(self):
+        """Get range of processed dates.
+
+        :returns: (first date, last date) tuple, both inclusive. None
+            means no limit.
+        """
+        return self._filter.from_date, self._filter.to_date
+
+    def shard(self, from_date, to_date):
+        """Get the same generator restricted to a date range.
+
+        :param from_date: first date or None (within date_range())
+        :param to_date: last date or None (within date_range())
+        """
+        shard = copy.copy(self)
+        shard._filter = self._filter._replace(from_date=from_date,
+                                              to_date=to_date)
+        return shard
+
+
+class TxnsByAccount(_Mergeable):
     """Total Transactions by Account (TTA) report generator.
 
     This is the simpliest report possible. It's actual porpose is to
     help design the reports framework.
+
+    Accounts of consolidated database are grouped by source.
+
+    :param ReportFilter report_filter: only matching transactions are
+        counted
     """
 
     name = 'Total transactions quantity by account'
     description = 'TODO'
 
+    def __init__(self, source=None, currency=None, report_filter=None):
+        self._source = source
+        self._currency = currency
+        self._filter = report_filter or ReportFilter()
+
     def generate_report(self, dbc):
-        report = Report(self.name, self._create_table(dbc))
-        report.description = self.description
-        return report
+        return self.merge_partials([self.generate_partial(dbc)])
+
+    def generate_partial(self, dbc):
+        """Count transactions.
 
-    def _create_table(self, dbc):
+        :returns: list of (source name, account name, count) tuples
+        """
+        query = _cached_statement(
+            (type(self), self._source, self._currency, self._filter.key()),
+            self._build_query)
+        return [tuple(row) for row in statements.execute(dbc, query)]
+
+    def merge_partials(self, partials):
+        """Build report from results of generate_partial()."""
         table = Table()
         table.add_row(['Accounts', 'Transactions qty.'])
-        result = dbc.execute(
-            select([account.c.name,
+        # Every result has all accounts in the same order
+        for source_name, account_name, count in merge_rows(partials, 2):
+            table.add_row([_account_label(source_name, account_name), count])
+        report = Report(self.name, table)
+        report.description = self.description
+        return report
+
+    def _build_query(self):
+        query = (
+            select([source.c.name,
+                    account.c.name,
                     func.count(txn.c.id)])
-            .select_from(account.outerjoin(
-                txn,
-                # explicit on-clause seems better
-                txn.c.account_id == account.c.id))
-            .group_by(account.c.name)
-            .order_by(account.c.name)
+            .select_from(
+                account
+                .outerjoin(source, source.c.id == account.c.source_id)
+                # explicit on-clause seems better. Filter goes to
+                # on-clause to keep accounts without matching
+                # transactions.
+                .outerjoin(txn, and_(
+                    txn.c.account_id == account.c.id,
+                    *self._filter.txn_conditions(split_joined=False))))
+            .where(and_(*self._filter.account_conditions()))
+            .group_by(account.c.id)
+            .order_by(source.c.name, account.c.name)
         )
-        for row in result:
-            table.add_row(row)
-        return table
+        if self._source is not None:
+            query = query.where(source.c.name == self._source)
+        if self._currency is not None:
+            query = query.where(
+                account.c.currency_id == select([currency.c.id])
+                .where(currency.c.name == self._currency)
+                .as_scalar())
+        return query
 
 
-class AnnualBalanceByCategory:
+class AnnualBalanceByCategory(_Mergeable):
     """Annual Balance by Category (ABC) report generator.
 
     Processes transactions in range [from_year, to_year] if these
     arguments are provided. Otherwise processes all transactions.
+    ReportFilter narrows the selection further.
+
+    Processes transactions from all sources unless source name is
+    provided.
+
+    Balances in different currencies can't be summed up. If currency
+    name is not provided, all currencies are processed in one pass
+    and the table gets a currency column.
+
+    :param bool approx: estimate balances from split sample (see
+        hbreports.approx). Cells are tables.Estimate then.
     """
 
     name = 'Annual balance by category'
     description = 'TODO'
 
-    def __init__(self, from_year=None, to_year=None):
+    def __init__(self, from_year=None, to_year=None, source=None,
+                 currency=None, report_filter=None, approx=False):
         self._from_year = from_year
         self._to_year = to_year
-        # TODO: get from args
-        self._currency_id = 1
+        self._source = source
+        self._currency = currency
+        self._filter = report_filter or ReportFilter()
+        self._approx = approx
 
     def generate_report(self, dbc):
-        report = Report(self.name, self._get_table(dbc))
+        report = Report(_report_name(self.name, self._approx),
+                        self._get_table(dbc))
         report.description = self.description
         return report
 
+    def generate_partial(self, dbc):
+        """Aggregate balances without building a table.
+
+        :returns: cells (see pivot.Pivot.cells)
+        """
+        return self._pivot().cells(dbc)
+
+    def merge_partials(self, partials):
+        """Build report from results of generate_partial()."""
+        report = Report(_report_name(self.name, self._approx),
+                        self._pivot().merged_table(partials))
+        report.description = self.description
+        return report
+
+    def date_range(self):
+        from_date, to_date = super().date_range()
+        if self._from_year:
+            year_start = datetime.date(self._from_year, 1, 1)
+            if from_date is None or from_date < year_start:
+                from_date = year_start
+        if self._to_year:
+            year_end = datetime.date(self._to_year, 12, 31)
+            if to_date is None or to_date > year_end:
+                to_date = year_end
+        return from_date, to_date
+
     def _get_table(self, dbc):
+        return self._pivot().table(dbc)
+
+    def _pivot(self):
+        return _cached_statement(
+            (type(self), self._from_year, self._to_year, self._source,
+             self._currency, self._filter.key(), self._approx),
+            self._build_pivot)
+
+    def _build_pivot(self):
         # TODO: this skips years and categories with no
         # transactions. It's fixable but do we really need them?
         #
         # TODO: Filter out closed and marked accounts?
-        topcat = category.alias()
-        subcat = category.alias()
-        year = func.strftime('%Y', txn.c.date).label('year')
+        splits = split_sample if self._approx else split
+        conditions = _balance_conditions(
+            self._source, self._currency, self._filter, splits)
+        # Years are compared as dates: comparing strftime() results
+        # would compute year for every row.
+        if self._from_year:
+            conditions.append(
+                txn.c.date >= datetime.date(self._from_year, 1, 1))
+        if self._to_year:
+            conditions.append(
+                txn.c.date <= datetime.date(self._to_year, 12, 31))
+        return Pivot(
+            _balance_from(['category', 'year'], splits), conditions,
+            row_key=DIMENSIONS['category'],
+            column_key=DIMENSIONS['year'],
+            corner_label='Category/Year',
+            group_key=currency.c.name,
+            group_label='Currency' if self._currency is None else None,
+            totals=False,
+            **_balance_values(splits, self._approx))
+
+
+class BalanceByDimensions(_Mergeable):
+    """Balance by Dimensions (pivot) report generator.
+
+    Cross-tab of balance for any pair of dimensions (see DIMENSIONS):
+    category by year, payee by month, account by quarter, etc. Row
+    and column totals are included.
+
+    Processes the same transactions as ABC report. Currencies are
+    handled the same way too.
+
+    :param str rows: dimension for rows
+    :param str columns: dimension for columns
+    :param bool approx: estimate balances (see ABC report)
+    :raises ValueError: unknown or same dimensions
+    """
+
+    description = 'TODO'
+
+    def __init__(self, rows='category', columns='year', source=None,
+                 currency=None, report_filter=None, approx=False):
+        for dimension in (rows, columns):
+            if dimension not in DIMENSIONS:
+                raise ValueError(f'Unknown dimension "{dimension}"')
+        if rows == columns:
+            raise ValueError('Rows and columns must be different')
+        self.name = f'Balance by {rows} and {columns}'
+        self._rows = rows
+        self._columns = columns
+        self._source = source
+        self._currency = currency
+        self._filter = report_filter or ReportFilter()
+        self._approx = approx
+
+    def generate_report(self, dbc):
+        report = Report(_report_name(self.name, self._approx),
+                        self._get_table(dbc))
+        report.description = self.description
+        return report
+
+    def generate_partial(self, dbc):
+        """Aggregate balances without building a table.
+
+        :returns: cells (see pivot.Pivot.cells)
+        """
+        return self._pivot().cells(dbc)
+
+    def merge_partials(self, partials):
+        """Build report from results of generate_partial()."""
+        report = Report(_report_name(self.name, self._approx),
+                        self._pivot().merged_table(partials))
+        report.description = self.description
+        return report
+
+    def _get_table(self, dbc):
+        return self._pivot().table(dbc)
+
+    def _pivot(self):
+        return _cached_statement(
+            (type(self), self._rows, self._columns, self._source,
+             self._currency, self._filter.key(), self._approx),
+            self._build_pivot)
+
+    def _build_pivot(self):
+        splits = split_sample if self._approx else split
+        return Pivot(
+            _balance_from([self._rows, self._columns], splits),
+            _balance_conditions(
+                self._source, self._currency, self._filter, splits),
+            row_key=DIMENSIONS[self._rows],
+            column_key=DIMENSIONS[self._columns],
+            corner_label=(f'{self._rows.capitalize()}/'
+                          f'{self._columns.capitalize()}'),
+            group_key=currency.c.name,
+            group_label='Currency' if self._currency is None else None,
+            **_balance_values(splits, self._approx))
+
+
+class BalanceOverTime:
+    """Balance over Time (BOT) report generator.
+
+    Balance of every account and net worth at the end of every
+    month. Net worth is calculated for every currency separately.
+
+    Based on balance checkpoints (see hbreports.derived). Balances
+    are computed for whole accounts, so ReportFilter may only select
+    accounts and months (by date range).
+
+    :raises ValueError: filter has unsupported criteria
+    """
+
+    name = 'Balance over time'
+    description = 'TODO'
+
+    _FILTER_CRITERIA = {'from_date', 'to_date', 'accounts'}
+
+    # Only derived tables are queried (see hbreports.partitions)
+    reads_transactions = False
+
+    def __init__(self, source=None, currency=None, report_filter=None):
+        self._source = source
+        self._currency = currency
+        self._filter = report_filter or ReportFilter()
+        unsupported = set(self._filter.criteria()) - self._FILTER_CRITERIA
+        if unsupported:
+            raise ValueError('Balance over time report can\'t filter by '
+                             + ', '.join(sorted(unsupported)))
+
+    def generate_report(self, dbc):
+        report = Report(self.name, self._get_table(dbc))
+        report.description = self.description
+        return report
+
+    def _get_table(self, dbc):
+        accounts_query, checkpoints_query = _cached_statement(
+            (type(self), self._source, self._currency, self._filter.key()),
+            self._build_queries)
+        accounts = statements.execute(dbc, accounts_query).fetchall()
+        checkpoints = statements.execute(
+            dbc, checkpoints_query,
+            {'account_ids': [row[0] for row in accounts]}).fetchall()
+        if not checkpoints:
+            return Table()
+        # Checkpoints before from_date are needed for balances, but
+        # their months are not shown.
+        first_month = checkpoints[0][0]
+        if self._filter.from_date is not None:
+            first_month = max(first_month,
+                              self._filter.from_date.replace(day=1))
+        last_month = checkpoints[-1][0]
+        if self._filter.to_date is not None:
+            last_month = self._filter.to_date.replace(day=1)
+        if first_month > last_month:
+            return Table()
+
+        currencies = sorted({row[3] for row in accounts})
+        table = Table()
+        table.add_row(
+            ['Month']
+            + [_account_label(row[1], row[2]) for row in accounts]
+            + [f'Net worth, {name}' for name in currencies])
+
+        balances = {row[0]: row[4] for row in accounts}
+        checkpoints_by_month = {
+            month: list(month_checkpoints)
+            for month, month_checkpoints in itertools.groupby(
+                checkpoints, key=lambda row: row[0])}
+        for month in _months_between(checkpoints[0][0], last_month):
+            for _, account_id, balance in checkpoints_by_month.get(month, []):
+                balances[account_id] = balance
+            if month < first_month:
+                continue
+            net_worth = dict.fromkeys(currencies, 0.0)
+            for row in accounts:
+                net_worth[row[3]] += balances[row[0]]
+            table.add_row(
+                [month.strftime('%Y-%m')]
+                + [balances[row[0]] for row in accounts]
+                + [net_worth[name] for name in currencies])
+        return table
+
+    def _build_queries(self):
+        accounts_query = (
+            select([account.c.id,
+                    source.c.name,
+                    account.c.name,
+                    currency.c.name,
+                    account.c.initial])
+            .select_from(
+                account
+                .outerjoin(source, source.c.id == account.c.source_id)
+                .join(currency, currency.c.id == account.c.currency_id))
+            .where(and_(*self._filter.account_conditions()))
+            .order_by(source.c.name, account.c.name)
+        )
+        if self._source is not None:
+            accounts_query = accounts_query.where(
+                source.c.name == self._source)
+        if self._currency is not None:
+            accounts_query = accounts_query.where(
+                currency.c.name == self._currency)
+
+        cp = balance_checkpoint.c
+        checkpoints_query = (
+            select([cp.month, cp.account_id, cp.balance])
+            .where(cp.account_id.in_(
+                bindparam('account_ids', expanding=True)))
+            .order_by(cp.month)
+        )
+        if self._filter.to_date is not None:
+            checkpoints_query = checkpoints_query.where(
+                cp.month <= self._filter.to_date)
+        return accounts_query, checkpoints_query
+
+
+class BalanceByTag(_Mergeable):
+    """Balance by Tag (BBT) report generator.
+
+    Balance of transactions with every tag by year or by month. A
+    transaction with several tags is counted for every tag.
+
+    Currencies are handled the same way as in ABC report.
+
+    :param str period: "year" or "month"
+    :param ReportFilter report_filter: tags criterion selects tags
+        shown, other criteria select transactions
+    :param bool approx: estimate balances (see ABC report)
+    """
+
+    name = 'Balance by tag'
+    description = 'TODO'
+
+    _PERIOD_FORMATS = {
+        'year': '%Y',
+        'month': '%Y-%m',
+    }
+
+    def __init__(self, period='year', source=None, currency=None,
+                 report_filter=None, approx=False):
+        if period not in self._PERIOD_FORMATS:
+            raise ValueError(f'Unknown period "{period}"')
+        self._period = period
+        self._source = source
+        self._currency = currency
+        self._filter = report_filter or ReportFilter()
+        self._approx = approx
+
+    def generate_report(self, dbc):
+        return self.merge_partials([self.generate_partial(dbc)])
+
+    def generate_partial(self, dbc):
+        """Aggregate balances.
+
+        :returns: list of (currency, tag, period, balance) tuples
+            (variance follows balance if approx is set)
+        """
+        query = _cached_statement(
+            (type(self), self._period, self._source, self._currency,
+             self._filter.key(), self._approx),
+            self._build_query)
+        return [tuple(row) for row in statements.execute(dbc, query)]
+
+    def merge_partials(self, partials):
+        """Build report from results of generate_partial()."""
+        rows = merge_rows(partials, 3)
+        if self._approx:
+            rows = [row[:3] + (to_estimate(row[3], row[4]),) for row in rows]
+        table = _build_currency_table(
+            rows,
+            corner_label=f'Tag/{self._period.capitalize()}',
+            currency_column=self._currency is None)
+        report = Report(_report_name(self.name, self._approx), table)
+        report.description = self.description
+        return report
+
+    def _build_query(self):
+        splits = split_sample if self._approx else split
+        values = [func.sum(value) for value
+                  in _balance_values(splits, self._approx).values()]
+        period = func.strftime(
+            self._PERIOD_FORMATS[self._period], julian_day(txn.c.date)
+        ).label('period')
+        # Starting from txn_tag: its primary key is (tag_id, txn_id),
+        # so transactions are fetched tag by tag through indexes.
         query = (
             select([
-                topcat.c.name,
-                year,
-                func.sum(split.c.amount)
-            ])
+                currency.c.name,
+                tag.c.name,
+                period,
+            ] + values)
             .select_from(
-                txn
-                .join(split, split.c.txn_id == txn.c.id)
+                txn_tag
+                .join(tag, tag.c.id == txn_tag.c.tag_id)
+                .join(txn, txn.c.id == txn_tag.c.txn_id)
+                .join(splits, splits.c.txn_id == txn.c.id)
                 .join(account, account.c.id == txn.c.account_id)
-                .outerjoin(subcat, subcat.c.id == split.c.category_id)
-                .outerjoin(topcat,
-                           or_(topcat.c.id == subcat.c.parent_id,
-                               and_(topcat.c.id == subcat.c.id,
-                                    topcat.c.parent_id == None)))  # noqa: E711
+                .join(currency, currency.c.id == account.c.currency_id)
             )
-            .where(account.c.currency_id == self._currency_id)
             .where(txn.c.status == TxnStatus.RECONCILED)
             .where(txn.c.paymode != Paymode.INTERNAL_TRANSFER)
-            .group_by(topcat.c.name, 'year')
+            .where(and_(*self._filter.txn_conditions(split_table=splits)))
+            .group_by(account.c.currency_id, txn_tag.c.tag_id, 'period')
         )
-        # Using year instead of date probably hurts perfomance a little
-        if self._from_year:
-            query = query.where(year >= str(self._from_year))
-        if self._to_year:
-            query = query.where(year <= str(self._from_year))
-        result = dbc.execute(query)
+        if self._filter.tags is not None:
+            query = query.where(tag.c.name.in_(self._filter.tags))
+        if self._source is not None:
+            query = query.where(
+                account.c.source_id == select([source.c.id])
+                .where(source.c.name == self._source)
+                .as_scalar())
+        if self._currency is not None:
+            query = query.where(currency.c.name == self._currency)
+        return query
 
-        builder = FreeTableBuilder(corner_label='Category/Year', default=0.0)
-        for row in result:
-            builder.set_cell(row[0] or '<other>', row[1], row[2])
+
+# Statements built by generators (see _cached_statement)
+_STATEMENTS = LRUCache(100)
+
+
+def _cached_statement(key, build):
+    """Get statement built once per generator options.
+
+    Generators with the same options share statements, so statements
+    are compiled once (see hbreports.statements) no matter how many
+    times reports are generated.
+
+    :param tuple key: generator class and all options used by build
+    :param callable build: function to build statement
+    """
+    statement = _STATEMENTS.get(key)
+    if statement is None:
+        statement = _STATEMENTS[key] = build()
+    return statement
+
+
+# Categories for balance queries. top_category_id is a derived column,
+# so a plain equi-join is enough for any depth of category tree. It's
+# NULL until derived.refresh() is called: fall back to parent_id then,
+# which is right for two-level HomeBank categories.
+_topcat = category.alias('topcat')
+_subcat = category.alias('subcat')
+_top_category_id = func.coalesce(
+    _subcat.c.top_category_id, _subcat.c.parent_id, _subcat.c.id)
+
+
+# Dimensions of balance reports: SQL expressions for labels. Labels
+# are never NULL.
+DIMENSIONS = {
+    'category': func.coalesce(_topcat.c.name, '<other>'),
+    'payee': func.coalesce(payee.c.name, '<none>'),
+    'account': case(
+        [(source.c.name == None, account.c.name)],  # noqa: E711
+        else_=source.c.name + ': ' + account.c.name),
+    'year': func.strftime('%Y', julian_day(txn.c.date), type_=String),
+    'quarter': (
+        func.strftime('%Y', julian_day(txn.c.date), type_=String) + '-Q'
+        + cast((cast(func.strftime('%m', julian_day(txn.c.date)), Integer)
+                + 2) / 3,
+               String)),
+    'month': func.strftime('%Y-%m', julian_day(txn.c.date), type_=String),
+}
+
+
+def _balance_from(dimensions, splits=split):
+    """Get FROM clause for balance queries (a row per split).
+
+    :param dimensions: names of used dimensions. Only tables they
+        need are joined.
+    :param splits: split or split_sample table
+    """
+    from_obj = (
+        txn
+        .join(splits, splits.c.txn_id == txn.c.id)
+        .join(account, account.c.id == txn.c.account_id)
+        .join(currency, currency.c.id == account.c.currency_id)
+    )
+    if 'account' in dimensions:
+        from_obj = from_obj.outerjoin(
+            source, source.c.id == account.c.source_id)
+    if 'payee' in dimensions:
+        from_obj = from_obj.outerjoin(payee, payee.c.id == txn.c.payee_id)
+    if 'category' in dimensions:
+        from_obj = (
+            from_obj
+            .outerjoin(_subcat, _subcat.c.id == splits.c.category_id)
+            .outerjoin(_topcat, _topcat.c.id == _top_category_id)
+        )
+    return from_obj
+
+
+def _balance_conditions(source_name, currency_name, report_filter,
+                        splits=split):
+    """Get WHERE predicates for balance queries.
+
+    Balance is computed for reconciled transactions. Internal
+    transfers are ignored.
+
+    :param splits: split or split_sample table
+    :returns: list of SQL expressions
+    """
+    conditions = [
+        txn.c.status == TxnStatus.RECONCILED,
+        txn.c.paymode != Paymode.INTERNAL_TRANSFER,
+    ]
+    conditions.extend(report_filter.txn_conditions(split_table=splits))
+    if source_name is not None:
+        conditions.append(
+            account.c.source_id == select([source.c.id])
+            .where(source.c.name == source_name)
+            .as_scalar())
+    if currency_name is not None:
+        conditions.append(currency.c.name == currency_name)
+    return conditions
+
+
+def _balance_values(splits, approx):
+    """Get SQL expressions to sum up for balance (pivot_table arguments).
+
+    :returns: dict with "value" and, if approx is set, "variance"
+    """
+    if not approx:
+        return {'value': splits.c.amount}
+    return {'value': weighted_amount(splits),
+            'variance': amount_variance(splits)}
+
+
+def _build_currency_table(rows, corner_label, currency_column):
+    """Build table from (currency, row, column, value) rows.
+
+    :param bool currency_column: add currency column. Otherwise
+        currency is ignored.
+    """
+    with memprofile.phase('FreeTableBuilder'):
+        if currency_column:
+            builder = FreeTableBuilder(
+                corner_label=('Currency', corner_label), default=0.0)
+            for currency_name, row_name, column_name, value in rows:
+                builder.set_cell(
+                    (currency_name, row_name), column_name, value)
+        else:
+            builder = FreeTableBuilder(corner_label=corner_label,
+                                       default=0.0)
+            for _, row_name, column_name, value in rows:
+                builder.set_cell(row_name, column_name, value)
         return builder.table
 
 
+def _report_name(name, approx):
+    if approx:
+        return f'{name} (approximate)'
+    return name
+
+
+def _account_label(source_name, account_name):
+    """Get account label (account names are unique only per source)."""
+    if source_name is None:
+        return account_name
+    return f'{source_name}: {account_name}'
+
+
+def _months_between(first, last):
+    """Get first days of months from first to last (inclusive)."""
+    month = first.replace(day=1)
+    while month <= last:
+        yield month
+        month = (month + datetime.timedelta(days=32)).replace(day=1)
+
+
+# Report generators by short name
+GENERATORS = {
+    'tta': TxnsByAccount,
+    'abc': AnnualBalanceByCategory,
+    'bot': BalanceOverTime,
+    'bbt': BalanceByTag,
+    'pivot': BalanceByDimensions,
+}
+
+
 # TODO: AMC - Average Monthly expenses by Category
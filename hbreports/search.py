@@ -0,0 +1,88 @@
+"""Full-text search for transactions.
+
+Search uses FTS5 index (see hbreports.derived). Memos, info, split
+memos and payee names are indexed. Query syntax is FTS5 syntax::
+
+    coffee
+    "gas station"
+    memo: coffee OR payee: starbucks
+    taxi NOT airport
+"""
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql import text
+
+from hbreports.db import JULIAN_DAY_OFFSET
+from hbreports.derived import SEARCH_TABLE
+from hbreports.reports import Report
+from hbreports.tables import Table
+
+
+class SearchError(Exception):
+    """Search failed."""
+
+
+_SEARCH_QUERY = text(f"""
+SELECT date(txn.date + {JULIAN_DAY_OFFSET}), account.name, payee.name,
+       (SELECT sum(split.amount) FROM split WHERE split.txn_id = txn.id),
+       txn.memo
+FROM {SEARCH_TABLE}
+JOIN txn ON txn.id = {SEARCH_TABLE}.rowid
+JOIN account ON account.id = txn.account_id
+LEFT JOIN payee ON payee.id = txn.payee_id
+WHERE {SEARCH_TABLE} MATCH :query
+ORDER BY {SEARCH_TABLE}.rank, txn.id
+LIMIT :limit OFFSET :offset
+""")
+
+
+class TxnSearch:
+    """Transaction search report generator.
+
+    The best matches go first.
+
+    :param str query: FTS5 query
+    :param int limit: maximum number of transactions (page size)
+    :param int offset: number of transactions to skip (page start)
+    """
+
+    name = 'Search results'
+    description = 'Transactions matching search query'
+
+    def __init__(self, query, limit=20, offset=0):
+        self._query = query
+        self._limit = limit
+        self._offset = offset
+
+    def generate_report(self, dbc):
+        """Generate report.
+
+        :raises SearchError:
+        """
+        report = Report(self.name, self._get_table(dbc))
+        report.description = self.description
+        return report
+
+    def _get_table(self, dbc):
+        if not dbc.dialect.has_table(dbc, SEARCH_TABLE):
+            raise SearchError('Search index not found. Import data again'
+                              ' using SQLite with FTS5 support.')
+        try:
+            rows = dbc.execute(
+                _SEARCH_QUERY,
+                query=self._query,
+                limit=self._limit,
+                offset=self._offset
+            ).fetchall()
+        except OperationalError as exc:
+            raise SearchError(
+                f'Invalid search query: {exc.orig}') from exc
+
+        if not rows:
+            return Table()
+        table = Table()
+        table.add_row(['Date', 'Account', 'Payee', 'Amount', 'Memo'])
+        for date, account_name, payee_name, amount, memo in rows:
+            table.add_row([date, account_name, payee_name or '',
+                           amount or 0.0, memo or ''])
+        return table
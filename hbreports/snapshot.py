@@ -0,0 +1,307 @@
+"""Columnar snapshots of the database.
+
+Snapshot is a read-only copy of the data most useful for analytics
+(transactions, splits, accounts, categories, etc.) stored as
+fixed-width typed columns. Snapshot file is memory-mapped. Reading a
+column doesn't parse or copy anything, so even a huge snapshot is
+"loaded" instantly.
+
+File format (version 1, native byte order recorded in the header):
+
+* header: magic, version, byte order, number of columns;
+* column directory: table name, column name, array typecode, number
+  of items and data offset for every column;
+* column data, every column aligned to 8 bytes.
+
+NULL ids are stored as -1. Strings are stored as indexes in the string
+dictionary: "strings.offsets" and "strings.data" columns (UTF-8 data,
+string i is data[offsets[i]:offsets[i + 1]]).
+
+Columns work with numpy without copying too::
+
+    amounts = numpy.frombuffer(snapshot.column('split', 'amount'))
+"""
+
+import array
+import collections
+import mmap
+import os
+import struct
+import sys
+
+from sqlalchemy.sql import select
+
+from hbreports import db
+
+
+FORMAT_VERSION = 1
+
+# Value for NULL ids
+NULL_ID = -1
+
+_MAGIC = b'HBSNAP\0\0'
+_HEADER = struct.Struct('<8sII4xI')
+_DIRECTORY_ENTRY = struct.Struct('<16s16sc7xQQ')
+_ALIGNMENT = 8
+_BYTE_ORDERS = {'little': 0, 'big': 1}
+
+# Column kinds
+_ID = 'id'
+_NULLABLE_ID = 'nullable_id'
+_STRING = 'string'
+_DATE = 'date'
+_FLOAT = 'float'
+_SMALL_INT = 'small_int'
+
+_TYPECODES = {
+    _ID: 'q',
+    _NULLABLE_ID: 'q',
+    _STRING: 'q',
+    _DATE: 'i',
+    _FLOAT: 'd',
+    _SMALL_INT: 'b',
+}
+
+# Snapshot contents: tables and their columns with kinds
+_LAYOUT = [
+    (db.currency, [
+        ('id', _ID),
+        ('name', _STRING),
+    ]),
+    (db.account, [
+        ('id', _ID),
+        ('name', _STRING),
+        ('currency_id', _ID),
+        ('initial', _FLOAT),
+        ('source_id', _NULLABLE_ID),
+    ]),
+    (db.payee, [
+        ('id', _ID),
+        ('name', _STRING),
+    ]),
+    (db.category, [
+        ('id', _ID),
+        ('name', _STRING),
+        ('parent_id', _NULLABLE_ID),
+        ('income', _SMALL_INT),
+    ]),
+    (db.txn, [
+        ('id', _ID),
+        ('date', _DATE),
+        ('account_id', _ID),
+        ('status', _SMALL_INT),
+        ('payee_id', _NULLABLE_ID),
+        ('paymode', _SMALL_INT),
+    ]),
+    (db.split, [
+        ('id', _ID),
+        ('txn_id', _ID),
+        ('amount', _FLOAT),
+        ('category_id', _NULLABLE_ID),
+    ]),
+]
+
+
+class SnapshotError(Exception):
+    """Snapshot file is damaged or incompatible."""
+
+
+ColumnInfo = collections.namedtuple(
+    'ColumnInfo', ['typecode', 'count', 'offset'])
+
+
+def write_snapshot(dbc, path):
+    """Write snapshot of the database.
+
+    File is written under a temporary name and renamed, so readers
+    never see a partial snapshot.
+
+    :param sqlalchemy.engine.Connectable dbc: database connection
+    :param str path: snapshot file path
+    """
+    strings = _StringDictionary()
+    columns = []
+    for table, column_specs in _LAYOUT:
+        names = [name for name, _ in column_specs]
+        arrays = [array.array(_TYPECODES[kind]) for _, kind in column_specs]
+        converters = [_converter(kind, strings) for _, kind in column_specs]
+        result = dbc.execute(
+            select([table.c[name] for name in names])
+            .order_by(table.c.id))
+        for row in result:
+            for column_array, converter, value in zip(
+                    arrays, converters, row):
+                column_array.append(converter(value))
+        columns.extend((table.name, name, column_array)
+                       for name, column_array in zip(names, arrays))
+    columns.extend(strings.columns())
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        _write_columns(f, columns)
+    os.replace(tmp_path, path)
+
+
+class Snapshot:
+    """Memory-mapped snapshot.
+
+    Columns are memoryviews of the mapped file. Release them before
+    closing the snapshot. Otherwise the file stays mapped until the
+    last column is garbage-collected.
+
+    :param str path: snapshot file path
+    :raises SnapshotError:
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            try:
+                self._mmap = mmap.mmap(
+                    f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty file
+                raise SnapshotError('Not a snapshot file') from None
+        try:
+            self.columns = _read_directory(self._mmap)
+        except SnapshotError:
+            self._mmap.close()
+            raise
+        self._buffer = memoryview(self._mmap)
+
+    def column(self, table, column):
+        """Get column data.
+
+        :returns: memoryview with items of column type
+        :raises KeyError: unknown column
+        """
+        info = self.columns[(table, column)]
+        size = info.count * struct.calcsize(info.typecode)
+        return self._buffer[info.offset:info.offset + size].cast(
+            info.typecode)
+
+    def length(self, table):
+        """Get number of rows in table."""
+        return self.columns[(table, 'id')].count
+
+    def string(self, index):
+        """Get string from string dictionary.
+
+        :returns: str or None for NULL
+        """
+        if index == NULL_ID:
+            return None
+        offsets = self.column('strings', 'offsets')
+        data = self.column('strings', 'data')
+        return str(data[offsets[index]:offsets[index + 1]], 'utf-8')
+
+    def close(self):
+        self._buffer.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Some columns are still in use
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _StringDictionary:
+    """Dictionary of unique strings."""
+
+    def __init__(self):
+        self._indexes = {}
+        self._strings = []
+
+    def index(self, value):
+        if value is None:
+            return NULL_ID
+        index = self._indexes.get(value)
+        if index is None:
+            index = self._indexes[value] = len(self._strings)
+            self._strings.append(value)
+        return index
+
+    def columns(self):
+        offsets = array.array('q', [0])
+        data = bytearray()
+        for value in self._strings:
+            data += value.encode('utf-8')
+            offsets.append(len(data))
+        return [('strings', 'offsets', offsets),
+                ('strings', 'data', array.array('B', data))]
+
+
+def _converter(kind, strings):
+    if kind == _STRING:
+        return strings.index
+    if kind == _NULLABLE_ID:
+        return lambda value: NULL_ID if value is None else value
+    if kind == _DATE:
+        return lambda value: value.toordinal()
+    if kind == _SMALL_INT:
+        return int
+    return lambda value: value
+
+
+def _write_columns(f, columns):
+    offset = _align(_HEADER.size + _DIRECTORY_ENTRY.size * len(columns))
+    directory = []
+    for table_name, column_name, column_array in columns:
+        directory.append(_DIRECTORY_ENTRY.pack(
+            table_name.encode('ascii'),
+            column_name.encode('ascii'),
+            column_array.typecode.encode('ascii'),
+            len(column_array),
+            offset))
+        offset = _align(offset + len(column_array) * column_array.itemsize)
+
+    f.write(_HEADER.pack(_MAGIC, FORMAT_VERSION,
+                         _BYTE_ORDERS[sys.byteorder], len(columns)))
+    f.writelines(directory)
+    for _, _, column_array in columns:
+        _pad(f)
+        column_array.tofile(f)
+    _pad(f)
+
+
+def _read_directory(buffer):
+    """Read file header and column directory.
+
+    :returns: dict mapping (table, column) to ColumnInfo
+    :raises SnapshotError:
+    """
+    if len(buffer) < _HEADER.size:
+        raise SnapshotError('Not a snapshot file')
+    magic, version, byte_order, columns_count = _HEADER.unpack_from(buffer)
+    if magic != _MAGIC:
+        raise SnapshotError('Not a snapshot file')
+    if version != FORMAT_VERSION:
+        raise SnapshotError(f'Unsupported snapshot version {version}')
+    if byte_order != _BYTE_ORDERS[sys.byteorder]:
+        raise SnapshotError('Snapshot was created on a platform'
+                            ' with different byte order')
+
+    columns = {}
+    for i in range(columns_count):
+        table_name, column_name, typecode, count, offset = \
+            _DIRECTORY_ENTRY.unpack_from(
+                buffer, _HEADER.size + i * _DIRECTORY_ENTRY.size)
+        info = ColumnInfo(typecode.decode('ascii'), count, offset)
+        if offset + count * struct.calcsize(info.typecode) > len(buffer):
+            raise SnapshotError('Snapshot file is truncated')
+        key = (table_name.rstrip(b'\0').decode('ascii'),
+               column_name.rstrip(b'\0').decode('ascii'))
+        columns[key] = info
+    return columns
+
+
+def _align(offset):
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def _pad(f):
+    f.write(b'\0' * (_align(f.tell()) - f.tell()))
@@ -0,0 +1,48 @@
+"""Cache of compiled SQL statements.
+
+SQLAlchemy compiles a statement to SQL on every execution. For a
+simple INSERT that costs more than executing it in SQLite. Statements
+executed again and again (import inserts, report queries) are built
+once with bound parameters and executed with execute(): they are
+compiled once per parameter names.
+
+Cache key is the statement object itself, so a statement must be
+built once and kept (module level or generator attribute). Cache size
+is bounded: statements that are built per call just don't benefit.
+"""
+
+from sqlalchemy.util import LRUCache
+
+
+# Maximum number of compiled statements
+_CACHE_SIZE = 500
+
+_compiled_cache = LRUCache(_CACHE_SIZE)
+
+
+def execute(dbc, statement, params=None):
+    """Execute statement compiled once.
+
+    :param sqlalchemy.engine.Connectable dbc: database connection
+    :param statement: SQL expression construct
+    :param params: dict of parameter values or list of dicts (with the
+        same keys) for executemany
+    :returns: sqlalchemy.engine.ResultProxy
+    """
+    if isinstance(params, list):
+        keys = tuple(sorted(params[0]))
+    else:
+        keys = tuple(sorted(params)) if params else ()
+    # Compiled SQL doesn't depend on dialect options, only on dialect
+    # type (a new dialect instance comes with every engine).
+    key = (statement, type(dbc.dialect), keys, isinstance(params, list))
+    compiled = _compiled_cache.get(key)
+    if compiled is None:
+        compiled = statement.compile(
+            dialect=dbc.dialect,
+            column_keys=list(keys),
+            inline=isinstance(params, list))
+        _compiled_cache[key] = compiled
+    if params is None:
+        return dbc.execute(compiled)
+    return dbc.execute(compiled, params)
@@ -3,12 +3,23 @@
 This module is for report tables, not database tables.
 """
 
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 
 
 # TODO: EmptyCell?
 
 
+class Estimate(namedtuple('Estimate', ['value', 'error'])):
+    """Approximate value: the true value is within value ± error
+    (with high probability).
+    """
+
+    __slots__ = ()
+
+    def __str__(self):
+        return f'{self.value} ± {self.error}'
+
+
 class Table:
     """Table with report results.
 
@@ -60,7 +71,9 @@ class FreeTableBuilder:
 
     This builder supports filling cells in arbitrary order.
 
-    :param str corner_label: label for left top corner (header)
+    :param corner_label: label for left top corner (header). Use a
+        tuple of labels to get several columns with row labels. Row
+        names must be tuples of the same length in this case.
     :param default: value to use for empty cells
     """
 
@@ -83,13 +96,41 @@ class FreeTableBuilder:
         column_names = sorted({column_name
                                for row in self._table.values()
                                for column_name in row.keys()})
+        multiple_labels = isinstance(self._corner_label, tuple)
         # header
-        generated_table.add_row([self._corner_label] + column_names)
+        if multiple_labels:
+            generated_table.add_row(list(self._corner_label) + column_names)
+        else:
+            generated_table.add_row([self._corner_label] + column_names)
 
         for row_name in sorted(self._table.keys()):
+            row_labels = list(row_name) if multiple_labels else [row_name]
             generated_table.add_row(
-                [row_name]
+                row_labels
                 + [self._table[row_name].get(column_name, self._default)
                    for column_name in column_names])
 
         return generated_table
+
+
+def merge_rows(partials, key_size):
+    """Merge partial results of a report.
+
+    Partial results are lists of rows: keys followed by sums (or
+    counts). Sums of rows with the same keys are added up.
+
+    :param partials: iterable of lists of rows
+    :param int key_size: number of keys in a row
+    :returns: list of merged rows in order of first appearance
+    """
+    merged = {}
+    for rows in partials:
+        for row in rows:
+            key = tuple(row[:key_size])
+            sums = merged.get(key)
+            if sums is None:
+                merged[key] = list(row[key_size:])
+            else:
+                for i, value in enumerate(row[key_size:]):
+                    sums[i] += value
+    return [key + tuple(sums) for key, sums in merged.items()]
@@ -3,9 +3,15 @@
 Put shared fixtures, plugins and hooks here.
 """
 
+import datetime
+import io
+
 import pytest
 
 from hbreports import db
+from hbreports.common import TxnStatus
+from hbreports.hbfile import initial_import
+from hbreports.tests.test_hbfile import STANDARD_XHB
 
 
 @pytest.fixture
@@ -20,3 +26,36 @@ def db_connection(db_engine):
     connection = db_engine.connect()
     yield connection
     connection.close()
+
+
+@pytest.fixture
+def std_db(db_connection):
+    """In-memory database with STANDARD_XHB imported."""
+    with db_connection.begin():
+        initial_import(io.StringIO(STANDARD_XHB), db_connection)
+    return db_connection
+
+
+@pytest.fixture
+def txn_db_path(tmp_path):
+    """Database file with transactions of several years (2016-2020)."""
+    path = str(tmp_path / 'test.db')
+    engine = db.init_db(path)
+    with engine.begin() as dbc:
+        dbc.execute(db.currency.insert(), [{'id': 1, 'name': 'currency1'}])
+        dbc.execute(db.account.insert(), [
+            {'id': 1, 'name': 'account1', 'currency_id': 1},
+            {'id': 2, 'name': 'account2', 'currency_id': 1},
+        ])
+        dbc.execute(db.txn.insert(), [
+            {'id': i, 'account_id': i % 2 + 1,
+             'date': datetime.date(2016 + i // 2, 1 + i % 12, 10),
+             'status': TxnStatus.RECONCILED}
+            for i in range(1, 9)])
+        dbc.execute(db.split.insert(), [
+            {'txn_id': i, 'amount': -1.0 * i} for i in range(1, 9)])
+        dbc.execute(db.tag.insert(), [{'id': 1, 'name': 'tag1'}])
+        dbc.execute(db.txn_tag.insert(), [
+            {'tag_id': 1, 'txn_id': i} for i in range(1, 9, 3)])
+    engine.dispose()
+    return path
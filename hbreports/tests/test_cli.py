@@ -1,7 +1,15 @@
+import gzip
+import json
+import os
+
 import pytest
 from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
 
 from hbreports.cli import main
+from hbreports.reports import GENERATORS
+from hbreports.snapshot import Snapshot
+from hbreports.watch import FileWatcher
 
 
 # TODO: use pytest-datadir or pytest-datafiles?
@@ -33,6 +41,22 @@ def test_import_success(tmp_path):
         engine.dispose()
 
 
+def test_import_compressed(tmp_path):
+    xhb_path = tmp_path / 'test.xhb.gz'
+    with gzip.open(xhb_path, 'wt', encoding='utf-8') as f:
+        f.write(MINI_XHB)
+    db_path = tmp_path / 'test.db'
+
+    main(['import', str(xhb_path), str(db_path)])
+
+    engine = create_engine(f'sqlite:///{db_path}')
+    try:
+        count = engine.execute('select count(*) from currency').scalar()
+        assert count >= 1
+    finally:
+        engine.dispose()
+
+
 def test_import_no_xhb_file(tmp_path):
     """Test import - XHB doesn't exist."""
     xhb_path = tmp_path / 'test.xhb'
@@ -67,6 +91,75 @@ def test_import_non_xml_file(tmp_path):
     assert not db_path.exists(), "shouldn't create database, if import fails"
 
 
+def test_import_resume(tmp_path, monkeypatch, capsys):
+    """Interrupted import keeps the database and can be resumed."""
+    monkeypatch.setattr('hbreports.hbfile.CHECKPOINT_INTERVAL', 2)
+    # Account with unknown currency fails after a checkpoint. The
+    # fixed file has the same size.
+    bad_account = '<account key="1" curr="9" name="a" initial="0"/>'
+    fixed_account = '<account key="1" curr="1" name="a" initial="0"/>'
+    xhb = MINI_XHB.replace('</homebank>', bad_account + '</homebank>')
+    xhb_path = tmp_path / 'test.xhb'
+    xhb_path.write_text(xhb, encoding='utf-8')
+    mtime_ns = os.stat(xhb_path).st_mtime_ns
+    db_path = tmp_path / 'test.db'
+
+    with pytest.raises(SystemExit, match='--resume'):
+        main(['import', str(xhb_path), str(db_path)])
+    assert db_path.exists()
+
+    with pytest.raises(SystemExit, match='not complete'):
+        main(['report', str(db_path), 'tta'])
+
+    xhb_path.write_text(xhb.replace(bad_account, fixed_account),
+                        encoding='utf-8')
+    os.utime(xhb_path, ns=(mtime_ns, mtime_ns))
+    main(['import', '--resume', str(xhb_path), str(db_path)])
+
+    main(['report', str(db_path), 'tta'])
+    assert 'Total transactions' in capsys.readouterr().out
+
+
+def test_import_database_error(tmp_path, monkeypatch):
+    """Database errors between batches (e.g. disk is full) keep
+    committed batches."""
+    monkeypatch.setattr('hbreports.hbfile.CHECKPOINT_INTERVAL', 2)
+
+    def checkpoint_wal(dbc, truncate=False):
+        raise OperationalError('PRAGMA wal_checkpoint', {},
+                               Exception('database or disk is full'))
+
+    monkeypatch.setattr('hbreports.db.checkpoint_wal', checkpoint_wal)
+    xhb_path = tmp_path / 'test.xhb'
+    xhb_path.write_text(MINI_XHB, encoding='utf-8')
+    db_path = tmp_path / 'test.db'
+
+    with pytest.raises(SystemExit, match='disk is full.*--resume'):
+        main(['import', str(xhb_path), str(db_path)])
+    assert db_path.exists()
+
+
+def test_import_resume_no_import_state(tmp_path):
+    """Database imported in one transaction can't be resumed."""
+    xhb_path = tmp_path / 'test.xhb'
+    xhb_path.write_text(MINI_XHB, encoding='utf-8')
+    db_path = tmp_path / 'test.db'
+    main(['import-many', str(db_path), str(xhb_path)])
+
+    with pytest.raises(SystemExit, match='no import to resume'):
+        main(['import', '--resume', str(xhb_path), str(db_path)])
+    assert db_path.exists()
+
+
+def test_import_resume_no_db(tmp_path):
+    xhb_path = tmp_path / 'test.xhb'
+    xhb_path.write_text(MINI_XHB, encoding='utf-8')
+
+    with pytest.raises(SystemExit, match='not found'):
+        main(['import', '--resume', str(xhb_path),
+              str(tmp_path / 'test.db')])
+
+
 def test_report_no_db(tmp_path):
     """Test report - db doesn't exist."""
     db_path = tmp_path / 'test.db'
@@ -74,6 +167,19 @@ def test_report_no_db(tmp_path):
         main(['report', str(db_path), 'abc'])
 
 
+def test_report_other_schema_version(tmp_path):
+    xhb_path = tmp_path / 'test.xhb'
+    xhb_path.write_text(MINI_XHB, encoding='utf-8')
+    db_path = tmp_path / 'test.db'
+    main(['import', str(xhb_path), str(db_path)])
+    engine = create_engine(f'sqlite:///{db_path}')
+    engine.execute('PRAGMA user_version = 0')
+    engine.dispose()
+
+    with pytest.raises(SystemExit, match='another version'):
+        main(['report', str(db_path), 'abc'])
+
+
 def test_report_unknown(tmp_path):
     """Test unknown report."""
     db_path = tmp_path / 'test.db'
@@ -86,3 +192,223 @@ def test_report_unknown(tmp_path):
     exc_str = str(exc_info.value).lower()
     assert report_name in exc_str
     assert 'unknown' in exc_str
+
+
+def test_watch_renders_reports(tmp_path, monkeypatch, capsys):
+    xhb_path = tmp_path / 'test.xhb'
+    with xhb_path.open('w') as f:
+        f.write(MINI_XHB)
+    db_path = tmp_path / 'test.db'
+
+    def interrupt(self, timeout=None):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(FileWatcher, 'wait_for_change', interrupt)
+
+    main(['watch', str(xhb_path), '--report', 'tta', '--db', str(db_path)])
+
+    assert db_path.exists()
+    assert 'Total transactions' in capsys.readouterr().out
+
+
+def test_report_several(tmp_path, capsys):
+    xhb_path = tmp_path / 'test.xhb'
+    with xhb_path.open('w') as f:
+        f.write(MINI_XHB)
+    db_path = tmp_path / 'test.db'
+    main(['import', str(xhb_path), str(db_path)])
+
+    main(['report', str(db_path), 'tta', 'abc', '--jobs', '2'])
+
+    output = capsys.readouterr().out
+    assert output.index('Total transactions') < \
+        output.index('Annual balance')
+
+
+def test_import_many(tmp_path):
+    xhb_paths = []
+    for name in ('first', 'second'):
+        xhb_path = tmp_path / f'{name}.xhb'
+        with xhb_path.open('w') as f:
+            f.write(MINI_XHB)
+        xhb_paths.append(str(xhb_path))
+    db_path = tmp_path / 'test.db'
+
+    main(['import-many', str(db_path)] + xhb_paths)
+
+    engine = create_engine(f'sqlite:///{db_path}')
+    try:
+        count = engine.execute('select count(*) from source').scalar()
+        assert count == 2
+    finally:
+        engine.dispose()
+
+
+def test_snapshot(tmp_path):
+    xhb_path = tmp_path / 'test.xhb'
+    with xhb_path.open('w') as f:
+        f.write(MINI_XHB)
+    db_path = tmp_path / 'test.db'
+    main(['import', str(xhb_path), str(db_path)])
+    snapshot_path = tmp_path / 'test.snap'
+
+    main(['snapshot', str(db_path), str(snapshot_path)])
+
+    with Snapshot(str(snapshot_path)) as snapshot:
+        assert snapshot.length('currency') == 1
+
+
+def test_report_unsupported_option(tmp_path):
+    db_path = tmp_path / 'test.db'
+    db_path.touch()
+
+    with pytest.raises(SystemExit, match='period'):
+        main(['report', str(db_path), 'tta', '--period', 'month'])
+
+
+@pytest.mark.parametrize('command', [
+    ['report', 'test.db', 'abc'],
+    ['import-many', 'test.db', 'test.xhb'],
+])
+def test_bad_jobs(command, capsys):
+    for jobs in ['0', '-1', 'x']:
+        with pytest.raises(SystemExit):
+            main(command + ['--jobs', jobs])
+        assert 'positive integer expected' in capsys.readouterr().err
+
+
+def test_report_constructor_type_error(tmp_path, monkeypatch):
+    class BrokenReport:
+        def __init__(self, period=None):
+            raise TypeError('bug')
+
+    monkeypatch.setitem(GENERATORS, 'broken', BrokenReport)
+    db_path = tmp_path / 'test.db'
+    db_path.touch()
+
+    # Not reported as unsupported option
+    with pytest.raises(TypeError, match='bug'):
+        main(['report', str(db_path), 'broken', '--period', 'month'])
+
+
+def test_search(tmp_path, capsys):
+    xhb_path = tmp_path / 'test.xhb'
+    with xhb_path.open('w') as f:
+        f.write(MINI_XHB)
+    db_path = tmp_path / 'test.db'
+    main(['import', str(xhb_path), str(db_path)])
+
+    main(['search', str(db_path), 'anything'])
+
+    assert 'Search results' in capsys.readouterr().out
+
+    with pytest.raises(SystemExit, match='query'):
+        main(['search', str(db_path), '"unterminated'])
+
+
+def test_explain(tmp_path, capsys):
+    xhb_path = tmp_path / 'test.xhb'
+    with xhb_path.open('w') as f:
+        f.write(MINI_XHB)
+    db_path = tmp_path / 'test.db'
+    main(['import', str(xhb_path), str(db_path)])
+
+    main(['explain', str(db_path), 'abc', '--currency', 'RUB'])
+
+    output = capsys.readouterr().out
+    assert 'SELECT' in output
+    assert 'Plan:' in output
+
+
+def test_export(tmp_path):
+    xhb_path = tmp_path / 'test.xhb'
+    with xhb_path.open('w') as f:
+        f.write(MINI_XHB)
+    db_path = tmp_path / 'test.db'
+    main(['import', str(xhb_path), str(db_path)])
+    output_path = tmp_path / 'currency.csv'
+
+    main(['export', str(db_path), '--table', 'currency',
+          '--output', str(output_path)])
+
+    assert output_path.read_text().splitlines() == [
+        'id,name', '1,Russian Ruble']
+
+
+def test_report_filter(tmp_path, capsys):
+    xhb_path = tmp_path / 'test.xhb'
+    with xhb_path.open('w') as f:
+        f.write(MINI_XHB)
+    db_path = tmp_path / 'test.db'
+    main(['import', str(xhb_path), str(db_path)])
+
+    main(['report', str(db_path), 'abc', 'tta', '--from', '2019-01-01',
+          '--status', 'reconciled', '--status', 'cleared',
+          '--paymode', 'cash', '--tag', 'tag1'])
+    assert 'Total transactions' in capsys.readouterr().out
+
+    with pytest.raises(SystemExit, match='categories'):
+        main(['report', str(db_path), 'bot', '--category', 'cat'])
+    with pytest.raises(SystemExit):
+        main(['report', str(db_path), 'abc', '--from', '01.01.2019'])
+
+
+def test_partition(tmp_path, capsys):
+    xhb_path = tmp_path / 'test.xhb'
+    xhb_path.write_text(MINI_XHB.replace('</homebank>', """
+<account key="1" pos="1" type="1" curr="1" name="account1" initial="0"/>
+<ope date="737060" amount="-1" account="1" st="2"/>
+<ope date="737425" amount="-2" account="1" st="2"/>
+</homebank>"""), encoding='utf-8')
+    db_path = tmp_path / 'test.db'
+    main(['import', str(xhb_path), str(db_path)])
+
+    with pytest.raises(SystemExit, match='must be positive'):
+        main(['partition', str(db_path), '--years-per-file', '0'])
+    main(['partition', str(db_path)])
+    assert (tmp_path / 'test.2019.db').exists()
+    assert (tmp_path / 'test.2020.db').exists()
+    main(['report', str(db_path), 'tta', '--from', '2020-01-01'])
+    assert 'account1 | 1' in capsys.readouterr().out.replace('  ', '')
+    with pytest.raises(SystemExit, match='already partitioned'):
+        main(['partition', str(db_path)])
+
+
+def test_memprofile(tmp_path, capsys):
+    xhb_path = tmp_path / 'test.xhb'
+    with xhb_path.open('w') as f:
+        f.write(MINI_XHB)
+    db_path = tmp_path / 'test.db'
+    profile_path = tmp_path / 'import.json'
+    main(['import', str(xhb_path), str(db_path),
+          '--memprofile', str(profile_path)])
+    phases = json.loads(profile_path.read_text())['phases']
+    assert [phase['name'] for phase in phases] == [
+        'import', 'import/derived.refresh']
+
+    profile_path = tmp_path / 'report.json'
+    main(['report', str(db_path), 'tta', 'bbt',
+          '--memprofile', str(profile_path), '--memory-budget', '100'])
+    assert 'Total transactions' in capsys.readouterr().out
+    phases = json.loads(profile_path.read_text())['phases']
+    assert [phase['name'] for phase in phases] == [
+        'report tta', 'render tta',
+        'report bbt', 'report bbt/FreeTableBuilder', 'render bbt']
+
+    with pytest.raises(SystemExit, match='budget'):
+        main(['report', str(db_path), 'tta',
+              '--memprofile', str(profile_path), '--memory-budget', '0'])
+
+
+def test_report_pivot(tmp_path, capsys):
+    xhb_path = tmp_path / 'test.xhb'
+    with xhb_path.open('w') as f:
+        f.write(MINI_XHB)
+    db_path = tmp_path / 'test.db'
+    main(['import', str(xhb_path), str(db_path)])
+
+    main(['report', str(db_path), 'pivot', '--rows', 'payee',
+          '--columns', 'month'])
+    assert 'Balance by payee and month' in capsys.readouterr().out
+
+    main(['report', str(db_path), 'pivot', '--approx'])
+    assert '(approximate)' in capsys.readouterr().out
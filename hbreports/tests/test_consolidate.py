@@ -0,0 +1,96 @@
+import pytest
+from sqlalchemy.sql import func, select
+
+from hbreports import db
+from hbreports.consolidate import import_many
+from hbreports.hbfile import DataImportError
+from hbreports.reports import AnnualBalanceByCategory, TxnsByAccount
+from hbreports.tests.test_hbfile import STANDARD_XHB
+
+
+@pytest.fixture
+def xhb_paths(tmp_path):
+    paths = []
+    for name in ('household1', 'household2'):
+        path = tmp_path / f'{name}.xhb'
+        path.write_text(STANDARD_XHB)
+        paths.append(str(path))
+    return paths
+
+
+def _count(dbc, table):
+    return dbc.execute(select([func.count()]).select_from(table)).scalar()
+
+
+def test_import_many_sources(xhb_paths, db_connection):
+    with db_connection.begin():
+        import_many(xhb_paths, db_connection, max_workers=2)
+
+    rows = db_connection.execute(
+        select([db.source.c.name]).order_by(db.source.c.id)).fetchall()
+    assert [row.name for row in rows] == ['household1', 'household2']
+
+
+def test_import_many_shared_entities(xhb_paths, db_connection):
+    with db_connection.begin():
+        import_many(xhb_paths, db_connection)
+
+    assert _count(db_connection, db.currency) == 2
+    assert _count(db_connection, db.payee) == 2
+    assert _count(db_connection, db.category) == 6
+    assert _count(db_connection, db.account) == 6
+
+
+def test_import_many_transactions(xhb_paths, db_connection):
+    with db_connection.begin():
+        import_many(xhb_paths, db_connection)
+
+    assert _count(db_connection, db.txn) == 12
+    assert _count(db_connection, db.split) == 16
+    assert _count(db_connection, db.txn_tag) == 4
+    # every source has its own accounts
+    rows = db_connection.execute(
+        select([db.account.c.source_id, func.count(db.txn.c.id)])
+        .select_from(db.txn.join(
+            db.account, db.account.c.id == db.txn.c.account_id))
+        .group_by(db.account.c.source_id)
+    ).fetchall()
+    assert sorted(rows) == [(1, 6), (2, 6)]
+
+
+def test_import_many_duplicate_names(tmp_path, db_connection):
+    paths = []
+    for directory in ('a', 'b'):
+        (tmp_path / directory).mkdir()
+        path = tmp_path / directory / 'test.xhb'
+        path.write_text(STANDARD_XHB)
+        paths.append(str(path))
+
+    with pytest.raises(DataImportError, match='unique'):
+        import_many(paths, db_connection)
+
+
+def test_import_many_bad_file(xhb_paths, tmp_path, db_connection):
+    bad_path = tmp_path / 'bad.xhb'
+    bad_path.write_text('test')
+    with pytest.raises(DataImportError, match='bad.xhb'):
+        import_many(xhb_paths + [str(bad_path)], db_connection)
+
+
+def test_reports_by_source(xhb_paths, db_connection):
+    with db_connection.begin():
+        import_many(xhb_paths, db_connection)
+
+    rows = list(TxnsByAccount(source='household1')
+                .generate_report(db_connection).table)
+    assert rows[1:] == [('household1: account1', 5),
+                        ('household1: account2', 1),
+                        ('household1: account3', 0)]
+
+    total = list(AnnualBalanceByCategory(currency='Russian Ruble')
+                 .generate_report(db_connection).table)
+    single = list(AnnualBalanceByCategory(source='household2',
+                                          currency='Russian Ruble')
+                  .generate_report(db_connection).table)
+    assert [row[1:] for row in total[1:]] == \
+        [tuple(2 * value for value in row[1:]) for row in single[1:]]
@@ -0,0 +1,154 @@
+import datetime
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+
+from hbreports import db
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'test.db')
+    db.init_db(path).dispose()
+    return path
+
+
+@pytest.mark.parametrize('immutable', [False, True])
+def test_readonly_pragmas(db_path, immutable):
+    engine = db.open_readonly_db(db_path, immutable=immutable)
+    try:
+        assert engine.execute('PRAGMA cache_size').scalar() == -65536
+        assert engine.execute('PRAGMA temp_store').scalar() == 2
+        assert engine.execute('select count(*) from txn').scalar() == 0
+    finally:
+        engine.dispose()
+
+
+def test_readonly_single_connection(db_path):
+    engine = db.open_readonly_db(db_path, single_connection=True)
+    try:
+        with engine.connect() as first:
+            first_dbapi = first.connection.connection
+        with engine.connect() as second:
+            assert second.connection.connection is first_dbapi
+    finally:
+        engine.dispose()
+
+
+def test_readonly_new_connections(db_path):
+    engine = db.open_readonly_db(db_path)
+    try:
+        with engine.connect() as first:
+            first_dbapi = first.connection.connection
+        with engine.connect() as second:
+            assert second.connection.connection is not first_dbapi
+    finally:
+        engine.dispose()
+
+
+def test_wal_mode(db_path, tmp_path):
+    engine = db.init_db(db_path)
+    try:
+        assert engine.execute('PRAGMA journal_mode').scalar() == 'wal'
+    finally:
+        engine.dispose()
+
+    engine = db.init_db(str(tmp_path / 'rollback.db'), wal=False)
+    try:
+        assert engine.execute('PRAGMA journal_mode').scalar() == 'delete'
+    finally:
+        engine.dispose()
+
+
+def test_manual_wal_checkpoints(db_path):
+    engine = db.init_db(db_path)
+    try:
+        with engine.connect() as dbc:
+            default = dbc.execute('PRAGMA wal_autocheckpoint').scalar()
+            assert default > 0
+            with db.manual_wal_checkpoints(dbc):
+                assert dbc.execute(
+                    'PRAGMA wal_autocheckpoint').scalar() == 0
+            assert dbc.execute(
+                'PRAGMA wal_autocheckpoint').scalar() == default
+    finally:
+        engine.dispose()
+
+
+def test_readers_not_blocked_by_writer(db_path, monkeypatch):
+    # Blocked reader would fail almost immediately
+    monkeypatch.setattr(db, 'BUSY_TIMEOUT', 0.01)
+    writer_engine = db.init_db(db_path)
+    reader_engine = db.open_readonly_db(db_path)
+    # DBAPI connection with explicit transactions
+    writer = writer_engine.raw_connection()
+    writer.connection.isolation_level = None
+    try:
+        cursor = writer.cursor()
+        cursor.execute("INSERT INTO currency (name) VALUES ('committed')")
+        # Exclusive lock keeps readers out in rollback journal mode
+        cursor.execute('BEGIN EXCLUSIVE')
+        cursor.execute("INSERT INTO currency (name) VALUES ('uncommitted')")
+
+        with reader_engine.connect() as reader:
+            names = reader.execute('SELECT name FROM currency').fetchall()
+            assert names == [('committed',)]
+
+        cursor.execute('COMMIT')
+        with reader_engine.connect() as reader:
+            count = reader.execute('SELECT count(*) FROM currency').scalar()
+            assert count == 2
+    finally:
+        writer.close()
+        reader_engine.dispose()
+        writer_engine.dispose()
+
+
+def test_dates_stored_as_ordinals():
+    engine = db.init_db()
+    with engine.connect() as dbc:
+        dbc.execute(db.currency.insert().values(id=1, name='c'))
+        dbc.execute(db.account.insert().values(id=1, name='a',
+                                               currency_id=1))
+        dbc.execute(db.txn.insert().values(
+            id=1, account_id=1, status=0, date=datetime.date(2019, 1, 2)))
+        assert dbc.execute('SELECT date FROM txn').scalar() == 737061
+        assert dbc.execute(
+            select([db.txn.c.date])
+            .where(db.txn.c.date > datetime.date(2019, 1, 1))
+        ).scalar() == datetime.date(2019, 1, 2)
+        assert dbc.execute('SELECT date FROM txn_iso').scalar() == \
+            '2019-01-02'
+        assert dbc.execute(
+            select([func.strftime('%Y-%m', db.julian_day(db.txn.c.date))])
+        ).scalar() == '2019-01'
+
+
+def test_schema_version(db_path):
+    engine = db.open_readonly_db(db_path)
+    try:
+        with engine.connect() as dbc:
+            assert db.read_schema_version(dbc) == db.SCHEMA_VERSION
+    finally:
+        engine.dispose()
+
+
+def test_schema_version_of_existing_db_kept(db_path):
+    engine = db.init_db(db_path)
+    with engine.connect() as dbc:
+        dbc.execute('PRAGMA user_version = 0')
+    engine.dispose()
+    engine = db.init_db(db_path)
+    with engine.connect() as dbc:
+        assert db.read_schema_version(dbc) == 0
+    engine.dispose()
+
+
+def test_account_names_unique_without_source():
+    engine = db.init_db()
+    with engine.connect() as dbc:
+        dbc.execute(db.currency.insert().values(id=1, name='c'))
+        dbc.execute(db.account.insert().values(name='a', currency_id=1))
+        with pytest.raises(IntegrityError):
+            dbc.execute(db.account.insert().values(name='a', currency_id=1))
@@ -0,0 +1,113 @@
+import datetime
+
+import pytest
+from sqlalchemy.sql import select
+
+from hbreports import db
+from hbreports.derived import account_balance, refresh
+
+
+def test_balance_checkpoints(std_db, db_connection):
+    cp = db.balance_checkpoint.c
+    rows = db_connection.execute(
+        select([cp.account_id, cp.month, cp.balance])
+        .order_by(cp.account_id, cp.month)
+    ).fetchall()
+    assert [(account_id, month, round(balance, 2))
+            for account_id, month, balance in rows] == [
+        (1, datetime.date(2019, 1, 1), -8.33),
+        (1, datetime.date(2019, 7, 1), -29.33),
+        (2, datetime.date(2019, 7, 1), 20.33),
+    ]
+
+
+@pytest.mark.parametrize('account_id, date, expected', [
+    (1, datetime.date(2018, 12, 31), 0.0),
+    (1, datetime.date(2019, 1, 1), -1.0),
+    (1, datetime.date(2019, 3, 1), -8.33),
+    (1, datetime.date(2019, 7, 9), -21.33),
+    (1, datetime.date(2020, 1, 1), -29.33),
+    (2, datetime.date(2019, 1, 1), 10.33),
+    (3, datetime.date(2019, 1, 1), 0.0),
+])
+def test_account_balance(std_db, db_connection, account_id, date, expected):
+    assert round(account_balance(db_connection, account_id, date), 2) == \
+        expected
+
+
+def test_refresh_replaces_checkpoints(std_db, db_connection):
+    db_connection.execute(db.split.delete())
+    refresh(db_connection)
+    count = db_connection.execute(
+        select([db.balance_checkpoint])).fetchall()
+    assert count == []
+
+
+def test_category_closure(std_db, db_connection):
+    closure = db.category_closure.c
+    rows = db_connection.execute(
+        select([closure.ancestor_id, closure.descendant_id, closure.depth])
+        .order_by(closure.ancestor_id, closure.descendant_id)
+    ).fetchall()
+    assert rows == [(1, 1, 0), (1, 2, 1), (1, 5, 1),
+                    (2, 2, 0),
+                    (3, 3, 0),
+                    (4, 4, 0), (4, 6, 1),
+                    (5, 5, 0),
+                    (6, 6, 0)]
+
+
+def test_category_closure_deep(db_connection):
+    db_connection.execute(db.category.insert(), [
+        {'id': 1, 'name': 'c1', 'parent_id': None, 'income': False},
+        {'id': 2, 'name': 'c2', 'parent_id': 1, 'income': False},
+        {'id': 3, 'name': 'c3', 'parent_id': 2, 'income': False},
+    ])
+    refresh(db_connection)
+
+    closure = db.category_closure.c
+    rows = db_connection.execute(
+        select([closure.ancestor_id, closure.depth])
+        .where(closure.descendant_id == 3)
+        .order_by(closure.depth)
+    ).fetchall()
+    assert rows == [(3, 0), (2, 1), (1, 2)]
+    top_ids = db_connection.execute(
+        select([db.category.c.top_category_id])
+        .order_by(db.category.c.id)
+    ).fetchall()
+    assert top_ids == [(1,), (1,), (1,)]
+
+
+def test_split_sample_small_strata(std_db, db_connection):
+    # Strata smaller than the minimum sample size are taken whole
+    sample = db_connection.execute(
+        select([db.split_sample.c.id, db.split_sample.c.weight])
+        .order_by(db.split_sample.c.id)).fetchall()
+    splits = db_connection.execute(
+        select([db.split.c.id]).order_by(db.split.c.id)).fetchall()
+    assert [row[0] for row in sample] == [row[0] for row in splits]
+    assert {row[1] for row in sample} == {1.0}
+
+
+def test_split_sample_large_stratum(db_connection):
+    db_connection.execute(db.currency.insert(), {'id': 1, 'name': 'c'})
+    db_connection.execute(db.account.insert(),
+                          {'id': 1, 'name': 'a', 'currency_id': 1})
+    db_connection.execute(db.txn.insert(), [
+        {'id': i, 'account_id': 1, 'date': datetime.date(2019, 1, 1),
+         'status': 0}
+        for i in range(1, 1001)])
+    db_connection.execute(db.split.insert(), [
+        {'txn_id': i, 'amount': float(i), 'category_id': None,
+         'memo': None}
+        for i in range(1, 1001)])
+    refresh(db_connection)
+
+    sample = db_connection.execute(
+        select([db.split_sample.c.amount, db.split_sample.c.weight])
+    ).fetchall()
+    assert len(sample) == 50
+    assert {row[1] for row in sample} == {20.0}
+    # Pseudo-random: not just the first splits
+    assert max(row[0] for row in sample) > 500
@@ -0,0 +1,130 @@
+import threading
+
+import pytest
+
+from hbreports import db
+from hbreports.engines import EngineRegistry
+
+
+@pytest.fixture
+def db_paths(tmp_path):
+    paths = []
+    for i in range(3):
+        path = str(tmp_path / f'{i}.db')
+        db.init_db(path).dispose()
+        paths.append(path)
+    return paths
+
+
+def _write(path, sql):
+    engine = db.init_db(path)
+    try:
+        engine.execute(sql)
+    finally:
+        engine.dispose()
+
+
+def test_same_engine(db_paths):
+    with EngineRegistry() as registry:
+        engine = registry.get(db_paths[0])
+        assert registry.get(db_paths[0]) is engine
+        assert registry.get(db_paths[1]) is not engine
+        assert len(registry) == 2
+
+
+def test_lru_eviction(db_paths, monkeypatch):
+    disposed = []
+    with EngineRegistry(max_engines=2) as registry:
+        first = registry.get(db_paths[0])
+        monkeypatch.setattr(first, 'dispose', lambda: disposed.append(first))
+        second = registry.get(db_paths[1])
+        # first is the most recently used now
+        assert registry.get(db_paths[0]) is first
+        registry.get(db_paths[2])
+
+        assert len(registry) == 2
+        assert registry.get(db_paths[0]) is first
+        assert registry.get(db_paths[1]) is not second
+        assert disposed == []
+    assert disposed == [first]
+
+
+def test_connections_reused(db_paths):
+    with EngineRegistry() as registry:
+        engine = registry.get(db_paths[0])
+        with engine.connect() as dbc:
+            dbapi_connection = dbc.connection.connection
+        _write(db_paths[0], "INSERT INTO currency (name) VALUES ('c')")
+        with registry.get(db_paths[0]).connect() as dbc:
+            assert dbc.connection.connection is dbapi_connection
+            # Kept connection sees changes
+            assert dbc.execute('SELECT count(*) FROM currency').scalar() == 1
+
+
+def test_partitions_detached_on_return(db_paths):
+    with EngineRegistry() as registry:
+        engine = registry.get(db_paths[0])
+        with engine.connect() as dbc:
+            dbc.execute(f"ATTACH DATABASE '{db_paths[1]}' AS partition_2020")
+            dbc.execute('CREATE TEMP VIEW txn AS'
+                        ' SELECT * FROM partition_2020.txn')
+        with engine.connect() as dbc:
+            names = [row[1] for row in dbc.execute('PRAGMA database_list')]
+            assert 'partition_2020' not in names
+            assert dbc.execute(
+                "SELECT count(*) FROM sqlite_temp_master").scalar() == 0
+
+
+def test_data_change_keeps_engine(db_paths):
+    with EngineRegistry() as registry:
+        engine = registry.get(db_paths[0])
+        _write(db_paths[0], "INSERT INTO currency (name) VALUES ('c')")
+        assert registry.get(db_paths[0]) is engine
+
+
+def test_schema_change_reopens_engine(db_paths):
+    with EngineRegistry() as registry:
+        engine = registry.get(db_paths[0])
+        _write(db_paths[0], 'PRAGMA user_version = 100')
+        assert registry.get(db_paths[0]) is not engine
+
+
+def test_immutable_data_change_reopens_engine(db_paths):
+    with EngineRegistry(immutable=True) as registry:
+        engine = registry.get(db_paths[0])
+        _write(db_paths[0], "INSERT INTO currency (name) VALUES ('c')")
+        new_engine = registry.get(db_paths[0])
+        assert new_engine is not engine
+        assert new_engine.execute(
+            'SELECT count(*) FROM currency').scalar() == 1
+
+
+def test_missing_file(db_paths, tmp_path):
+    with EngineRegistry() as registry:
+        registry.get(db_paths[0])
+        (tmp_path / '0.db').unlink()
+        with pytest.raises(FileNotFoundError):
+            registry.get(db_paths[0])
+        assert len(registry) == 0
+
+
+def test_threads(db_paths):
+    errors = []
+
+    def work(registry, thread_number):
+        try:
+            for i in range(30):
+                engine = registry.get(db_paths[(thread_number + i) % 3])
+                engine.execute('SELECT count(*) FROM txn').scalar()
+        except Exception as exc:
+            errors.append(exc)
+
+    with EngineRegistry(max_engines=2) as registry:
+        threads = [threading.Thread(target=work, args=(registry, n))
+                   for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(registry) == 2
+    assert errors == []
@@ -0,0 +1,46 @@
+from hbreports.explain import (
+    PlanStep,
+    _find_problems,
+    explain_report,
+    format_plans,
+)
+from hbreports.reports import AnnualBalanceByCategory, TxnsByAccount
+
+
+def test_explain_report(db_connection):
+    plans = explain_report(db_connection, AnnualBalanceByCategory())
+
+    # cells of pivot table and column keys
+    assert len(plans) == 2
+    plan = plans[0]
+    assert 'FROM txn' in plan.sql
+    assert plan.steps
+    assert all(isinstance(step.detail, str) for step in plan.steps)
+
+
+def test_explain_report_params(db_connection):
+    plans = explain_report(db_connection, TxnsByAccount(currency='c'))
+    assert [tuple(plan.params) for plan in plans] == [('c',)]
+
+
+def test_find_problems():
+    steps = [
+        PlanStep(0, 'SCAN txn'),
+        PlanStep(1, 'SEARCH split USING INDEX ix_split_txn (txn_id=?)'),
+        PlanStep(0, 'SCAN account USING COVERING INDEX ix'),
+        PlanStep(0, 'SEARCH t USING AUTOMATIC COVERING INDEX (id=?)'),
+        PlanStep(0, 'USE TEMP B-TREE FOR GROUP BY'),
+        PlanStep(0, 'SCAN CONSTANT ROW'),
+    ]
+    warnings = _find_problems(steps)
+    assert len(warnings) == 3
+    assert warnings[0].startswith('full table scan')
+    assert warnings[1].startswith('automatic index')
+    assert warnings[2].startswith('temporary B-tree')
+
+
+def test_format_plans(db_connection):
+    plans = explain_report(db_connection, TxnsByAccount())
+    text = format_plans(plans)
+    assert 'Query 1' in text
+    assert 'Plan:' in text
@@ -0,0 +1,67 @@
+import csv
+import io
+import json
+
+import pytest
+
+from hbreports.export import FLAT_TRANSACTIONS, FORMATS, export
+
+
+def _export(dbc, name, output_format):
+    f = io.StringIO(newline='')
+    count = export(dbc, name, f, output_format)
+    f.seek(0)
+    if output_format == 'csv':
+        rows = list(csv.DictReader(f))
+    else:
+        rows = [json.loads(line) for line in f]
+    assert len(rows) == count
+    return rows
+
+
+@pytest.mark.parametrize('output_format', FORMATS)
+def test_export_table(std_db, output_format):
+    rows = _export(std_db, 'currency', output_format)
+    assert [row['name'] for row in rows] == ['Russian Ruble', 'Euro']
+
+
+@pytest.mark.parametrize('output_format', FORMATS)
+def test_export_table_dates(std_db, output_format):
+    rows = _export(std_db, 'txn', output_format)
+    assert [row['date'] for row in rows[:2]] == ['2019-01-01', '2019-01-02']
+
+    rows = _export(std_db, 'balance_checkpoint', output_format)
+    assert rows[0]['month'] == '2019-01-01'
+
+
+def test_export_flat_transactions(std_db):
+    rows = _export(std_db, FLAT_TRANSACTIONS, 'jsonl')
+
+    assert len(rows) == 8
+    full = rows[1]
+    assert full['date'] == '2019-01-02'
+    assert full['account'] == 'account1'
+    assert full['currency'] == 'Russian Ruble'
+    assert full['payee'] == 'payee1'
+    assert full['category'] == 'category1'
+    assert full['tags'] == 'tag1 tag2'
+    assert full['amount'] == -7.33
+    assert rows[0]['payee'] is None
+    assert rows[0]['tags'] is None
+
+
+def test_export_category_path(std_db):
+    std_db.execute(
+        "UPDATE split SET category_id = 2 WHERE txn_id = 1")
+
+    rows = _export(std_db, FLAT_TRANSACTIONS, 'csv')
+
+    assert rows[0]['category'] == 'category1:subcategory1-1'
+    assert rows[0]['tags'] == ''
+
+
+def test_export_unknown(std_db):
+    with pytest.raises(ValueError, match='table'):
+        export(std_db, 'unknown', io.StringIO())
+    with pytest.raises(ValueError, match='format'):
+        export(std_db, 'txn', io.StringIO(), 'xml')
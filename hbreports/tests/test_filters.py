@@ -0,0 +1,51 @@
+import datetime
+
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.sql import and_
+
+from hbreports.common import TxnStatus
+from hbreports.filters import ReportFilter
+
+
+def _compile(conditions):
+    return str(and_(*conditions).compile(dialect=sqlite.dialect()))
+
+
+def test_empty_filter():
+    report_filter = ReportFilter()
+    assert report_filter.criteria() == []
+    assert report_filter.txn_conditions() == []
+    assert report_filter.account_conditions() == []
+
+
+def test_criteria():
+    report_filter = ReportFilter(to_date=datetime.date(2019, 1, 1),
+                                 tags=['tag1'])
+    assert report_filter.criteria() == ['to_date', 'tags']
+
+
+def test_conditions_sargable():
+    """Columns are compared as they are, without functions."""
+    report_filter = ReportFilter(from_date=datetime.date(2019, 1, 1),
+                                 to_date=datetime.date(2019, 12, 31),
+                                 accounts=['account1'],
+                                 statuses=[TxnStatus.RECONCILED])
+
+    sql = _compile(report_filter.txn_conditions())
+
+    assert 'txn.date BETWEEN' in sql
+    assert 'txn.account_id IN (SELECT' in sql
+    assert 'txn.status IN' in sql
+    assert 'strftime' not in sql
+
+
+def test_category_conditions():
+    report_filter = ReportFilter(categories=['category1'])
+
+    with_splits = _compile(report_filter.txn_conditions())
+    without_splits = _compile(
+        report_filter.txn_conditions(split_joined=False))
+
+    assert with_splits.startswith('split.category_id IN')
+    assert without_splits.startswith('txn.id IN')
+    assert 'category_closure' in with_splits
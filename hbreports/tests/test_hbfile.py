@@ -1,5 +1,9 @@
+import bz2
 import datetime
+import gzip
 import io
+import lzma
+import os
 
 import pytest
 from sqlalchemy.sql import (
@@ -13,11 +17,20 @@ from hbreports.db import (
     currency,
     payee,
     split,
+    tag,
     txn,
     txn_tag,
 )
 from hbreports.common import Paymode
-from hbreports.hbfile import initial_import, DataImportError
+from hbreports import db, derived
+from hbreports.hbfile import (
+    PARSERS,
+    DataImportError,
+    checkpointed_import,
+    initial_import,
+    open_xhb,
+    read_import_state,
+)
 
 
 # Hard-coded input makes tests fragile and leads to duplication. On
@@ -262,9 +275,8 @@ def test_import_transaction_no_tags(std_xhb_file, db_connection):
         initial_import(std_xhb_file, db_connection)
 
     count = db_connection.execute(
-        select([func.count(txn_tag.c.id)])
+        select([func.count(txn_tag.c.tag_id)])
         .where(txn_tag.c.txn_id == 1)
-        .order_by(txn_tag.c.name)
     ).scalar()
     assert count == 0
 
@@ -274,9 +286,10 @@ def test_import_transaction_with_tags(std_xhb_file, db_connection):
         initial_import(std_xhb_file, db_connection)
 
     rows = db_connection.execute(
-        select([txn_tag.c.name])
+        select([tag.c.name])
+        .select_from(txn_tag.join(tag, tag.c.id == txn_tag.c.tag_id))
         .where(txn_tag.c.txn_id == 2)
-        .order_by(txn_tag.c.name)
+        .order_by(tag.c.name)
     ).fetchall()
     assert [row.name for row in rows] == ['tag1', 'tag2']
 
@@ -304,3 +317,226 @@ def test_import_other_xml_file(db_connection):
     with pytest.raises(DataImportError, match='HomeBank'), \
          db_connection.begin():  # noqa
         initial_import(io.StringIO('<foobar/>'), db_connection)
+
+
+def test_import_tags_interned(db_connection):
+    """Every tag name is stored once."""
+    xhb = STANDARD_XHB.replace(
+        '</homebank>',
+        '<ope date="737255" amount="-1" account="1" tags="tag2 tag3 tag3"/>'
+        '</homebank>')
+    with db_connection.begin():
+        initial_import(io.StringIO(xhb), db_connection)
+
+    names = db_connection.execute(
+        select([tag.c.name]).order_by(tag.c.name)).fetchall()
+    assert [row.name for row in names] == ['tag1', 'tag2', 'tag3']
+    count = db_connection.execute(
+        select([func.count()]).select_from(txn_tag)).scalar()
+    assert count == 4
+
+
+@pytest.mark.parametrize('compress', [
+    lambda data: data,
+    gzip.compress,
+    bz2.compress,
+    lzma.compress,
+], ids=['plain', 'gzip', 'bzip2', 'xz'])
+def test_import_compressed(compress, tmp_path, db_connection):
+    """Test import of compressed file. Extension doesn't matter."""
+    path = tmp_path / 'test.xhb'
+    path.write_bytes(compress(STANDARD_XHB.encode('utf-8')))
+
+    with db_connection.begin(), open_xhb(str(path)) as f:
+        initial_import(f, db_connection)
+
+    count = db_connection.execute(select([func.count(txn.c.id)])).scalar()
+    assert count == 6
+
+
+@pytest.fixture(params=sorted(PARSERS))
+def parser_name(request):
+    return request.param
+
+
+def _dump_tables(dbc):
+    return {table.name: dbc.execute(
+                select([table]).order_by(*table.primary_key)).fetchall()
+            for table in db.metadata.sorted_tables}
+
+
+def test_parsers_equivalent(db_engine):
+    """All parser engines produce the same data."""
+    dumps = []
+    for name in sorted(PARSERS):
+        with db_engine.begin() as dbc:
+            initial_import(io.StringIO(STANDARD_XHB), dbc, parser=name)
+            dumps.append(_dump_tables(dbc))
+            for table in reversed(db.metadata.sorted_tables):
+                dbc.execute(table.delete())
+    assert dumps[0] == dumps[1]
+    assert dumps[0]['txn']
+
+
+def test_parser_binary_input(parser_name, db_connection):
+    with db_connection.begin():
+        initial_import(io.BytesIO(STANDARD_XHB.encode('utf-8')),
+                       db_connection, parser=parser_name)
+    count = db_connection.execute(select([func.count(txn.c.id)])).scalar()
+    assert count == 6
+
+
+@pytest.mark.parametrize('data, match', [
+    ('', 'XML'),
+    ('<foobar/>', 'HomeBank'),
+    (STANDARD_XHB[:-30], 'XML'),
+    (NO_CURRENCY_NAME_XHB, 'name'),
+], ids=['empty', 'other_xml', 'truncated', 'no_attribute'])
+def test_parser_errors(parser_name, data, match, db_connection):
+    with pytest.raises(DataImportError, match=match), db_connection.begin():
+        initial_import(io.StringIO(data), db_connection, parser=parser_name)
+
+
+@pytest.mark.parametrize('compress', [
+    gzip.compress,
+    bz2.compress,
+    lzma.compress,
+], ids=['gzip', 'bzip2', 'xz'])
+def test_import_truncated_compressed(compress, parser_name, tmp_path,
+                                     db_connection):
+    path = tmp_path / 'test.xhb'
+    data = compress(STANDARD_XHB.encode('utf-8'))
+    path.write_bytes(data[:len(data) // 2])
+
+    with pytest.raises(DataImportError, match='Failed to read'):
+        with db_connection.begin(), open_xhb(str(path)) as f:
+            initial_import(f, db_connection, parser=parser_name)
+
+
+def test_parser_database_error(parser_name, db_connection):
+    with pytest.raises(DataImportError, match='"account"'), \
+            db_connection.begin():
+        initial_import(io.StringIO(NO_CURRENCY_XHB), db_connection,
+                       parser=parser_name)
+
+
+def test_unknown_parser(db_connection):
+    with pytest.raises(ValueError):
+        initial_import(io.StringIO(STANDARD_XHB), db_connection,
+                       parser='unknown')
+
+
+# Transaction with unknown account fails on insert (foreign key).
+# Fixing the file doesn't change its size.
+BAD_TXN = '<ope date="737255" amount="-1" account="9"/>'
+FIXED_TXN = '<ope date="737255" amount="-1" account="3"/>'
+
+
+def _write_xhb(path, data, mtime_ns=None):
+    path.write_text(data, encoding='utf-8')
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+    return str(path)
+
+
+def test_checkpointed_import(parser_name, tmp_path, db_engine):
+    xhb_path = _write_xhb(tmp_path / 'test.xhb', STANDARD_XHB)
+
+    checkpointed_import(xhb_path, db_engine, parser=parser_name,
+                        checkpoint_interval=3)
+
+    with db_engine.connect() as dbc:
+        state = read_import_state(dbc)
+        assert state.complete
+        assert state.elements == STANDARD_XHB.count('<') - 1
+        count = dbc.execute(select([func.count(txn.c.id)])).scalar()
+        assert count == 6
+
+
+def test_checkpointed_import_resume(parser_name, tmp_path, db_engine):
+    """Interrupted import keeps committed batches and can be resumed."""
+    xhb = STANDARD_XHB.replace('</homebank>', BAD_TXN + '</homebank>')
+    xhb_path = _write_xhb(tmp_path / 'test.xhb', xhb)
+    mtime_ns = os.stat(xhb_path).st_mtime_ns
+
+    with pytest.raises(DataImportError, match='"ope"'):
+        checkpointed_import(xhb_path, db_engine, parser=parser_name,
+                            checkpoint_interval=4)
+
+    with db_engine.connect() as dbc:
+        state = read_import_state(dbc)
+        assert not state.complete
+        assert state.elements == 20
+        if parser_name == 'expat':
+            assert state.byte_offset > 0
+        # 5 of 6 good transactions are imported before the last
+        # checkpoint
+        count = dbc.execute(select([func.count(txn.c.id)])).scalar()
+        assert count == 5
+
+    _write_xhb(tmp_path / 'test.xhb', xhb.replace(BAD_TXN, FIXED_TXN),
+               mtime_ns)
+    checkpointed_import(xhb_path, db_engine, resume=True,
+                        parser=parser_name, checkpoint_interval=4)
+
+    with db_engine.connect() as dbc:
+        assert read_import_state(dbc).complete
+        resumed = _dump_tables(dbc)
+    engine = db.init_db()
+    try:
+        with engine.begin() as dbc:
+            initial_import(io.StringIO(xhb.replace(BAD_TXN, FIXED_TXN)),
+                           dbc)
+            expected = _dump_tables(dbc)
+    finally:
+        engine.dispose()
+    del resumed['import_state']
+    del expected['import_state']
+    assert resumed == expected
+
+
+def test_checkpointed_import_resume_changed_file(tmp_path, db_engine):
+    xhb = STANDARD_XHB.replace('</homebank>', BAD_TXN + '</homebank>')
+    xhb_path = _write_xhb(tmp_path / 'test.xhb', xhb)
+    with pytest.raises(DataImportError):
+        checkpointed_import(xhb_path, db_engine, checkpoint_interval=4)
+
+    _write_xhb(tmp_path / 'test.xhb', xhb.replace(BAD_TXN, ''))
+    with pytest.raises(DataImportError, match='changed'):
+        checkpointed_import(xhb_path, db_engine, resume=True)
+
+
+def test_checkpointed_import_resume_complete(tmp_path, db_engine):
+    xhb_path = _write_xhb(tmp_path / 'test.xhb', STANDARD_XHB)
+    checkpointed_import(xhb_path, db_engine)
+    with pytest.raises(DataImportError, match='complete'):
+        checkpointed_import(xhb_path, db_engine, resume=True)
+
+
+def test_checkpointed_import_concurrent_reader(tmp_path, monkeypatch):
+    """Readers see the last committed batch while import runs."""
+    xhb_path = _write_xhb(tmp_path / 'test.xhb', STANDARD_XHB)
+    db_path = str(tmp_path / 'test.db')
+    monkeypatch.setattr(db, 'BUSY_TIMEOUT', 0.01)
+    engine = db.init_db(db_path)
+    reader_engine = db.open_readonly_db(db_path)
+    seen = []
+
+    def refresh(dbc):
+        # Runs at the end of the last (uncommitted) batch
+        with reader_engine.connect() as reader:
+            seen.append((read_import_state(reader).complete,
+                         reader.execute(select([func.count(txn.c.id)]))
+                         .scalar()))
+        original_refresh(dbc)
+
+    original_refresh = derived.refresh
+    monkeypatch.setattr(derived, 'refresh', refresh)
+    try:
+        checkpointed_import(xhb_path, engine, checkpoint_interval=4)
+        with reader_engine.connect() as reader:
+            assert read_import_state(reader).complete
+    finally:
+        reader_engine.dispose()
+        engine.dispose()
+    assert seen == [(False, 5)]
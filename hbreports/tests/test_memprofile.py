@@ -0,0 +1,70 @@
+import io
+import json
+import tracemalloc
+
+import pytest
+
+from hbreports import memprofile
+from hbreports.memprofile import MemoryProfiler, check_budget, phase
+
+
+_SIZE = 1024 * 1024
+
+
+def test_phases():
+    with MemoryProfiler() as profiler:
+        with phase('outer'):
+            kept = bytearray(_SIZE)
+            with phase('inner'):
+                freed = bytearray(2 * _SIZE)
+                del freed
+
+    outer, inner = profiler.phases
+    assert outer['name'] == 'outer'
+    assert inner['name'] == 'outer/inner'
+    assert inner['peak_bytes'] - inner['start_bytes'] >= 2 * _SIZE
+    assert inner['end_bytes'] - inner['start_bytes'] < _SIZE
+    # Nested peak counts for outer phase
+    assert outer['peak_bytes'] >= inner['peak_bytes']
+    assert outer['end_bytes'] - outer['start_bytes'] >= _SIZE
+    assert any(site['size_bytes'] >= _SIZE for site in outer['top'])
+    assert outer['seconds'] >= inner['seconds']
+    assert len(kept) == _SIZE
+    assert not tracemalloc.is_tracing()
+
+
+def test_phase_without_profiler():
+    with phase('nothing'):
+        pass
+    assert memprofile._profiler is None
+
+
+def test_without_reset_peak(monkeypatch):
+    # Python < 3.9: peaks since tracing started (upper bounds)
+    monkeypatch.delattr(tracemalloc, 'reset_peak', raising=False)
+    with MemoryProfiler() as profiler:
+        with phase('first'):
+            freed = bytearray(2 * _SIZE)
+            del freed
+        with phase('second'):
+            pass
+
+    first, second = profiler.phases
+    assert second['peak_bytes'] >= first['peak_bytes']
+    f = io.StringIO()
+    profiler.write_json(f)
+    assert json.loads(f.getvalue())['exact_peaks'] is False
+
+
+@pytest.mark.parametrize('budget_mib, exceeded', [(0.5, True), (1000, False)])
+def test_check_budget(budget_mib, exceeded):
+    with MemoryProfiler() as profiler:
+        with phase('big'):
+            freed = bytearray(_SIZE)
+            del freed
+
+    message = check_budget(profiler, budget_mib)
+    if exceeded:
+        assert '"big"' in message
+    else:
+        assert message is None
@@ -0,0 +1,113 @@
+import asyncio
+import datetime
+
+import pytest
+
+from hbreports import db
+from hbreports.filters import ReportFilter
+from hbreports.parallel import (
+    generate_many,
+    generate_many_sync,
+    split_date_range,
+)
+from hbreports.reports import (
+    AnnualBalanceByCategory,
+    BalanceByDimensions,
+    BalanceByTag,
+    BalanceOverTime,
+    TxnsByAccount,
+)
+
+
+def _sequential_reports(txn_db_path, report_gens):
+    engine = db.init_db(txn_db_path)
+    try:
+        with engine.connect() as dbc:
+            return [gen.generate_report(dbc) for gen in report_gens]
+    finally:
+        engine.dispose()
+
+
+@pytest.mark.parametrize('processes', [False, True])
+def test_generate_many_sync(txn_db_path, processes):
+    report_gens = [AnnualBalanceByCategory(), TxnsByAccount(),
+                   AnnualBalanceByCategory(from_year=2018)]
+    reports = generate_many_sync(txn_db_path, report_gens, processes=processes)
+
+    expected = _sequential_reports(txn_db_path, report_gens)
+    assert [report.name for report in reports] == \
+        [report.name for report in expected]
+    assert [list(report.table) for report in reports] == \
+        [list(report.table) for report in expected]
+
+
+@pytest.mark.parametrize('report_gen', [
+    TxnsByAccount(),
+    AnnualBalanceByCategory(),
+    AnnualBalanceByCategory(from_year=2018),
+    AnnualBalanceByCategory(approx=True),
+    BalanceByDimensions(rows='account', columns='month'),
+    BalanceByTag(period='month'),
+    BalanceOverTime(),
+])
+def test_generate_sharded(txn_db_path, report_gen):
+    report, = generate_many_sync(txn_db_path, [report_gen], shards=3)
+    expected, = _sequential_reports(txn_db_path, [report_gen])
+    assert report.name == expected.name
+    assert list(report.table) == list(expected.table)
+
+
+def test_split_date_range(txn_db_path):
+    engine = db.open_readonly_db(txn_db_path)
+    try:
+        with engine.connect() as dbc:
+            assert split_date_range(dbc, None, None, 4) == [
+                (None, datetime.date(2017, 4, 9)),
+                (datetime.date(2017, 4, 10), datetime.date(2018, 6, 9)),
+                (datetime.date(2018, 6, 10), datetime.date(2019, 8, 9)),
+                (datetime.date(2019, 8, 10), None),
+            ]
+            # days with transactions are never split
+            assert len(split_date_range(dbc, None, None, 20)) == 8
+            assert split_date_range(
+                dbc, datetime.date(2017, 1, 1), None, 1
+            ) == [(datetime.date(2017, 1, 1), None)]
+            # no transactions
+            date_range = (datetime.date(2021, 1, 1),
+                          datetime.date(2021, 12, 31))
+            assert split_date_range(dbc, *date_range, 2) == [date_range]
+    finally:
+        engine.dispose()
+
+
+def test_shard_restricts_dates():
+    report_gen = AnnualBalanceByCategory(
+        from_year=2017, report_filter=ReportFilter(
+            to_date=datetime.date(2020, 6, 30), accounts=['account1']))
+    assert report_gen.date_range() == (datetime.date(2017, 1, 1),
+                                       datetime.date(2020, 6, 30))
+    shard = report_gen.shard(datetime.date(2018, 1, 1), None)
+    assert shard._filter == ReportFilter(
+        from_date=datetime.date(2018, 1, 1), accounts=['account1'])
+    assert report_gen._filter.from_date is None
+
+
+def test_generate_many_async(txn_db_path):
+    report_gens = [TxnsByAccount(), AnnualBalanceByCategory()]
+    reports = asyncio.run(
+        generate_many(txn_db_path, report_gens, max_workers=2))
+    assert [report.name for report in reports] == \
+        [gen.name for gen in report_gens]
+
+
+def test_generate_many_empty(txn_db_path):
+    assert generate_many_sync(txn_db_path, []) == []
+
+
+def test_readonly_connection(txn_db_path):
+    engine = db.open_readonly_db(txn_db_path)
+    try:
+        with pytest.raises(Exception, match='readonly'):
+            engine.execute(db.currency.insert().values(id=2, name='c2'))
+    finally:
+        engine.dispose()
@@ -0,0 +1,170 @@
+import datetime
+import os
+
+import pytest
+
+from hbreports import db, partitions
+from hbreports.filters import ReportFilter
+from hbreports.parallel import generate_many_sync
+from hbreports.partitions import PartitionError, partition_db
+from hbreports.reports import (
+    AnnualBalanceByCategory,
+    BalanceByTag,
+    BalanceOverTime,
+    TxnsByAccount,
+)
+
+
+def _open(path):
+    return db.open_readonly_db(path)
+
+
+def _attached(dbc):
+    return [row['name'] for row in dbc.execute('PRAGMA database_list')
+            if row['name'].startswith('partition_')]
+
+
+def test_partition_db(txn_db_path):
+    paths = partition_db(txn_db_path)
+
+    assert [os.path.basename(path) for path in paths] == [
+        'test.2016.db', 'test.2017.db', 'test.2018.db', 'test.2019.db',
+        'test.2020.db']
+    assert not os.stat(paths[0]).st_mode & 0o222
+    assert os.stat(paths[-1]).st_mode & 0o200
+    engine = _open(txn_db_path)
+    try:
+        with engine.connect() as dbc:
+            assert dbc.execute('SELECT count(*) FROM txn').scalar() == 0
+            partitions.attach(dbc)
+            assert dbc.execute('SELECT count(*) FROM txn').scalar() == 8
+            assert dbc.execute('SELECT count(*) FROM split').scalar() == 8
+            assert dbc.execute('SELECT count(*) FROM txn_tag').scalar() == 3
+    finally:
+        engine.dispose()
+
+
+def test_partition_db_several_years(txn_db_path):
+    paths = partition_db(txn_db_path, years_per_file=2)
+    assert [os.path.basename(path) for path in paths] == [
+        'test.2016-2017.db', 'test.2018-2019.db', 'test.2020.db']
+
+
+def test_partition_db_twice(txn_db_path):
+    partition_db(txn_db_path)
+    with pytest.raises(PartitionError, match='already partitioned'):
+        partition_db(txn_db_path)
+
+
+def test_partition_db_long_history(txn_db_path, monkeypatch):
+    # More years per file to attach all partitions at once
+    monkeypatch.setattr(partitions, 'MAX_ATTACHED', 2)
+    paths = partition_db(txn_db_path)
+    assert [os.path.basename(path) for path in paths] == [
+        'test.2016-2018.db', 'test.2019-2020.db']
+
+
+def test_partition_file_exists(txn_db_path, tmp_path):
+    (tmp_path / 'test.2019.db').touch()
+    with pytest.raises(PartitionError, match='already exists'):
+        partition_db(txn_db_path)
+    # Checked before any partition is created
+    assert sorted(os.listdir(tmp_path)) == ['test.2019.db', 'test.db']
+
+
+def test_partition_db_failed(txn_db_path, tmp_path, monkeypatch):
+    create_partition = partitions._create_partition
+
+    def fail_on_last(dbc, path, partition):
+        create_partition(dbc, path, partition)
+        if path.endswith('2020.db'):
+            raise OSError('disk full')
+
+    monkeypatch.setattr(partitions, '_create_partition', fail_on_last)
+    with pytest.raises(OSError):
+        partition_db(txn_db_path)
+    assert os.listdir(tmp_path) == ['test.db']
+    engine = _open(txn_db_path)
+    try:
+        with engine.connect() as dbc:
+            assert dbc.execute('SELECT count(*) FROM txn').scalar() == 8
+    finally:
+        engine.dispose()
+
+
+def test_partition_db_bad_years_per_file(txn_db_path):
+    with pytest.raises(ValueError):
+        partition_db(txn_db_path, years_per_file=0)
+
+
+def test_attach_prunes_partitions(txn_db_path):
+    partition_db(txn_db_path)
+    engine = _open(txn_db_path)
+    try:
+        with engine.connect() as dbc:
+            partitions.attach(dbc, datetime.date(2017, 6, 1),
+                              datetime.date(2018, 6, 1))
+            assert _attached(dbc) == ['partition_2017', 'partition_2018']
+            assert dbc.execute('SELECT count(*) FROM txn').scalar() == 4
+            # attached again for another range
+            partitions.attach(dbc, from_date=datetime.date(2020, 1, 1))
+            assert _attached(dbc) == ['partition_2020']
+            partitions.detach(dbc)
+            assert _attached(dbc) == []
+            assert dbc.execute('SELECT count(*) FROM txn').scalar() == 0
+    finally:
+        engine.dispose()
+
+
+def test_attach_report(txn_db_path):
+    partition_db(txn_db_path)
+    engine = _open(txn_db_path)
+    try:
+        with engine.connect() as dbc:
+            partitions.attach_report(dbc, AnnualBalanceByCategory(
+                from_year=2019))
+            assert _attached(dbc) == ['partition_2019', 'partition_2020']
+            partitions.attach_report(dbc, TxnsByAccount())
+            assert len(_attached(dbc)) == 5
+    finally:
+        engine.dispose()
+
+
+def test_attach_not_partitioned(txn_db_path):
+    engine = _open(txn_db_path)
+    try:
+        with engine.connect() as dbc:
+            partitions.attach(dbc)
+            assert _attached(dbc) == []
+            assert dbc.execute('SELECT count(*) FROM txn').scalar() == 8
+    finally:
+        engine.dispose()
+
+
+def test_attach_too_many(txn_db_path, monkeypatch):
+    partition_db(txn_db_path)
+    monkeypatch.setattr(partitions, 'MAX_ATTACHED', 2)
+    engine = _open(txn_db_path)
+    try:
+        with engine.connect() as dbc:
+            with pytest.raises(PartitionError, match='spans 5 partitions'):
+                partitions.attach(dbc)
+    finally:
+        engine.dispose()
+
+
+@pytest.mark.parametrize('shards', [1, 3])
+def test_reports_same_after_partitioning(txn_db_path, shards):
+    report_gens = [
+        TxnsByAccount(),
+        AnnualBalanceByCategory(),
+        AnnualBalanceByCategory(report_filter=ReportFilter(
+            from_date=datetime.date(2017, 3, 1))),
+        BalanceByTag(period='month'),
+        BalanceOverTime(),
+    ]
+    expected = generate_many_sync(txn_db_path, report_gens)
+    partition_db(txn_db_path)
+    reports = generate_many_sync(txn_db_path, report_gens, shards=shards)
+    assert [list(report.table) for report in reports] == \
+        [list(report.table) for report in expected]
@@ -0,0 +1,98 @@
+import pytest
+from sqlalchemy import func
+
+from hbreports.db import account, currency, julian_day, txn
+from hbreports.pivot import TOTAL_LABEL, Pivot, pivot_table
+from hbreports.tables import Estimate
+
+
+@pytest.fixture
+def pivot_db(db_connection):
+    db_connection.execute(currency.insert(), [
+        {'id': 1, 'name': 'c1'},
+        {'id': 2, 'name': 'c2'},
+    ])
+    db_connection.execute(account.insert(), [
+        {'id': 1, 'name': 'a1', 'currency_id': 1, 'initial': 1.0},
+        {'id': 2, 'name': 'a2', 'currency_id': 1, 'initial': 2.0},
+        {'id': 3, 'name': 'a3', 'currency_id': 2, 'initial': 4.0},
+    ])
+    return db_connection
+
+
+def _pivot(dbc, **kwargs):
+    # Pivot of account initial balances: currency by account name
+    return list(pivot_table(
+        dbc, account.join(currency, currency.c.id == account.c.currency_id),
+        [], row_key=currency.c.name, column_key=account.c.name,
+        value=account.c.initial, corner_label='C/A', **kwargs))
+
+
+def test_pivot(pivot_db):
+    assert _pivot(pivot_db) == [
+        ('C/A', 'a1', 'a2', 'a3', TOTAL_LABEL),
+        ('c1', 1.0, 2.0, 0.0, 3.0),
+        ('c2', 0.0, 0.0, 4.0, 4.0),
+        (TOTAL_LABEL, 1.0, 2.0, 4.0, 7.0),
+    ]
+
+
+def test_pivot_no_totals(pivot_db):
+    assert _pivot(pivot_db, totals=False) == [
+        ('C/A', 'a1', 'a2', 'a3'),
+        ('c1', 1.0, 2.0, 0.0),
+        ('c2', 0.0, 0.0, 4.0),
+    ]
+
+
+def test_pivot_groups(pivot_db):
+    """Every group gets its own totals."""
+    table = _pivot(pivot_db, group_key=currency.c.name, group_label='G')
+    assert table == [
+        ('G', 'C/A', 'a1', 'a2', 'a3', TOTAL_LABEL),
+        ('c1', 'c1', 1.0, 2.0, 0.0, 3.0),
+        ('c1', TOTAL_LABEL, 1.0, 2.0, 0.0, 3.0),
+        ('c2', 'c2', 0.0, 0.0, 4.0, 4.0),
+        ('c2', TOTAL_LABEL, 0.0, 0.0, 4.0, 4.0),
+    ]
+
+
+def test_pivot_empty(db_connection):
+    table = pivot_table(
+        db_connection, txn, [], row_key=txn.c.memo,
+        column_key=func.strftime('%Y', julian_day(txn.c.date)),
+        value=txn.c.id,
+        corner_label='M/Y')
+    assert not table
+
+
+def test_pivot_temporary_table_dropped(pivot_db):
+    _pivot(pivot_db)
+    _pivot(pivot_db)
+
+
+def test_pivot_variance(pivot_db):
+    rows = _pivot(pivot_db, variance=account.c.initial * 0 + 0.25)
+    assert rows[1] == ('c1', Estimate(1.0, 0.98), Estimate(2.0, 0.98),
+                       Estimate(0.0, 0.0), Estimate(3.0, 1.96 * 0.5 ** 0.5))
+    assert rows[-1][-1] == Estimate(7.0, 1.96 * 0.75 ** 0.5)
+
+
+@pytest.mark.parametrize('kwargs', [
+    {},
+    {'totals': False},
+    {'group_key': currency.c.name, 'group_label': 'G'},
+    {'variance': account.c.initial * 0 + 0.25},
+])
+def test_pivot_merged_table(pivot_db, kwargs):
+    from_obj = account.join(currency, currency.c.id == account.c.currency_id)
+    partials = [
+        Pivot(from_obj, [condition], row_key=currency.c.name,
+              column_key=account.c.name, value=account.c.initial,
+              corner_label='C/A', **kwargs).cells(pivot_db)
+        for condition in [account.c.id < 2, account.c.id >= 2]]
+    pivot = Pivot(from_obj, [], row_key=currency.c.name,
+                  column_key=account.c.name, value=account.c.initial,
+                  corner_label='C/A', **kwargs)
+    assert list(pivot.merged_table(partials)) == list(pivot.table(pivot_db))
+    assert not pivot.merged_table([[], []])
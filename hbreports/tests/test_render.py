@@ -2,7 +2,7 @@ import io
 
 from hbreports.render import PlainTextRenderer
 from hbreports.reports import Report
-from hbreports.tables import Table
+from hbreports.tables import Estimate, Table
 
 
 def test_render_minimal_report_to_plain_text():
@@ -22,4 +22,21 @@ def test_render_minimal_report_to_plain_text():
             assert cell in output, 'cell value not found in stream'
 
 
-# TODO: test empty table
+def test_render_empty_table_to_plain_text():
+    stream = io.StringIO()
+    renderer = PlainTextRenderer(stream)
+
+    renderer.render(Report('Report name', Table()))
+
+    assert 'no data' in stream.getvalue().lower()
+
+
+def test_render_estimate():
+    stream = io.StringIO()
+    renderer = PlainTextRenderer(stream)
+
+    table = Table([['h1', 'h2'],
+                   ['c21', Estimate(-10.0, 1.234)]])
+    renderer.render(Report('Report name', table))
+
+    assert '-10.00 ± 1.23' in stream.getvalue()
@@ -2,14 +2,18 @@ import datetime
 
 import pytest
 
-from hbreports import db
+from hbreports import db, derived
 from hbreports.common import Paymode, TxnStatus
+from hbreports.filters import ReportFilter
 from hbreports.reports import (
     AnnualBalanceByCategory,
+    BalanceByDimensions,
+    BalanceByTag,
+    BalanceOverTime,
     Report,
     TxnsByAccount,
 )
-from hbreports.tables import Table
+from hbreports.tables import Estimate, Table
 
 
 @pytest.fixture
@@ -18,10 +22,12 @@ def demo_db(db_connection):
     # keys will be silently ignored.
     db_connection.execute(db.currency.insert(), [
         {'id': 1, 'name': 'currency1'},
+        {'id': 2, 'name': 'currency2'},
     ])
     db_connection.execute(db.account.insert(), [
         {'id': 1, 'name': 'account1', 'currency_id': 1},
         {'id': 2, 'name': 'account2', 'currency_id': 1},
+        {'id': 3, 'name': 'account3', 'currency_id': 2},
     ])
     db_connection.execute(db.category.insert(), [
         {'id': 1, 'name': 'expense_cat1', 'income': False}
@@ -31,12 +37,25 @@ def demo_db(db_connection):
          'status': TxnStatus.RECONCILED},
         {'id': 2, 'account_id': 1, 'date': datetime.date(2018, 1, 10),
          'status': TxnStatus.RECONCILED},
+        {'id': 3, 'account_id': 3, 'date': datetime.date(2018, 2, 10),
+         'status': TxnStatus.RECONCILED},
     ])
     db_connection.execute(db.split.insert(), [
         {'txn_id': 1, 'amount': -10.0, 'category_id': None},
         {'txn_id': 2, 'amount': -15.0, 'category_id': None},
         {'txn_id': 2, 'amount': -1.1, 'category_id': 1},
+        {'txn_id': 3, 'amount': -7.0, 'category_id': 1},
+    ])
+    db_connection.execute(db.tag.insert(), [
+        {'id': 1, 'name': 'tag1'},
+        {'id': 2, 'name': 'tag2'},
+    ])
+    db_connection.execute(db.txn_tag.insert(), [
+        {'tag_id': 1, 'txn_id': 1},
+        {'tag_id': 1, 'txn_id': 2},
+        {'tag_id': 2, 'txn_id': 2},
     ])
+    derived.refresh(db_connection)
 
 
 def test_report_minimal():
@@ -113,6 +132,25 @@ def test_tta_basic(db_connection):
     assert list(row2) == [accounts[1]['name'], 0]
 
 
+def test_tta_filter(db_connection, demo_db):
+    report_filter = ReportFilter(tags=['tag2'])
+    report = TxnsByAccount(report_filter=report_filter).generate_report(
+        db_connection)
+
+    assert list(report.table)[1:] == [('account1', 1),
+                                      ('account2', 0),
+                                      ('account3', 0)]
+
+
+def test_tta_filter_accounts_and_categories(db_connection, demo_db):
+    report_filter = ReportFilter(accounts=['account1', 'account3'],
+                                 categories=['expense_cat1'])
+    report = TxnsByAccount(report_filter=report_filter).generate_report(
+        db_connection)
+
+    assert list(report.table)[1:] == [('account1', 1), ('account3', 1)]
+
+
 # Annual expenses by category report tests
 
 
@@ -129,7 +167,8 @@ def test_abc_defaults(db_connection, demo_db):
 def test_abc_basic(db_connection, demo_db):
     year = 2018
     generator = AnnualBalanceByCategory(from_year=year,
-                                        to_year=year)
+                                        to_year=year,
+                                        currency='currency1')
     report = generator.generate_report(db_connection)
     assert isinstance(report.name, str)
     assert isinstance(report.description, str)
@@ -143,3 +182,215 @@ def test_abc_basic(db_connection, demo_db):
     assert '<other>' in categories
     assert 'expense_cat1' in categories
     assert isinstance(rows[1][1], float)
+
+
+def test_abc_all_currencies(db_connection, demo_db):
+    generator = AnnualBalanceByCategory()
+    report = generator.generate_report(db_connection)
+
+    header, *rows = report.table
+    assert list(header) == ['Currency', 'Category/Year', '2017', '2018']
+    assert rows == [('currency1', '<other>', -10.0, -15.0),
+                    ('currency1', 'expense_cat1', 0.0, -1.1),
+                    ('currency2', 'expense_cat1', 0.0, -7.0)]
+
+
+def test_abc_approx(db_connection, demo_db):
+    # Small strata are sampled whole: estimates are exact
+    report = AnnualBalanceByCategory(approx=True).generate_report(
+        db_connection)
+    assert 'approximate' in report.name
+
+    header, *rows = report.table
+    assert list(header) == ['Currency', 'Category/Year', '2017', '2018']
+    assert rows[0] == ('currency1', '<other>',
+                       Estimate(-10.0, 0.0), Estimate(-15.0, 0.0))
+
+
+def test_abc_generated_again(db_connection, demo_db):
+    # Statements are cached, results are not
+    generator = AnnualBalanceByCategory(currency='currency2')
+    generator.generate_report(db_connection)
+    db_connection.execute(db.split.insert(), {
+        'txn_id': 3, 'amount': -3.0, 'category_id': 1, 'memo': None})
+
+    report = AnnualBalanceByCategory(currency='currency2').generate_report(
+        db_connection)
+    assert list(report.table)[1] == ('expense_cat1', -10.0)
+
+
+def test_abc_not_refreshed(db_connection, demo_db):
+    # top_category_id is not derived yet: parent_id is used
+    db_connection.execute(db.category.insert(), {
+        'id': 2, 'name': 'expense_subcat', 'income': False, 'parent_id': 1})
+    db_connection.execute(db.split.insert(), {
+        'txn_id': 3, 'amount': -3.0, 'category_id': 2, 'memo': None})
+
+    report = AnnualBalanceByCategory(currency='currency2').generate_report(
+        db_connection)
+    assert list(report.table)[1] == ('expense_cat1', -10.0)
+
+
+def test_abc_single_currency(db_connection, demo_db):
+    generator = AnnualBalanceByCategory(currency='currency2')
+    report = generator.generate_report(db_connection)
+
+    assert list(report.table) == [('Category/Year', '2018'),
+                                  ('expense_cat1', -7.0)]
+
+
+def test_abc_to_year(db_connection, demo_db):
+    generator = AnnualBalanceByCategory(to_year=2017)
+    report = generator.generate_report(db_connection)
+
+    assert list(report.table) == [
+        ('Currency', 'Category/Year', '2017'),
+        ('currency1', '<other>', -10.0)]
+
+
+def test_abc_filter(db_connection, demo_db):
+    report_filter = ReportFilter(from_date=datetime.date(2018, 1, 1),
+                                 to_date=datetime.date(2018, 1, 31),
+                                 categories=['expense_cat1'])
+    generator = AnnualBalanceByCategory(report_filter=report_filter)
+    report = generator.generate_report(db_connection)
+
+    assert list(report.table) == [
+        ('Currency', 'Category/Year', '2018'),
+        ('currency1', 'expense_cat1', -1.1)]
+
+
+# Balance by dimensions report tests
+
+
+def test_pivot_category_by_year(db_connection, demo_db):
+    """Same numbers as ABC plus totals."""
+    report = BalanceByDimensions(currency='currency1').generate_report(
+        db_connection)
+    assert isinstance(report.name, str)
+    assert isinstance(report.description, str)
+
+    header, *rows = report.table
+    assert list(header) == ['Category/Year', '2017', '2018', 'Total']
+    assert rows[:2] == [('<other>', -10.0, -15.0, -25.0),
+                        ('expense_cat1', 0.0, -1.1, -1.1)]
+    assert rows[2][0] == 'Total'
+    assert [round(value, 2) for value in rows[2][1:]] == [-10.0, -16.1, -26.1]
+
+
+def test_pivot_account_by_quarter(db_connection, demo_db):
+    report = BalanceByDimensions(rows='account', columns='quarter')
+    header, *rows = report.generate_report(db_connection).table
+
+    assert list(header) == ['Currency', 'Account/Quarter',
+                            '2017-Q1', '2018-Q1', 'Total']
+    assert rows[0] == ('currency1', 'account1', -10.0, -16.1, -26.1)
+    assert rows[-1] == ('currency2', 'Total', 0.0, -7.0, -7.0)
+
+
+def test_pivot_payee_by_month(db_connection, demo_db):
+    report = BalanceByDimensions(rows='payee', columns='month',
+                                 currency='currency2')
+    assert list(report.generate_report(db_connection).table) == [
+        ('Payee/Month', '2018-02', 'Total'),
+        ('<none>', -7.0, -7.0),
+        ('Total', -7.0, -7.0)]
+
+
+@pytest.mark.parametrize('rows, columns', [
+    ('week', 'year'),
+    ('year', 'year'),
+])
+def test_pivot_bad_dimensions(rows, columns):
+    with pytest.raises(ValueError):
+        BalanceByDimensions(rows=rows, columns=columns)
+
+
+# Balance over time report tests
+
+
+def test_bot_empty_db(db_connection):
+    report = BalanceOverTime().generate_report(db_connection)
+    assert isinstance(report.name, str)
+    assert isinstance(report.description, str)
+    assert not report.table
+
+
+def test_bot_basic(db_connection, demo_db):
+    report = BalanceOverTime(currency='currency1').generate_report(
+        db_connection)
+
+    header, *rows = report.table
+    assert list(header) == ['Month', 'account1', 'account2',
+                            'Net worth, currency1']
+    assert len(rows) == 13, 'every month expected'
+    assert rows[0] == ('2017-01', -10.0, 0.0, -10.0)
+    assert rows[1] == ('2017-02', -10.0, 0.0, -10.0)
+    assert rows[-1][0] == '2018-01'
+    assert round(rows[-1][1], 2) == -26.1
+
+
+def test_bot_filter(db_connection, demo_db):
+    report_filter = ReportFilter(from_date=datetime.date(2017, 6, 15),
+                                 to_date=datetime.date(2017, 8, 1),
+                                 accounts=['account1'])
+    report = BalanceOverTime(report_filter=report_filter).generate_report(
+        db_connection)
+
+    assert list(report.table) == [
+        ('Month', 'account1', 'Net worth, currency1'),
+        ('2017-06', -10.0, -10.0),
+        ('2017-07', -10.0, -10.0),
+        ('2017-08', -10.0, -10.0)]
+
+
+def test_bot_unsupported_filter():
+    with pytest.raises(ValueError, match='tags'):
+        BalanceOverTime(report_filter=ReportFilter(tags=['tag1']))
+
+
+# Balance by tag report tests
+
+
+def test_bbt_by_year(db_connection, demo_db):
+    report = BalanceByTag(currency='currency1').generate_report(
+        db_connection)
+    assert isinstance(report.name, str)
+    assert isinstance(report.description, str)
+
+    header, *rows = report.table
+    assert list(header) == ['Tag/Year', '2017', '2018']
+    assert rows == [('tag1', -10.0, -16.1),
+                    ('tag2', 0.0, -16.1)]
+
+
+def test_bbt_by_month(db_connection, demo_db):
+    report = BalanceByTag(period='month').generate_report(db_connection)
+
+    header, *rows = report.table
+    assert list(header) == ['Currency', 'Tag/Month', '2017-01', '2018-01']
+    assert len(rows) == 2
+
+
+def test_bbt_approx(db_connection, demo_db):
+    report = BalanceByTag(currency='currency1', approx=True).generate_report(
+        db_connection)
+
+    header, *rows = report.table
+    assert rows == [('tag1', Estimate(-10.0, 0.0), Estimate(-16.1, 0.0)),
+                    ('tag2', 0.0, Estimate(-16.1, 0.0))]
+
+
+def test_bbt_unknown_period():
+    with pytest.raises(ValueError):
+        BalanceByTag(period='week')
+
+
+def test_bbt_filter_tags(db_connection, demo_db):
+    report_filter = ReportFilter(tags=['tag2'])
+    report = BalanceByTag(report_filter=report_filter).generate_report(
+        db_connection)
+
+    assert list(report.table) == [
+        ('Currency', 'Tag/Year', '2018'),
+        ('currency1', 'tag2', -16.1)]
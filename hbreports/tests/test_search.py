@@ -0,0 +1,62 @@
+import pytest
+
+from hbreports import db
+from hbreports.derived import refresh
+from hbreports.search import SearchError, TxnSearch
+
+
+def _search(dbc, query, **kwargs):
+    report = TxnSearch(query, **kwargs).generate_report(dbc)
+    return list(report.table)[1:]
+
+
+def test_search_memo(std_db, db_connection):
+    rows = _search(db_connection, 'full')
+    assert [row[4] for row in rows] == ['full memo']
+
+
+def test_search_split_memo(std_db, db_connection):
+    rows = _search(db_connection, '"split memo"')
+    assert len(rows) == 1
+    assert rows[0][3] == -3.0
+
+
+def test_search_payee_and_info(std_db, db_connection):
+    assert len(_search(db_connection, 'payee1')) == 1
+    assert len(_search(db_connection, 'info: info')) == 1
+
+
+def test_search_ranking(std_db, db_connection):
+    rows = _search(db_connection, 'split OR memo')
+    # split transaction matches both terms in several columns
+    assert rows[0][4] == 'split transaction'
+
+
+def test_search_pagination(std_db, db_connection):
+    all_rows = _search(db_connection, 'split OR memo')
+    assert len(all_rows) == 2
+    assert _search(db_connection, 'split OR memo', limit=1) == all_rows[:1]
+    assert _search(db_connection, 'split OR memo',
+                   limit=1, offset=1) == all_rows[1:]
+
+
+def test_search_nothing_found(std_db, db_connection):
+    report = TxnSearch('nothing').generate_report(db_connection)
+    assert not report.table
+
+
+def test_search_invalid_query(std_db, db_connection):
+    with pytest.raises(SearchError, match='query'):
+        _search(db_connection, '"unterminated')
+
+
+def test_search_no_index(db_connection):
+    with pytest.raises(SearchError, match='index'):
+        _search(db_connection, 'memo')
+
+
+def test_search_index_refreshed(std_db, db_connection):
+    db_connection.execute(db.txn.update().values(memo='updated'))
+    refresh(db_connection)
+    assert _search(db_connection, 'full') == []
+    assert len(_search(db_connection, 'updated')) == 6
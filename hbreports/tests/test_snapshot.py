@@ -0,0 +1,53 @@
+import pytest
+
+from hbreports.snapshot import (
+    NULL_ID,
+    Snapshot,
+    SnapshotError,
+    write_snapshot,
+)
+
+
+@pytest.fixture
+def snapshot_path(tmp_path, std_db):
+    path = str(tmp_path / 'test.snap')
+    write_snapshot(std_db, path)
+    return path
+
+
+def test_snapshot_columns(snapshot_path):
+    with Snapshot(snapshot_path) as snapshot:
+        assert snapshot.length('txn') == 6
+        assert snapshot.length('split') == 8
+        assert list(snapshot.column('txn', 'date'))[:2] == [737060, 737061]
+        assert list(snapshot.column('txn', 'payee_id'))[:2] == [NULL_ID, 1]
+        amounts = snapshot.column('split', 'amount')
+        assert round(sum(amounts), 2) == -19.33
+        del amounts
+
+
+def test_snapshot_strings(snapshot_path):
+    with Snapshot(snapshot_path) as snapshot:
+        names = [snapshot.string(index)
+                 for index in snapshot.column('currency', 'name')]
+        assert names == ['Russian Ruble', 'Euro']
+        assert snapshot.string(NULL_ID) is None
+
+
+def test_snapshot_not_snapshot(tmp_path):
+    path = tmp_path / 'test.snap'
+    path.write_bytes(b'')
+    with pytest.raises(SnapshotError):
+        Snapshot(str(path))
+    path.write_bytes(b'garbage' * 10)
+    with pytest.raises(SnapshotError):
+        Snapshot(str(path))
+
+
+def test_snapshot_truncated(snapshot_path):
+    with open(snapshot_path, 'rb') as f:
+        data = f.read()
+    with open(snapshot_path, 'wb') as f:
+        f.write(data[:len(data) // 2])
+    with pytest.raises(SnapshotError, match='truncated'):
+        Snapshot(snapshot_path)
@@ -0,0 +1,31 @@
+from sqlalchemy.sql import select
+
+from hbreports import db, statements
+
+
+def test_compiled_once(db_connection, monkeypatch):
+    statement = db.currency.insert()
+    compiled = []
+    original_compile = statement.compile
+
+    def compile(*args, **kwargs):
+        compiled.append(kwargs['column_keys'])
+        return original_compile(*args, **kwargs)
+
+    monkeypatch.setattr(statement, 'compile', compile)
+    result = statements.execute(db_connection, statement, {'name': 'c1'})
+    assert result.inserted_primary_key == [1]
+    statements.execute(db_connection, statement, {'name': 'c2'})
+    statements.execute(db_connection, statement, {'id': 10, 'name': 'c3'})
+    assert compiled == [['name'], ['id', 'name']]
+
+    rows = db_connection.execute(select([db.currency])).fetchall()
+    assert rows == [(1, 'c1'), (2, 'c2'), (10, 'c3')]
+
+
+def test_executemany(db_connection):
+    statements.execute(db_connection, db.currency.insert(),
+                       [{'name': 'c1'}, {'name': 'c2'}])
+    rows = statements.execute(
+        db_connection, select([db.currency.c.id])).fetchall()
+    assert len(rows) == 2
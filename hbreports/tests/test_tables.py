@@ -1,6 +1,6 @@
 import pytest
 
-from hbreports.tables import FreeTableBuilder, Table
+from hbreports.tables import FreeTableBuilder, Table, merge_rows
 
 
 def test_table_empty():
@@ -108,3 +108,27 @@ def test_free_builder_default_value():
     table = builder.table
     rows = [list(row) for row in table]
     assert rows[1][2] == default_value
+
+
+def test_free_builder_multiple_row_labels():
+    builder = FreeTableBuilder(corner_label=('l1', 'l2'))
+    builder.set_cell(('r1', 'a'), 'c1', 1)
+    builder.set_cell(('r1', 'b'), 'c1', 2)
+    table = builder.table
+    rows = [list(row) for row in table]
+    assert rows == [['l1', 'l2', 'c1'],
+                    ['r1', 'a', 1],
+                    ['r1', 'b', 2]]
+
+
+def test_merge_rows():
+    partials = [
+        [('a', 'x', 1, 10.0), ('b', 'x', 2, 20.0)],
+        [],
+        [('b', 'x', 3, 30.0), ('a', 'y', 4, 40.0)],
+    ]
+    assert merge_rows(partials, 2) == [
+        ('a', 'x', 1, 10.0),
+        ('b', 'x', 5, 50.0),
+        ('a', 'y', 4, 40.0),
+    ]
@@ -0,0 +1,58 @@
+import os
+import threading
+import time
+
+import pytest
+
+from hbreports.watch import FileWatcher
+
+
+@pytest.fixture(params=[True, False], ids=['inotify', 'polling'])
+def use_inotify(request):
+    return request.param
+
+
+def _rewrite_later(path, delay, text):
+    def rewrite():
+        time.sleep(delay)
+        # HomeBank-like save: write new file and rename it
+        tmp_path = str(path) + '.new'
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    thread = threading.Thread(target=rewrite)
+    thread.start()
+    return thread
+
+
+def test_watcher_timeout(tmp_path, use_inotify):
+    path = tmp_path / 'test.xhb'
+    path.write_text('1')
+    with FileWatcher(str(path), interval=0.05, settle_time=0.05,
+                     use_inotify=use_inotify) as watcher:
+        assert watcher.wait_for_change(timeout=0.2) is False
+
+
+def test_watcher_change(tmp_path, use_inotify):
+    path = tmp_path / 'test.xhb'
+    path.write_text('1')
+    with FileWatcher(str(path), interval=0.05, settle_time=0.05,
+                     use_inotify=use_inotify) as watcher:
+        thread = _rewrite_later(path, 0.1, '22')
+        assert watcher.wait_for_change(timeout=5) is True
+        thread.join()
+        # the same change shouldn't be reported twice
+        assert watcher.wait_for_change(timeout=0.2) is False
+
+
+def test_watcher_debounce(tmp_path):
+    """Burst of writes is reported as a single change."""
+    path = tmp_path / 'test.xhb'
+    path.write_text('1')
+    with FileWatcher(str(path), interval=0.05, settle_time=0.3) as watcher:
+        threads = [_rewrite_later(path, delay, 'x' * (i + 2))
+                   for i, delay in enumerate((0.05, 0.1, 0.15))]
+        assert watcher.wait_for_change(timeout=5) is True
+        for thread in threads:
+            thread.join()
+        assert watcher.wait_for_change(timeout=0.5) is False
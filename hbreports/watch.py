@@ -0,0 +1,179 @@
+"""Watching HomeBank files for changes.
+
+HomeBank doesn't update a file in place. It writes a backup and a new
+file and renames them, so a single save produces a burst of file
+system events. The watcher waits until the file stays the same for a
+while (debouncing) and reports one change per save.
+
+inotify is used on Linux to wake up as soon as something happens in
+the file directory. Polling is used everywhere else.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import time
+
+
+# inotify event masks (see inotify(7))
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+
+_INOTIFY_MASK = (_IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO
+                 | _IN_CREATE | _IN_DELETE)
+
+
+class FileWatcher:
+    """Watcher for a single file.
+
+    :param str path: path to watched file
+    :param float interval: polling interval (seconds)
+    :param float settle_time: file must stay unchanged for this time
+        (seconds) before change is reported
+    :param bool use_inotify: try to use inotify
+    """
+
+    def __init__(self, path, interval=1.0, settle_time=1.0,
+                 use_inotify=True):
+        self._path = path
+        self._interval = interval
+        self._settle_time = settle_time
+        self._signature = _file_signature(path)
+        self._notifier = None
+        if use_inotify:
+            self._notifier = _InotifyNotifier.create(path)
+        if self._notifier is None:
+            self._notifier = _PollingNotifier()
+
+    @property
+    def uses_inotify(self):
+        return isinstance(self._notifier, _InotifyNotifier)
+
+    def wait_for_change(self, timeout=None):
+        """Wait until the file is changed and settled.
+
+        :param float timeout: maximum time to wait (seconds) or None
+            to wait forever
+        :returns: True if file was changed, False on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            self._notifier.wait(self._wait_time(deadline))
+            signature = _file_signature(self._path)
+            if signature is not None and signature != self._signature:
+                signature = self._wait_settled(signature)
+                if signature is not None:
+                    self._signature = signature
+                    return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+
+    def close(self):
+        self._notifier.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _wait_time(self, deadline):
+        if deadline is None:
+            return self._interval
+        return max(0.0, min(self._interval, deadline - time.monotonic()))
+
+    def _wait_settled(self, signature):
+        """Wait until file stops changing.
+
+        :returns: final signature or None if file disappeared
+        """
+        while True:
+            time.sleep(self._settle_time)
+            self._notifier.drain()
+            new_signature = _file_signature(self._path)
+            if new_signature == signature:
+                return signature
+            signature = new_signature
+
+
+def _file_signature(path):
+    """Get file state used to detect changes.
+
+    :returns: tuple or None if file doesn't exist
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+class _PollingNotifier:
+    """Notifier that never wakes up early."""
+
+    def wait(self, timeout):
+        time.sleep(timeout)
+
+    def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _InotifyNotifier:
+    """inotify-based notifier.
+
+    Watches the whole directory, because HomeBank replaces the file on
+    save. Events for other files just cause an extra check.
+    """
+
+    def __init__(self, fd):
+        self._fd = fd
+
+    @classmethod
+    def create(cls, path):
+        """Create notifier.
+
+        :returns: notifier or None if inotify is not available
+        """
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            return None
+        try:
+            libc = ctypes.CDLL(libc_name, use_errno=True)
+            inotify_init1 = libc.inotify_init1
+            inotify_add_watch = libc.inotify_add_watch
+        except (OSError, AttributeError):
+            return None
+
+        fd = inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return None
+        directory = os.path.dirname(os.path.abspath(path))
+        if inotify_add_watch(fd, os.fsencode(directory), _INOTIFY_MASK) < 0:
+            os.close(fd)
+            return None
+        return cls(fd)
+
+    def wait(self, timeout):
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if ready:
+            self.drain()
+
+    def drain(self):
+        """Discard pending events."""
+        try:
+            while os.read(self._fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None